@@ -0,0 +1,88 @@
+"""
+Compares decoding of base64 data URIs:
+
+- `parse`: the regular expression parser, as previously used by `URLFetchHandler` (with padding).
+- `decode`: the header-only parser with a direct base64 decode.
+- `fetch`: `URLFetchHandler` fetching the same URI `--references` times, decoded once per request.
+- `repeat`: the repeated references alone, fetched from a handler that already decoded the URI.
+- `digest`: a SHA-256 digest of the URI per reference, as the memo was previously keyed.
+
+Usage: python benchmarks/bench_data_uri.py [--size 2097152] [--references 20] [--repeat 5] [--output results.json]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import time
+import tracemalloc
+
+from pdf_service.URLFetchHandler import URLFetchHandler
+from pdf_service.data_uri import decode, parse
+
+
+def parse_padded(uri: str) -> bytes:
+    missing_padding = len(uri) % 4
+    uri_padded = uri if missing_padding == 0 else uri + ("=" * missing_padding)
+    return parse(uri_padded)[4]
+
+
+def measure(function, repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'seconds': min(durations), 'peak_bytes': peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2 * 1024 * 1024, help='Size of the decoded data in bytes')
+    parser.add_argument('--references', type=int, default=20, help='References to the same URI per document')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    uri = 'data:image/png;base64,' + base64.b64encode(os.urandom(args.size)).decode('ascii')
+    assert parse_padded(uri) == decode(uri).data
+
+    def fetch():
+        url_fetcher = URLFetchHandler()
+        for _ in range(args.references):
+            url_fetcher(uri)['file_obj'].read()
+
+    decoded_fetcher = URLFetchHandler()
+    decoded_fetcher(uri)
+
+    def repeat():
+        for _ in range(args.references):
+            decoded_fetcher(uri)['file_obj'].read()
+
+    results = {
+        'size': args.size,
+        'references': args.references,
+        'parse': measure(lambda: [parse_padded(uri) for _ in range(args.references)], args.repeat),
+        'decode': measure(lambda: [decode(uri) for _ in range(args.references)], args.repeat),
+        'fetch': measure(fetch, args.repeat),
+        'repeat': measure(repeat, args.repeat),
+        'digest': measure(lambda: [hashlib.sha256(uri.encode('utf-8')).digest() for _ in range(args.references)],
+                          args.repeat),
+    }
+
+    for name in ('parse', 'decode', 'fetch', 'repeat', 'digest'):
+        print(f"{name:>8}: {results[name]['seconds']:8.3f} s  {results[name]['peak_bytes'] / 1024 / 1024:8.1f} MiB peak")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
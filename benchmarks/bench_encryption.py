@@ -0,0 +1,82 @@
+"""
+Compares encrypting one PDF for many recipients:
+
+- `per-request`: a pypdf parse, page copy and write per recipient, like one `/encrypt` call each.
+- `pypdf`: a single pypdf parse and page copy, then a write per recipient (`/encrypt/batch`).
+- `pymupdf`: a single PyMuPDF parse, then a write per recipient (`/encrypt/batch?backend=pymupdf`).
+
+Usage: python benchmarks/bench_encryption.py [--pages 300] [--recipients 20] [--repeat 3] [--output results.json]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import fitz
+
+from pdf_service.encryption import Recipient, encrypt_copies
+from pdf_service.postprocess import postprocess
+
+
+def long_document(pages: int) -> bytes:
+    document = fitz.open()
+    text = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 2
+    for number in range(pages):
+        page = document.new_page()
+        page.insert_text((72, 72), f'Page {number + 1}', fontsize=24)
+        for line in range(40):
+            page.insert_text((72, 110 + line * 16), text[:90], fontsize=10)
+    return document.tobytes(deflate=True)
+
+
+def per_request(pdf: bytes, recipients):
+    for recipient in recipients:
+        postprocess(pdf, password=recipient.password)
+
+
+def fan_out(backend: str):
+    def encrypt(pdf: bytes, recipients):
+        for _ in encrypt_copies(pdf, recipients, backend):
+            pass
+    return encrypt
+
+
+def measure(function, pdf: bytes, recipients, repeat: int) -> dict:
+    durations = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function(pdf, recipients)
+        durations.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {'seconds': min(durations), 'peak_bytes': peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--recipients', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    pdf = long_document(args.pages)
+    recipients = [Recipient(f'recipient-{number}', f'password-{number}') for number in range(args.recipients)]
+    modes = {'per-request': per_request, 'pypdf': fan_out('pypdf'), 'pymupdf': fan_out('pymupdf')}
+    results = {'pages': args.pages, 'recipients': args.recipients, 'pdf_bytes': len(pdf)}
+    for name, function in modes.items():
+        results[name] = measure(function, pdf, recipients, args.repeat)
+
+    for name in modes:
+        print(f"{name:>11}: {results[name]['seconds']:8.3f} s  {results[name]['peak_bytes'] / 1024 / 1024:8.1f} MiB peak")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
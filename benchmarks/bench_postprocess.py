@@ -0,0 +1,72 @@
+"""
+Compares post-processing of a generated PDF, rotation followed by encryption:
+
+- `separate`: `write_pdf`, then a pypdf pass for the rotation and another one for the encryption.
+- `single`: rotation with a `write_pdf` finisher, then a single pypdf pass for the encryption.
+
+Usage: python benchmarks/bench_postprocess.py [--pages 300] [--repeat 3] [--output results.json]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from weasyprint import HTML
+
+from pdf_service.postprocess import postprocess, rotation_finisher
+
+
+def long_document(pages: int) -> str:
+    page = '<h1>Page {0}</h1>' + '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>' * 30
+    return ''.join(page.format(i) + '<div style="break-after: page"></div>' for i in range(pages))
+
+
+def separate(document) -> bytes:
+    pdf = document.write_pdf()
+    pdf = postprocess(pdf, rotation=90)
+    return postprocess(pdf, password='password')
+
+
+def single(document) -> bytes:
+    pdf = document.write_pdf(finisher=rotation_finisher(90))
+    return postprocess(pdf, password='password')
+
+
+def measure(function, document, repeat: int) -> dict:
+    durations = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function(document)
+        durations.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {'seconds': min(durations), 'peak_bytes': peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    document = HTML(string=long_document(args.pages)).render()
+    results = {
+        'pages': len(document.pages),
+        'separate': measure(separate, document, args.repeat),
+        'single': measure(single, document, args.repeat),
+    }
+
+    for name in ('separate', 'single'):
+        print(f"{name:>8}: {results[name]['seconds']:8.3f} s  {results[name]['peak_bytes'] / 1024 / 1024:8.1f} MiB peak")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
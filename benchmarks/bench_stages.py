@@ -0,0 +1,273 @@
+"""
+Measures the latency and the peak memory of every stage of `/generate` (`parse`, `render`,
+`write-pdf`, `rotate`, `encrypt` and the whole request) for the `e2e/data` corpus and generated
+large documents, and of `/encrypt` and `/form-fields` for a generated form.
+
+The latency is the best of `--repeat` runs. The peak memory is measured in an extra run with
+tracemalloc, it covers Python allocations only, not the native ones of cairo, pango or MuPDF.
+
+Usage: python benchmarks/bench_stages.py [--repeat 3] [--output results.json]
+                                         [--compare baseline.json] [--tolerance 0.2]
+
+With `--compare` the results are compared with those of an earlier run, the script exits with
+status 1 if any stage got slower or uses more memory than `--tolerance` allows.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import fitz
+import pypdf
+import weasyprint
+from weasyprint import HTML
+from weasyprint.css.counters import CounterStyle
+from werkzeug.datastructures import FileStorage, MultiDict
+
+from pdf_service import pdf_service
+from pdf_service.URLFetchHandler import URLFetchHandler
+from pdf_service.fonts import DocumentFontConfiguration
+from pdf_service.postprocess import postprocess
+from pdf_service.stylesheets import style_profile
+
+ROOT = Path(__file__).parent.parent
+E2E_DATA = ROOT / 'e2e' / 'data'
+TEST_PNG = ROOT / 'test-data' / 'assets' / 'test.png'
+
+
+class Document(NamedTuple):
+    name: str
+    html: bytes
+    # Asset name -> content
+    assets: Dict[str, bytes]
+
+    def files(self) -> MultiDict:
+        """
+        Fresh uploads of the assets, rendering closes the ones it fetched.
+        """
+        return MultiDict([
+            (name, FileStorage(BytesIO(data), name, content_type='image/png' if name.endswith('.png') else None))
+            for name, data in self.assets.items()
+        ])
+
+    def form_data(self) -> dict:
+        data = {'index.html': (BytesIO(self.html), 'index.html', 'text/html')}
+        for name, content in self.assets.items():
+            data[name] = (BytesIO(content), name)
+        return data
+
+
+def e2e_documents() -> List[Document]:
+    documents = []
+    for path in sorted(E2E_DATA.iterdir()):
+        if not (path / 'index.html').is_file():
+            continue
+        assets = {asset.name: asset.read_bytes() for asset in sorted(path.glob('assets/*'))}
+        documents.append(Document(path.name, (path / 'index.html').read_bytes(), assets))
+    return documents
+
+
+def long_table(rows: int) -> Document:
+    cells = ''.join(f'<td>Cell {column}</td>' for column in range(6))
+    html = (
+        '<table><thead><tr>' + ''.join(f'<th>Column {column}</th>' for column in range(6)) + '</tr></thead><tbody>' +
+        ''.join(f'<tr><td>{row}</td>{cells}</tr>' for row in range(rows)) +
+        '</tbody></table>'
+    )
+    return Document(f'long-table-{rows}', html.encode('utf-8'), {})
+
+
+def many_images(images: int) -> Document:
+    png = TEST_PNG.read_bytes()
+    html = ''.join(f'<img src="image-{i}.png" style="width: 3cm"/>' for i in range(images))
+    return Document(f'many-images-{images}', html.encode('utf-8'), {f'image-{i}.png': png for i in range(images)})
+
+
+def many_pages(pages: int) -> Document:
+    page = '<h1>Page {0}</h1>' + '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>' * 30
+    html = ''.join(page.format(i) + '<div style="break-after: page"></div>' for i in range(pages))
+    return Document(f'many-pages-{pages}', html.encode('utf-8'), {})
+
+
+def form_pdf(pages: int, fields_per_page: int) -> bytes:
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        for i in range(fields_per_page):
+            widget = fitz.Widget()
+            widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+            widget.field_name = f'field-{page_number}-{i}'
+            widget.rect = fitz.Rect(50, 50 + i * 25, 300, 70 + i * 25)
+            page.add_widget(widget)
+    return document.tobytes()
+
+
+def measure(function: Callable, repeat: int, setup: Optional[Callable] = None) -> dict:
+    """
+    Time `function` called with the result of `setup` (not measured), then trace its allocations.
+    """
+    durations = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': min(durations), 'median_seconds': statistics.median(durations), 'peak_bytes': peak}
+
+
+def bench_document(document: Document, repeat: int) -> dict:
+    profile = style_profile()
+
+    def parse() -> HTML:
+        url_fetcher = URLFetchHandler(document.files())
+        return HTML(file_obj=BytesIO(document.html), base_url='/', url_fetcher=url_fetcher, encoding='UTF-8')
+
+    def render(html: HTML):
+        font_config = DocumentFontConfiguration()
+        counter_style = CounterStyle()
+        for sheet in profile.stylesheets:
+            sheet.register(font_config, counter_style, weasyprint.default_url_fetcher)
+        return html.render(
+            presentational_hints=True,
+            stylesheets=[sheet.css for sheet in profile.stylesheets],
+            font_config=font_config,
+            counter_style=counter_style,
+        )
+
+    rendered = render(parse())
+    pdf = rendered.write_pdf()
+    client = pdf_service.test_client()
+
+    def generate():
+        if document.assets:
+            rv = client.post('/generate', data=document.form_data())
+        else:
+            rv = client.post('/generate', data=document.html, content_type='text/html')
+        assert rv.status_code == 200, rv.data
+
+    return {
+        'html_bytes': len(document.html) + sum(len(asset) for asset in document.assets.values()),
+        'pdf_bytes': len(pdf),
+        'pages': len(rendered.pages),
+        'stages': {
+            'parse': measure(parse, repeat),
+            'render': measure(render, repeat, setup=lambda: (parse(),)),
+            'write-pdf': measure(rendered.write_pdf, repeat),
+            'rotate': measure(lambda: postprocess(pdf, rotation=90), repeat),
+            'encrypt': measure(lambda: postprocess(pdf, password='password'), repeat),
+            'generate': measure(generate, repeat),
+        },
+    }
+
+
+def bench_form(pages: int, fields_per_page: int, repeat: int) -> dict:
+    pdf = form_pdf(pages, fields_per_page)
+    values = {f'field-{page}-{i}': f'Value {page}.{i}' for page in range(pages) for i in range(fields_per_page)}
+    client = pdf_service.test_client()
+
+    def request(method: str, url: str, **kwargs):
+        rv = client.open(url, method=method, **kwargs)
+        assert rv.status_code == 200, rv.data
+
+    def set_fields():
+        request('POST', '/form-fields', data={'pdf': (BytesIO(pdf), 'form.pdf'), **values})
+
+    return {
+        'pdf_bytes': len(pdf),
+        'pages': pages,
+        'fields': len(values),
+        'stages': {
+            'encrypt': measure(lambda: request('POST', '/encrypt', data=pdf, query_string={'password': 'password'}), repeat),
+            'get_fields': measure(lambda: request('PUT', '/form-fields', data=pdf), repeat),
+            'set_fields': measure(set_fields, repeat),
+        },
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    :return: Stages that regressed against `baseline` by more than `tolerance`
+    """
+    regressions = []
+    for group in ('documents', 'forms'):
+        for name, result in results[group].items():
+            for stage, current in result['stages'].items():
+                previous = baseline.get(group, {}).get(name, {}).get('stages', {}).get(stage)
+                if previous is None:
+                    continue
+                for metric in ('seconds', 'peak_bytes'):
+                    if previous[metric] and current[metric] / previous[metric] > 1 + tolerance:
+                        regressions.append(
+                            f'{name} {stage} {metric}: {previous[metric]:.4g} -> {current[metric]:.4g} '
+                            f'({current[metric] / previous[metric] - 1:+.0%})'
+                        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=5000, help='Rows of the long table')
+    parser.add_argument('--images', type=int, default=200, help='Images of the many images document')
+    parser.add_argument('--pages', type=int, default=300, help='Pages of the many pages document')
+    parser.add_argument('--form-pages', type=int, default=20)
+    parser.add_argument('--fields-per-page', type=int, default=25)
+    parser.add_argument('--output')
+    parser.add_argument('--compare', help='Results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    documents = e2e_documents() + [long_table(args.rows), many_images(args.images), many_pages(args.pages)]
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'weasyprint': weasyprint.__version__,
+            'pypdf': pypdf.__version__,
+            'pymupdf': fitz.VersionBind,
+        },
+        'documents': {},
+        'forms': {},
+    }
+
+    for document in documents:
+        results['documents'][document.name] = bench_document(document, args.repeat)
+    form = f'form-{args.form_pages}x{args.fields_per_page}'
+    results['forms'][form] = bench_form(args.form_pages, args.fields_per_page, args.repeat)
+
+    for group in ('documents', 'forms'):
+        for name, result in results[group].items():
+            print(f"{name} ({result['pages']} pages, {result['pdf_bytes'] / 1024:.0f} KiB PDF)")
+            for stage, measured in result['stages'].items():
+                print(f"  {stage:>10}: {measured['seconds']:8.3f} s  {measured['peak_bytes'] / 1024 / 1024:8.1f} MiB peak")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('Regression:', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
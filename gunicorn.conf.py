@@ -0,0 +1,60 @@
+import gc
+import os
+import shutil
+import tempfile
+
+# Metrics of all workers are aggregated through files in this directory (see pdf_service/metrics.py).
+# It's emptied on start, metrics of a previous run must not be aggregated.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'pdf-service-metrics'))
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir)
+
+# Import the service in the master process and fork the workers from it, see "Startup" in README.md
+preload_app = os.environ.get('PRELOAD', 'true').lower() not in ('0', 'false', 'no')
+
+# With GATEWAY=true the workers run the asyncio front end, see "Gateway" in README.md
+if os.environ.get('GATEWAY', 'false').lower() in ('1', 'true', 'yes'):
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'pdf_service.gateway:app'
+else:
+    wsgi_app = 'pdf_service:pdf_service'
+
+if preload_app:
+    # Objects freed while importing would leave holes in pages the workers share
+    gc.disable()
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+
+    from pdf_service.warmup import warm_up
+    warm_up()
+
+    # Move everything loaded so far out of reach of the garbage collector. Collections in the
+    # workers would otherwise write to these objects and copy the memory they share with the master.
+    gc.freeze()
+    gc.enable()
+
+
+def post_worker_init(worker):
+    if worker.cfg.preload_app:
+        return
+
+    from pdf_service.warmup import warm_up
+    warm_up()
+
+
+def child_exit(server, worker):
+    # Drop the live gauges (renders in flight, ...) of the worker
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+# A thread for every render slot (MAX_CONCURRENT_RENDERS) and every place in the render queue
+# (RENDER_QUEUE_SIZE), and one more, so requests over the limit reach the queue and are answered
+# with 503 when it's full, instead of waiting in the listen backlog. Defaults as in
+# pdf_service/admission.py. More than one thread makes gunicorn use gthread workers.
+_render_slots = int(os.environ.get('MAX_CONCURRENT_RENDERS')
+                    or max(1, (os.cpu_count() or 1) // int(os.environ.get('WORKER_COUNT') or 1)))
+threads = int(os.environ.get('WORKER_THREADS') or _render_slots + int(os.environ.get('RENDER_QUEUE_SIZE') or 16) + 1)
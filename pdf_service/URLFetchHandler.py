@@ -1,15 +1,43 @@
 import io
-from typing import Optional
+from typing import Callable, Dict, Optional
 from urllib.error import HTTPError
 
 from werkzeug.datastructures import MultiDict
 from werkzeug.exceptions import BadRequest, Forbidden, HTTPException
 from sentry_sdk import add_breadcrumb
 from urllib.parse import urlparse, ParseResult
-from pdf_service.data_uri import parse as datauri_parse
+from pdf_service.data_uri import decode as datauri_decode
 import weasyprint
 
+from . import http_pool
+from .assets import ASSET_SCHEME, get_asset
+from .deadline import current_deadline
 from .errors import URLFetcherCalledAfterExitException
+from .images import image_format, mime_type, optimize_image
+from .metrics import URL_FETCHES, stage
+from .pdf_options import PdfOptions
+from .prefetch import PREFETCH_TIMEOUT, prefetch, prefetched
+from .url_cache import url_cache
+
+
+def read_url(url_fetcher: Callable, url: str) -> dict:
+    """
+    Fetch `url` with an url_fetcher and return the result with the body as `string`.
+
+    Unlike `weasyprint.urls.fetch`, which closes a returned `file_obj`, uploaded files are rewound,
+    so they can be fetched again.
+    """
+    result = dict(url_fetcher(url))
+    result.setdefault('redirected_url', url)
+    result.setdefault('mime_type', None)
+    if 'string' not in result:
+        file_obj = result.pop('file_obj')
+        result['string'] = file_obj.read()
+        if file_obj.seekable():
+            file_obj.seek(0)
+        else:
+            file_obj.close()
+    return result
 
 
 class URLFetchHandler:
@@ -31,17 +59,30 @@ class URLFetchHandler:
     >>>   doc = html.render()
     """
 
-    def __init__(self, files: Optional[MultiDict] = None, isAllowExternal: Optional[bool] = False):
+    def __init__(self, files: Optional[MultiDict] = None, isAllowExternal: Optional[bool] = False,
+                 pdf_options: Optional[PdfOptions] = None, assets: Optional[Dict[str, str]] = None):
         self.http_errors = []
         self.closed = False
         self.isAllowExternal = isAllowExternal
+        # With `optimize_images`, fetched images are downscaled to `dpi` and recompressed
+        self.pdf_options = pdf_options or PdfOptions()
         self.files = files
+        # Names of the multipart API mapped to stored assets, see `pdf_service.assets`
+        self.assets = assets or {}
+        self.cache_stats = {'hit': 0, 'revalidated': 0, 'miss': 0}
+        # Fetched ahead, e.g. by the gateway that received the request
+        self.prefetched = dict(prefetched())
+        # Data URI -> decoded data URI. Strings cache their hash, so a repeated URI isn't hashed again
+        self.data_uris = {}
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.closed = True
+        if exc_type is not None and not issubclass(exc_type, Exception):
+            # Interrupted (see `deadline.DeadlineExceeded`), fetch errors don't matter anymore
+            return
         if len(self.http_errors) == 1:
             raise self.http_errors[0]
         elif len(self.http_errors) > 1:
@@ -67,6 +108,23 @@ class URLFetchHandler:
                 self.http_errors.append(error)
             raise error
 
+    def prefetch(self, urls: list):
+        """
+        Fetch external `urls` concurrently before rendering, see :func:`pdf_service.prefetch.prefetch`.
+        Later fetches of these URLs are served from memory. URLs fetched already aren't fetched again.
+        """
+        urls = [url for url in urls if url not in self.prefetched]
+        if not self.isAllowExternal or not urls:
+            return
+
+        timeout = PREFETCH_TIMEOUT
+        deadline = current_deadline()
+        if deadline is not None:
+            timeout = min(timeout, deadline.remaining())
+
+        self.prefetched.update(prefetch(urls, self._fetch_external, timeout=timeout))
+        add_breadcrumb(message="Prefetched external URLs", data={'requested': len(urls), 'fetched': len(self.prefetched)})
+
     def _handle_fetch(self, url: str):
         """
         Handle the fetching of a single URL
@@ -76,21 +134,69 @@ class URLFetchHandler:
 
         :raise: :class:`werkzeug.exceptions.BadRequest`, if file wasn't found internally
         :raise: :class:`ForbiddenURLFetchError`, if file can't be fetched because it's not allowed
+        :raise: :class:`DeadlineExceeded`, if the deadline of the request passed
         """
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.check()
+
         if url.startswith("data:"):
-            return self._handle_data_fetch(url)
+            URL_FETCHES.labels('data').inc()
+            result = self._handle_data_fetch(url)
+        elif url.startswith(ASSET_SCHEME):
+            URL_FETCHES.labels('asset').inc()
+            result = self._handle_asset_fetch(url.removeprefix(ASSET_SCHEME))
+        else:
+            parsed = urlparse(url)
+            if not bool(parsed.netloc):
+                # No domain name -> internal fetch
+                URL_FETCHES.labels('internal').inc()
+                result = self._handle_internal_fetch(url, parsed)
+            else:
+                # External
+                URL_FETCHES.labels('external').inc()
+                result = self._handle_external_fetch(url, parsed)
 
-        parsed = urlparse(url)
-        if not bool(parsed.netloc):
-            # No domain name -> internal fetch
-            return self._handle_internal_fetch(url, parsed)
+        if self.pdf_options.optimize_images:
+            return self._optimize_image(result)
+        return result
+
+    def _optimize_image(self, result: dict) -> dict:
+        """
+        Replace a fetched JPEG or PNG image with its optimized version, see :func:`optimize_image`.
+        Uploaded files are rewound, so they can be fetched again.
+        """
+        if 'string' in result:
+            data = result['string']
+            if not isinstance(data, bytes) or image_format(data) is None:
+                return result
         else:
-            # External
-            return self._handle_external_fetch(url, parsed)
+            file_obj = result['file_obj']
+            if not file_obj.seekable():
+                return result
+            signature = file_obj.read(8)
+            file_obj.seek(0)
+            if image_format(signature) is None:
+                return result
+            data = file_obj.read()
+            file_obj.seek(0)
+
+        with stage('optimize-image'):
+            optimized = optimize_image(data, self.pdf_options.dpi, self.pdf_options.jpeg_quality)
+        if optimized is None:
+            return result
+
+        result = {key: value for key, value in result.items() if key != 'file_obj'}
+        result['string'] = optimized
+        result['mime_type'] = mime_type(optimized)
+        return result
 
     def _handle_internal_fetch(self, url: str, parsed: ParseResult):
         filename = parsed.path.removeprefix('/')
 
+        if filename in self.assets and (self.files is None or filename not in self.files):
+            return self._handle_asset_fetch(self.assets[filename])
+
         if self.files is None or len(self.files) == 0:
             raise BadRequest(
                 'Referenced local file (%s) in basic mode' % filename
@@ -110,22 +216,58 @@ class URLFetchHandler:
                 'mime_type': file.content_type
             }
 
+    def _handle_asset_fetch(self, asset_id: str):
+        asset = get_asset(asset_id)
+        if asset is None:
+            add_breadcrumb(message="Failed to fetch asset", data={'asset': asset_id})
+            raise BadRequest(
+                "Missing asset (%s), upload it to /assets" % asset_id
+            )
+
+        add_breadcrumb(message="Fetched asset", data={'asset': asset_id})
+        data, content_type = asset
+        return {
+            'string': data,
+            'mime_type': content_type
+        }
+
     def _handle_data_fetch(self, url: str):
-        missing_padding = len(url) % 4
-        url_padded = url if missing_padding == 0 else url + ("=" * missing_padding)
-        (mimetype, _, _, _, data) = datauri_parse(url_padded)
-        file = io.BytesIO(data)
+        # Identical data URIs, like a logo on every page, are decoded once per request
+        decoded = self.data_uris.get(url)
+        if decoded is None:
+            decoded = self.data_uris[url] = datauri_decode(url)
 
         return {
-            'file_obj': file,
-            'mime_type': mimetype,
+            'file_obj': io.BytesIO(decoded.data),
+            'mime_type': decoded.mimetype,
         }
 
     def _handle_external_fetch(self, url: str, parsed: ParseResult):
         if self.isAllowExternal:
-            return weasyprint.default_url_fetcher(url)
+            result = self.prefetched.get(url)
+            if result is not None:
+                return dict(result)
+
+            return self._fetch_external(url)
         else:
             add_breadcrumb(message="Refused to fetch URL", data={'url': url})
             raise Forbidden(
                 description="Attempted to fetch forbidden url (%r)" % url
             )
+
+    def _fetch_external(self, url: str, timeout: float = 10, budget: Optional[http_pool.ByteBudget] = None):
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.check()
+            timeout = min(timeout, deadline.remaining())
+
+        if url_cache is not None:
+            result, status = url_cache.fetch(url, timeout, budget)
+            self.cache_stats[status] += 1
+            add_breadcrumb(message="Fetched external URL", data={'url': url, 'cache': status})
+            return result
+
+        if url.startswith(('http://', 'https://')):
+            return http_pool.fetch(url, timeout, budget)
+
+        return weasyprint.default_url_fetcher(url)
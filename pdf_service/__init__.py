@@ -5,12 +5,26 @@ from sentry_sdk.integrations.flask import FlaskIntegration
 from sentry_sdk.integrations.logging import LoggingIntegration
 import os
 
+from .admission import admission_control, queue_status
+from .deadline import with_deadline
+from .metrics import instrument, metrics_response
+from .spool import SpooledRequest
 from .sentry_tags import apply_sentry_tags
 from .generate import generate
-from .encryption import encryptPdf
+from .batch import generate_batch
+from .jobs import submit_job, get_job
+from .templates import register_template, get_template, delete_template, generate_from_template
+from .encryption import encryptPdf, encrypt_batch
 from .fields import get_fields, set_fields
+from .form_fill import fill_bulk
+from .preview import preview
+from .assets import upload_assets, missing_assets
+from .warmup import ready, warm_up
 
 pdf_service = Flask(__name__)
+pdf_service.request_class = SpooledRequest
+# Larger requests are answered with 413
+pdf_service.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_REQUEST_BYTES') or 0) or None
 sentry_logging = LoggingIntegration(
     level=logging.DEBUG,        # Capture info and above as breadcrumbs
     event_level=logging.ERROR  # Send errors as events
@@ -25,28 +39,91 @@ init(
 )
 
 apply_sentry_tags()
+instrument(pdf_service)
 
 @pdf_service.route('/generate', methods=['POST'])
+@admission_control
+@with_deadline
 def generate_pdf():
     return generate()
 
+@pdf_service.route('/preview', methods=['POST'])
+@admission_control
+@with_deadline
+def preview_pages():
+    return preview()
+
+@pdf_service.route('/assets', methods=['POST'])
+def post_assets():
+    return upload_assets()
+
+@pdf_service.route('/assets/missing', methods=['POST'])
+def check_assets():
+    return missing_assets()
+
+@pdf_service.route('/generate/batch', methods=['POST'])
+@admission_control(streamed=True)
+def generate_pdf_batch():
+    return generate_batch()
+
+# No render slot: jobs are rendered by the render processes and limited by JOB_QUEUE_SIZE
+@pdf_service.route('/jobs', methods=['POST'])
+def create_job():
+    return submit_job()
+
+@pdf_service.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    return get_job(job_id)
+
+@pdf_service.route('/templates/<template_id>', methods=['PUT'])
+def put_template(template_id):
+    return register_template(template_id)
+
+@pdf_service.route('/templates/<template_id>', methods=['GET'])
+def describe_template(template_id):
+    return get_template(template_id)
+
+@pdf_service.route('/templates/<template_id>', methods=['DELETE'])
+def remove_template(template_id):
+    return delete_template(template_id)
+
+@pdf_service.route('/templates/<template_id>/render', methods=['POST'])
+@admission_control
+@with_deadline
+def render_template_pdf(template_id):
+    return generate_from_template(template_id)
+
 @pdf_service.route('/encrypt', methods=['POST'])
+@admission_control
 def encrypt_pdf():
     return encryptPdf()
 
+@pdf_service.route('/encrypt/batch', methods=['POST'])
+@admission_control(streamed=True)
+def encrypt_pdf_batch():
+    return encrypt_batch()
+
 @pdf_service.route('/form-fields', methods=['GET'])
+@admission_control
 def get_form_fields():
     return get_fields()
 
 #.net 4.8 does not support GET with body. Use PUT as a workaround
 @pdf_service.route('/form-fields', methods=['PUT'])
+@admission_control
 def get_form_fields2():
     return get_fields()
 
 @pdf_service.route('/form-fields', methods=['POST'])
+@admission_control
 def set_form_fields():
     return set_fields()
 
+@pdf_service.route('/form-fields/bulk', methods=['POST'])
+@admission_control(streamed=True)
+def fill_form_fields_bulk():
+    return fill_bulk()
+
 @pdf_service.route('/health', methods=['GET'])
 def health():
     with configure_scope() as scope:
@@ -56,6 +133,33 @@ def health():
     response = make_response("Healthy")
     return response
 
+@pdf_service.route('/queue', methods=['GET'])
+def queue():
+    with configure_scope() as scope:
+        if scope.transaction:
+            scope.transaction.sampled = False
+
+    return queue_status()
+
+@pdf_service.route('/metrics', methods=['GET'])
+def metrics():
+    with configure_scope() as scope:
+        if scope.transaction:
+            scope.transaction.sampled = False
+
+    return metrics_response()
+
+@pdf_service.route('/ready', methods=['GET'])
+def readiness():
+    with configure_scope() as scope:
+        if scope.transaction:
+            scope.transaction.sampled = False
+
+    if not ready.is_set():
+        return make_response("Warming up", 503)
+
+    return make_response("Ready")
+
 @pdf_service.route('/', methods=['GET'])
 def root():
     response = make_response("HTML to PDF service.\n * https://github.com/ssharunas/pdf-service v0.4")
@@ -64,7 +168,9 @@ def root():
 
 
 def debug():
+    warm_up()
     pdf_service.run()
 
 if __name__ == '__main__': # pragma: no cover
+    warm_up()
     pdf_service.run()
@@ -1,4 +1,5 @@
-from . import pdf_service
+from . import pdf_service, warm_up
 
 
+warm_up()
 pdf_service.run()
@@ -0,0 +1,130 @@
+import os
+import threading
+from contextlib import contextmanager, ExitStack
+from functools import partial, wraps
+from typing import Callable, Optional
+
+from flask import make_response, Response
+
+from .errors import make_error, RenderError
+from .metrics import RENDERS_IN_FLIGHT, RENDERS_WAITING, live_gauges
+from .pool import WORKER_COUNT
+
+# Per worker, together the workers render on every CPU once
+MAX_CONCURRENT_RENDERS = int(os.environ.get('MAX_CONCURRENT_RENDERS') or max(1, (os.cpu_count() or 1) // WORKER_COUNT))
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE') or 16)
+RENDER_QUEUE_TIMEOUT = float(os.environ.get('RENDER_QUEUE_TIMEOUT') or 30)
+RETRY_AFTER = int(os.environ.get('RETRY_AFTER') or 5)
+MAX_PAGES = int(os.environ.get('MAX_PAGES') or 0)
+
+# Limits of the current worker. Limits shared with other workers would lose the slots of a worker
+# that's killed while rendering (out of memory, timeout), until the service is restarted.
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_RENDERS)
+_lock = threading.Lock()
+_active = 0
+_waiting = 0
+
+
+class Saturated(Exception):
+    pass
+
+
+@contextmanager
+def admit():
+    """
+    Hold one of the `MAX_CONCURRENT_RENDERS` render slots. If none is free, wait in the queue for up
+    to `RENDER_QUEUE_TIMEOUT` seconds.
+
+    :raise: :class:`Saturated` if the queue is full or no slot got free in time
+    """
+    global _active, _waiting
+    if not _slots.acquire(False):
+        with _lock:
+            if _waiting >= RENDER_QUEUE_SIZE:
+                raise Saturated()
+            _waiting += 1
+        RENDERS_WAITING.inc()
+        try:
+            acquired = _slots.acquire(timeout=RENDER_QUEUE_TIMEOUT)
+        finally:
+            with _lock:
+                _waiting -= 1
+            RENDERS_WAITING.dec()
+        if not acquired:
+            raise Saturated()
+
+    with _lock:
+        _active += 1
+    RENDERS_IN_FLIGHT.inc()
+    try:
+        yield
+    finally:
+        with _lock:
+            _active -= 1
+        RENDERS_IN_FLIGHT.dec()
+        _slots.release()
+
+
+def admission_control(view: Optional[Callable] = None, *, streamed: bool = False):
+    """
+    Decorate a view to run it in a render slot (see :func:`admit`), it's answered with `503` when
+    the service is saturated.
+
+    :param streamed: The view renders while its response is streamed, e.g. a batch, so the slot is
+     held until the response is closed.
+    """
+    if view is None:
+        return partial(admission_control, streamed=streamed)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(admit())
+            except Saturated:
+                response = make_error('Service is saturated, retry later', 503)
+                response.headers.set('Retry-After', str(RETRY_AFTER))
+                return response
+
+            response = view(*args, **kwargs)
+            if streamed and isinstance(response, Response) and response.is_streamed:
+                response.call_on_close(stack.pop_all().close)
+            return response
+    return wrapper
+
+
+def page_limit() -> Optional[int]:
+    """
+    Pages to lay out at most, one more than `MAX_PAGES`, which is enough to reject a document
+    over the limit. `None` without a limit.
+    """
+    return MAX_PAGES + 1 if MAX_PAGES else None
+
+
+def check_page_count(pages: int):
+    """
+    :raise: :class:`RenderError` if `pages` is over the `MAX_PAGES` limit
+    """
+    if MAX_PAGES and pages > MAX_PAGES:
+        raise RenderError(f'Document has more than {MAX_PAGES} pages', 413)
+
+
+def queue_status() -> Response:
+    """
+    Renders of all workers, summed from their metrics (see `PROMETHEUS_MULTIPROC_DIR`), and the
+    limits of all workers together. Without shared metrics, the renders of the answering worker.
+    """
+    gauges = live_gauges()
+    if gauges is None:
+        active, waiting, workers = _active, _waiting, 1
+    else:
+        active = int(gauges.get('pdf_service_renders_in_flight', 0))
+        waiting = int(gauges.get('pdf_service_renders_waiting', 0))
+        workers = WORKER_COUNT
+
+    return make_response({
+        'active': active,
+        'waiting': waiting,
+        'capacity': MAX_CONCURRENT_RENDERS * workers,
+        'queue_size': RENDER_QUEUE_SIZE * workers,
+    })
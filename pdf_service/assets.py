@@ -0,0 +1,137 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import Dict, Optional, Tuple
+
+from flask import make_response, request, Response
+from werkzeug.datastructures import MultiDict
+
+from .cache import DiskCache
+from .errors import make_error, RenderError
+
+ASSET_DIR = os.environ.get('ASSET_DIR') or os.path.join(tempfile.gettempdir(), 'pdf-service-assets')
+ASSET_DISK_BYTES = int(os.environ.get('ASSET_DISK_BYTES') or 1024 * 1024 * 1024)
+# Keep the assets of multipart `/generate` requests, so later requests can refer to them
+ASSET_KEEP_UPLOADS = os.environ.get('ASSET_KEEP_UPLOADS', 'true').lower() not in ('0', 'false', 'no')
+
+# Documents refer to stored assets as `asset:sha256-<hex digest>`
+ASSET_SCHEME = 'asset:'
+# Ids a single `/assets/missing` request can check
+MAX_CHECKED_ASSETS = 10000
+
+_ASSET_ID_RE = re.compile(r'^sha256-([0-9a-f]{64})$')
+
+# Shared by all workers, the least recently used assets are evicted beyond `ASSET_DISK_BYTES`.
+# Values are the content type, a newline and the data.
+store = DiskCache(ASSET_DIR, ASSET_DISK_BYTES)
+
+
+def asset_id(data: bytes) -> str:
+    return 'sha256-' + hashlib.sha256(data).hexdigest()
+
+
+def _key(value: str) -> Optional[str]:
+    match = _ASSET_ID_RE.match(value)
+    return match.group(1) if match else None
+
+
+def has_asset(value: str) -> bool:
+    """
+    Whether the asset with id `value` is stored. Checking an asset counts as use, so it isn't
+    evicted before the request that checked it.
+    """
+    key = _key(value)
+    return key is not None and store.touch(key)
+
+
+def put_asset(data: bytes, content_type: Optional[str]) -> str:
+    """
+    Store an asset, unless it's stored already.
+
+    :return: The id of the asset.
+    :raise: :class:`RenderError` if the asset is larger than `ASSET_DISK_BYTES`
+    """
+    value = asset_id(data)
+    if len(data) > ASSET_DISK_BYTES:
+        raise RenderError(f'Asset is too large, at most {ASSET_DISK_BYTES} bytes can be stored.', 413)
+    if not has_asset(value):
+        content_type = (content_type or 'application/octet-stream').replace('\n', ' ')
+        store.set(_key(value), content_type.encode('utf-8') + b'\n' + data)
+    return value
+
+
+def get_asset(value: str) -> Optional[Tuple[bytes, str]]:
+    """
+    The data and the content type of the asset with id `value`, `None` if it isn't stored.
+    """
+    key = _key(value)
+    stored = store.get(key) if key is not None else None
+    if stored is None:
+        return None
+    content_type, _, data = stored.partition(b'\n')
+    return data, content_type.decode('utf-8')
+
+
+def keep_assets(files: Optional[MultiDict]):
+    """
+    Store the assets of a multipart request, see `ASSET_KEEP_UPLOADS`. The files are rewound.
+    """
+    if not ASSET_KEEP_UPLOADS:
+        return
+    for name, file in (files or MultiDict()).items(multi=True):
+        if name == 'index.html':
+            continue
+        data = file.stream.read()
+        file.stream.seek(0)
+        if len(data) <= ASSET_DISK_BYTES:
+            put_asset(data, file.content_type)
+
+
+def parse_manifest(value: Optional[str]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Names of the multipart API mapped to stored assets, from an `X-Assets` header like
+    `logo.png=sha256-..., fonts/title.woff2=sha256-...`.
+
+    :raise: :class:`RenderError` for an invalid manifest
+    """
+    manifest: Dict[str, str] = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        name, _, reference = item.partition('=')
+        name, reference = name.strip().removeprefix('/'), reference.strip().removeprefix(ASSET_SCHEME)
+        if not name or _key(reference) is None:
+            raise RenderError(f'Invalid "X-Assets" header item {item.strip()}! Expected name=sha256-<hex digest>.', 400)
+        manifest[name] = reference
+    return tuple(sorted(manifest.items()))
+
+
+def upload_assets() -> Response:
+    """
+    Store the parts of a multipart request as assets. Responds with the ids by part name.
+    """
+    if not request.content_type or not request.content_type.startswith("multipart/form-data"):
+        return make_error("Invalid content type. Expected 'multipart/form-data'", 400)
+    if not request.files:
+        return make_error('No assets present', 400)
+
+    try:
+        ids = {name: put_asset(file.read(), file.content_type) for name, file in request.files.items(multi=True)}
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    return make_response({'assets': ids}, 201)
+
+
+def missing_assets() -> Response:
+    """
+    The ids of a JSON list that aren't stored, these have to be uploaded before they're used.
+    """
+    ids = request.get_json(silent=True)
+    if not isinstance(ids, list) or not all(isinstance(value, str) for value in ids):
+        return make_error('Request body must be a JSON list of asset ids', 400)
+    if len(ids) > MAX_CHECKED_ASSETS:
+        return make_error(f'Too many assets, at most {MAX_CHECKED_ASSETS} can be checked at once.', 400)
+
+    return make_response({'missing': [value for value in ids if not has_asset(value.removeprefix(ASSET_SCHEME))]})
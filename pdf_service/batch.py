@@ -0,0 +1,195 @@
+import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import CancelledError, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Tuple
+
+from flask import request, Response
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import HTTPException
+
+from .encryption import encrypt
+from .errors import make_error, RenderError
+from .generate import RenderOptions, render_pdf, request_options
+from .metrics import stage
+from .pool import RENDER_PROCESSES, render_pool, reset_render_pool
+from .streaming import FORMATS, Part, streaming_response
+
+HTML_EXTENSIONS = ('.html', '.htm')
+# Total uncompressed size of the files of a zip archive
+MAX_ZIP_BYTES = int(os.environ.get('MAX_ZIP_BYTES') or 512 * 1024 * 1024)
+TERMINATED = b'Render process terminated unexpectedly'
+
+# Assets shared by the documents of a batch: name -> (path of the spooled file, content type)
+Assets = Dict[str, Tuple[str, str]]
+
+
+def render_document(html: bytes, assets: Assets, options: RenderOptions) -> Tuple[int, bytes]:
+    """
+    Render a single document of a batch. Runs in a render process.
+
+    :return: The status and either the PDF or the error message.
+    """
+    files = MultiDict()
+    for name, (path, content_type) in assets.items():
+        files.add(name, FileStorage(open(path, 'rb'), filename=name, name=name, content_type=content_type))
+
+    try:
+        pdf = render_pdf(html, files, options)
+        if options.password:
+            pdf = encrypt(pdf, options.password)
+        return 200, pdf
+    except HTTPException as e:
+        return e.code, str(e.description).encode('utf-8')
+    except RenderError as e:
+        return e.status, e.message.encode('utf-8')
+    except Exception as e:
+        return 500, ('An error while encrypting pdf. ' + str(e)).encode('utf-8')
+    finally:
+        for file in files.values():
+            file.close()
+
+
+def _read_multipart(directory: str) -> Tuple[List[Tuple[str, bytes]], Assets]:
+    documents = []
+    assets = {}
+    for name, file in request.files.items(multi=True):
+        if name.lower().endswith(HTML_EXTENSIONS):
+            documents.append((name, file.read()))
+        else:
+            path = os.path.join(directory, str(len(assets)))
+            file.save(path)
+            assets[name] = (path, file.content_type)
+    return documents, assets
+
+
+def _read_zip(directory: str) -> Tuple[List[Tuple[str, bytes]], Assets]:
+    documents = []
+    assets = {}
+    with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as body:
+        shutil.copyfileobj(request.stream, body)
+        with zipfile.ZipFile(body) as archive:
+            # zipfile doesn't extract more than the declared sizes
+            if sum(entry.file_size for entry in archive.infolist()) > MAX_ZIP_BYTES:
+                raise RenderError(f'Zip archive is too large, at most {MAX_ZIP_BYTES} bytes can be extracted.', 413)
+            for entry in archive.infolist():
+                if entry.is_dir():
+                    continue
+                if entry.filename.lower().endswith(HTML_EXTENSIONS):
+                    documents.append((entry.filename, archive.read(entry)))
+                else:
+                    path = os.path.join(directory, str(len(assets)))
+                    with archive.open(entry) as source, open(path, 'wb') as target:
+                        shutil.copyfileobj(source, target)
+                    content_type = mimetypes.guess_type(entry.filename)[0] or 'application/octet-stream'
+                    assets[entry.filename] = (path, content_type)
+    return documents, assets
+
+
+def _unique_names(documents: List[Tuple[str, bytes]]) -> List[Tuple[str, bytes]]:
+    """
+    `documents` with repeated names suffixed by their number, e.g. `index.html`, `index-2.html`, so
+    every document has its own result file and report entry.
+    """
+    used = {name for name, _ in documents}
+    seen = set()
+    unique = []
+    for name, html in documents:
+        if name in seen:
+            base_name, extension = os.path.splitext(name)
+            number = 2
+            while f'{base_name}-{number}{extension}' in used:
+                number += 1
+            name = f'{base_name}-{number}{extension}'
+            used.add(name)
+        seen.add(name)
+        unique.append((name, html))
+    return unique
+
+
+def _render_all(documents: List[Tuple[str, bytes]], assets: Assets, options: RenderOptions) -> Iterator[Part]:
+    """
+    Render `documents` on the render pool and yield the results as they complete. At most two
+    documents per render process are queued, so finished PDFs don't pile up in memory.
+    """
+    report = []
+    remaining = iter(documents)
+    pending = {}
+
+    def submit_next():
+        document = next(remaining, None)
+        if document is not None:
+            name, html = document
+            # The pool is replaced after a render process died, so it's looked up for every document
+            try:
+                future = render_pool().submit(render_document, html, assets, options)
+            except BrokenProcessPool:
+                reset_render_pool()
+                future = render_pool().submit(render_document, html, assets, options)
+            pending[future] = name
+
+    for _ in range(2 * RENDER_PROCESSES):
+        submit_next()
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                status, data = future.result()
+            except BrokenProcessPool:
+                reset_render_pool()
+                status, data = 500, TERMINATED
+            except CancelledError:
+                # Queued on a pool that was reset
+                status, data = 500, TERMINATED
+
+            base_name = os.path.splitext(name)[0]
+            if status == 200:
+                report.append({'name': name, 'status': status, 'file': base_name + '.pdf'})
+                yield Part(base_name + '.pdf', data)
+            else:
+                report.append({'name': name, 'status': status, 'file': base_name + '.error.txt', 'error': data.decode('utf-8')})
+                yield Part(base_name + '.error.txt', data, 'text/plain', status)
+
+            submit_next()
+
+    yield Part('report.json', json.dumps(report).encode('utf-8'), 'application/json')
+
+
+def generate_batch() -> Response:
+    output_format = request.args.get('format', default='zip')
+    if output_format not in FORMATS:
+        return make_error(f'Invalid "format" parameter format={output_format}! Supported values are: {", ".join(FORMATS)}.', 400)
+
+    try:
+        options = request_options()
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    directory = tempfile.mkdtemp(prefix='pdf-batch-')
+    try:
+        with stage('decode'):
+            if request.content_type.startswith("multipart/form-data"):
+                documents, assets = _read_multipart(directory)
+            elif request.content_type.startswith(("application/zip", "application/x-zip-compressed")):
+                documents, assets = _read_zip(directory)
+            else:
+                raise RenderError("Invalid content type. Expected 'multipart/form-data' or 'application/zip'", 400)
+
+        if not documents:
+            raise RenderError("No html documents present", 400)
+    except zipfile.BadZipFile:
+        shutil.rmtree(directory, ignore_errors=True)
+        return make_error('Request body is not a valid zip archive', 400)
+    except RenderError as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        return make_error(e.message, e.status)
+
+    response = streaming_response(_render_all(_unique_names(documents), assets, options), output_format, 'generated')
+    response.call_on_close(lambda: shutil.rmtree(directory, ignore_errors=True))
+    return response
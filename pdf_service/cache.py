@@ -0,0 +1,346 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from .deadline import shielded
+
+
+class MemoryCache:
+    """
+    Size-bounded LRU cache for byte strings, local to the current worker process.
+
+    :param max_bytes: Total size of all stored values. Least recently used values are evicted once
+     the budget is exceeded.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with shielded(), self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+
+        with shielded(), self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+
+            self._entries[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DiskCache:
+    """
+    Size-bounded LRU cache stored in a directory, so it can be shared by all gunicorn workers.
+
+    Every value is a single file. Reads touch the file's modification time, which is then used as
+    the recency when the directory outgrows `max_bytes`. Writes go to a temporary file first and
+    are moved into place, so readers never observe partial values.
+
+    Each process keeps a running total of the directory size and only scans it once the total
+    exceeds `max_bytes`, or every `RESCAN_INTERVAL` writes to catch up with other workers.
+
+    :param path: Directory of the cache, created if missing.
+    :param max_bytes: Total size of all stored values.
+    """
+
+    # Lock files shared by all keys, so `.locks` doesn't grow with the cache
+    LOCK_STRIPES = 256
+    RESCAN_INTERVAL = 100
+    # Claims of keys being created (see `creating`) older than this are taken over, as their owner
+    # probably died
+    CLAIM_TIMEOUT = 300
+    CLAIM_POLL_INTERVAL = 0.05
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._size = None
+        self._writes = 0
+        self._size_lock = threading.Lock()
+        os.makedirs(os.path.join(path, '.locks'), exist_ok=True)
+        os.makedirs(os.path.join(path, '.claims'), exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return value
+
+    def touch(self, key: str) -> bool:
+        """
+        Mark `key` as recently used without reading it.
+
+        :return: Whether `key` is stored.
+        """
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            previous = os.stat(path).st_size
+        except FileNotFoundError:
+            previous = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with shielded(), self._size_lock:
+            self._writes += 1
+            if self._size is not None and self._writes < self.RESCAN_INTERVAL:
+                self._size += len(value) - previous
+                if self._size <= self.max_bytes:
+                    return
+
+            self._size = self._evict()
+            self._writes = 0
+
+    def _evict(self) -> int:
+        """
+        Remove the least recently used values until the directory fits into `max_bytes`.
+
+        :return: The size of the remaining values.
+        """
+        entries = []
+        total = 0
+        for directory in os.scandir(self.path):
+            if not directory.is_dir() or directory.name.startswith('.'):
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.startswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return total
+
+        for _, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+        return total
+
+    @contextmanager
+    def lock(self, key: str):
+        """
+        Exclusive lock on `key` across all processes using this directory. Keys share a fixed
+        number of lock files, so unrelated keys occasionally wait for each other.
+        """
+        stripe = zlib.crc32(key.encode('utf-8')) % self.LOCK_STRIPES
+        # Not interrupted by the deadline halfway, it's only held briefly (see `creating`)
+        with shielded(), open(os.path.join(self.path, '.locks', '%03d' % stripe), 'wb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def creating(self, key: str):
+        """
+        Claim the creation of `key` across all processes using this directory, waiting while
+        another process holds the claim.
+
+        The claim is a file in `.claims`, removed when the scope ends. The lock of `key` is only
+        held while the claim is checked and made, so unrelated keys sharing a lock file aren't
+        created one after another.
+        """
+        claim = os.path.join(self.path, '.claims', key)
+        while True:
+            with self.lock(key):
+                try:
+                    claimed = time.time() - os.stat(claim).st_mtime < self.CLAIM_TIMEOUT
+                except FileNotFoundError:
+                    claimed = False
+                if not claimed:
+                    with open(claim, 'wb'):
+                        pass
+                    os.utime(claim)
+                    break
+            time.sleep(self.CLAIM_POLL_INTERVAL)
+
+        try:
+            yield
+        finally:
+            with shielded():
+                try:
+                    os.unlink(claim)
+                except FileNotFoundError:
+                    pass
+
+
+class Cache:
+    """
+    Two tier cache with an optional per-worker :class:`MemoryCache` in front of an optional shared
+    :class:`DiskCache`.
+
+    :example:
+    >>> cache = Cache(MemoryCache(64 * 1024 * 1024), DiskCache('/tmp/cache', 1024 * 1024 * 1024))
+    >>> pdf = cache.get_or_create(key, lambda: render())
+    """
+
+    def __init__(self, memory: Optional[MemoryCache] = None, disk: Optional[DiskCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = None
+        if self.memory is not None:
+            value = self.memory.get(key)
+
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None and self.memory is not None:
+                self.memory.set(key, value)
+
+        return value
+
+    def set(self, key: str, value: bytes):
+        if self.memory is not None:
+            self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def get_or_create(self, key: str, create: Callable[[], bytes]) -> bytes:
+        """
+        Return the cached value of `key` or store the result of `create`.
+
+        Concurrent calls for the same key, in this process or (with a disk tier) in other workers,
+        wait for the first one to finish instead of calling `create` themselves.
+        Exceptions raised by `create` are propagated and nothing is stored.
+        """
+        value = self.get(key)
+        if value is not None:
+            self._count(hit=True)
+            return value
+
+        with self._in_flight(key):
+            value = self.get(key)
+            if value is not None:
+                self._count(hit=True)
+                return value
+
+            self._count(hit=False)
+            value = create()
+            self.set(key, value)
+            return value
+
+    def _count(self, hit: bool):
+        with shielded(), self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @contextmanager
+    def _in_flight(self, key: str):
+        with shielded(), self._locks_lock:
+            lock, waiting = self._locks.get(key, (threading.Lock(), 0))
+            self._locks[key] = (lock, waiting + 1)
+
+        try:
+            with lock:
+                if self.disk is not None:
+                    with self.disk.creating(key):
+                        yield
+                else:
+                    yield
+        finally:
+            with shielded(), self._locks_lock:
+                lock, waiting = self._locks[key]
+                if waiting == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, waiting - 1)
+
+
+def cache_from_env(prefix: str, memory_bytes: int = 0) -> Optional[Cache]:
+    """
+    Create a :class:`Cache` configured by the environment variables `{prefix}_CACHE_MEMORY_BYTES`
+    (default: `memory_bytes`), `{prefix}_CACHE_DIR` and `{prefix}_CACHE_DISK_BYTES`.
+
+    :return: The cache or `None` if neither tier is enabled.
+    """
+    memory_bytes = int(os.environ.get(f'{prefix}_CACHE_MEMORY_BYTES') or memory_bytes)
+    disk_path = os.environ.get(f'{prefix}_CACHE_DIR')
+    disk_bytes = int(os.environ.get(f'{prefix}_CACHE_DISK_BYTES') or 1024 * 1024 * 1024)
+
+    memory = MemoryCache(memory_bytes) if memory_bytes > 0 else None
+    disk = DiskCache(disk_path, disk_bytes) if disk_path else None
+    if memory is None and disk is None:
+        return None
+
+    return Cache(memory, disk)
+
+
+def digest(*parts) -> str:
+    """
+    SHA-256 hex digest over `parts`. Parts are `bytes`, `str` or `None` and are length prefixed, so
+    different splits of the same bytes don't collide.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            h.update(b'-')
+            continue
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        h.update(b'%d:' % len(part))
+        h.update(part)
+    return h.hexdigest()
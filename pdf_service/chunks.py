@@ -0,0 +1,239 @@
+import os
+import tempfile
+from concurrent.futures import FIRST_EXCEPTION, Future, wait
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+import fitz
+import html5lib
+from flask import has_request_context
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import HTTPException
+from xml.etree import ElementTree
+
+from .admission import check_page_count
+from .batch import Assets
+from .deadline import (CHECK_INTERVAL, RENDER_TIMEOUT, Deadline, DeadlineExceeded, current_deadline,
+                       deadline_scope, interruptible, request_timeout)
+from .errors import RenderError
+from .generate import PageNumbering, RenderOptions, render_pdf
+from .metrics import stage
+from .pool import render_pool, reset_render_pool
+from .spool import save_document
+
+# Top-level elements with this attribute start a new chunk
+CHUNK_ATTRIBUTE = 'data-pdf-chunk'
+
+
+def split_chunks(html: bytes) -> List[bytes]:
+    """
+    Split a document into chunks at the children of `<body>` with a `data-pdf-chunk` attribute.
+    Every chunk is a document with the `<head>` of `html`, so it has the same stylesheets.
+    Content before the first marked element belongs to the first chunk.
+    """
+    if CHUNK_ATTRIBUTE.encode('ascii') not in html:
+        return [html]
+
+    root = html5lib.parse(html, treebuilder='etree', namespaceHTMLElements=False)
+    head, body = root.find('head'), root.find('body')
+    groups: List[List[ElementTree.Element]] = [[]]
+    for child in body:
+        if child.get(CHUNK_ATTRIBUTE) is not None and groups[-1]:
+            groups.append([])
+        groups[-1].append(child)
+
+    chunks = []
+    for number, children in enumerate(groups):
+        chunk_root = ElementTree.Element('html', root.attrib)
+        chunk_root.append(head)
+        chunk_body = ElementTree.SubElement(chunk_root, 'body', body.attrib)
+        if number == 0:
+            chunk_body.text = body.text
+        chunk_body.extend(children)
+        serialized = html5lib.serialize(chunk_root, tree='etree', omit_optional_tags=False, quote_attr_values='always')
+        chunks.append(b'<!DOCTYPE html>' + serialized.encode('utf-8'))
+    return chunks
+
+
+def render_chunk(html: Union[bytes, List[bytes]], assets: Assets, options: RenderOptions, numbering: PageNumbering,
+                 timeout: float, marker: str, max_pages: Optional[int] = None) -> Tuple[int, bytes, PageNumbering]:
+    """
+    Render a chunk of a document. Runs in a render process.
+
+    The render stops after `timeout` seconds or once the `marker` file is removed, e.g. because
+    another chunk failed. `max_pages` is passed on to `render_pdf`.
+
+    :return: The status, either the PDF or the error message, and the page numbers of the chunk.
+    """
+    files = MultiDict()
+    for name, (path, content_type) in assets.items():
+        files.add(name, FileStorage(open(path, 'rb'), filename=name, name=name, content_type=content_type))
+
+    try:
+        with deadline_scope(Deadline(timeout, marker=marker)):
+            return 200, render_pdf(html, files, options, max_pages=max_pages, numbering=numbering), numbering
+    except HTTPException as e:
+        return e.code, str(e.description).encode('utf-8'), numbering
+    except RenderError as e:
+        return e.status, e.message.encode('utf-8'), numbering
+    except BaseException as e:
+        # Including `DeadlineExceeded` and `Stopped`, the request fails on its own
+        return 500, ('An error while rendering pdf. ' + repr(e)).encode('utf-8'), numbering
+    finally:
+        for file in files.values():
+            file.close()
+
+
+def _save_assets(files: Optional[MultiDict], directory: str) -> Assets:
+    assets = {}
+    for name, file in (files or MultiDict()).items(multi=True):
+        if name == 'index.html':
+            continue
+        path = os.path.join(directory, str(len(assets)))
+        file.save(path)
+        file.stream.seek(0)
+        assets[name] = (path, file.content_type)
+    return assets
+
+
+def _render_all(chunks: Dict[int, Union[bytes, List[bytes]]], assets: Assets, options: RenderOptions,
+                numberings: Dict[int, PageNumbering],
+                max_pages: Optional[int] = None) -> Dict[int, Tuple[bytes, PageNumbering]]:
+    """
+    Render `chunks` in parallel on the render pool. Without a deadline of the request, they're
+    rendered with the timeout of the request, so a chunk can't hold a render process forever.
+
+    Once the request fails, the chunks that didn't start are cancelled and the running ones stop at
+    their next deadline check, as the marker file they watch is removed.
+
+    :raise: :class:`RenderError` for the first chunk that failed
+    """
+    deadline = current_deadline()
+    own_deadline = deadline is None
+    if own_deadline:
+        deadline = Deadline(request_timeout() if has_request_context() else RENDER_TIMEOUT)
+
+    fd, marker = tempfile.mkstemp(prefix='pdf-service-chunks-')
+    os.close(fd)
+    pool = render_pool()
+    futures: Dict[Future, int] = {}
+    try:
+        for index, html in chunks.items():
+            future = pool.submit(render_chunk, html, assets, options, numberings[index], deadline.remaining(), marker,
+                                 max_pages)
+            futures[future] = index
+
+        pending = set(futures)
+        while pending:
+            # Deadline and client disconnect are checked in between
+            done, pending = wait(pending, timeout=CHECK_INTERVAL, return_when=FIRST_EXCEPTION)
+            deadline.check()
+            for future in done:
+                status, data, _ = future.result()
+                if status != 200:
+                    raise RenderError(data.decode('utf-8'), status)
+    except BrokenProcessPool:
+        reset_render_pool()
+        raise RenderError('Render process terminated unexpectedly')
+    except DeadlineExceeded:
+        if not own_deadline:
+            raise
+        raise RenderError(f'Rendering exceeded the deadline of {deadline.timeout:g} seconds', 504)
+    finally:
+        for future in futures:
+            future.cancel()
+        os.remove(marker)
+
+    results = {}
+    for future, index in futures.items():
+        _, pdf, numbering = future.result()
+        results[index] = (pdf, numbering)
+    return results
+
+
+def render_in_pool(html: Union[bytes, List[bytes]], files: Optional[MultiDict], options: RenderOptions,
+                   target: Optional[BinaryIO] = None, max_pages: Optional[int] = None) -> Union[bytes, BinaryIO]:
+    """
+    Like `render_pdf`, but the document is rendered in a process of the render pool, which stops at
+    the deadline of the request. For requests on threads the timer of `deadline_scope` can't
+    interrupt (see :func:`interruptible`), which would otherwise render until they finish.
+
+    :raise: :class:`RenderError` if rendering failed
+    """
+    with tempfile.TemporaryDirectory(prefix='pdf-service-render') as directory:
+        assets = _save_assets(files, directory)
+        with stage('render'):
+            pdf, _ = _render_all({0: html}, assets, options, {0: PageNumbering()}, max_pages)[0]
+
+    if target is None:
+        return pdf
+    target.write(pdf)
+    target.seek(0)
+    return target
+
+
+def join_pdfs(pdfs: List[bytes], target: BinaryIO) -> BinaryIO:
+    """
+    Join the PDFs of the chunks into one document with the metadata of the first chunk and the
+    bookmarks of all chunks.
+    """
+    document = fitz.open()
+    toc = []
+    for pdf in pdfs:
+        with fitz.open(stream=pdf, filetype='pdf') as chunk:
+            if not document.page_count:
+                document.set_metadata(chunk.metadata)
+            toc.extend([level, title, page + document.page_count] for level, title, page in chunk.get_toc())
+            document.insert_pdf(chunk)
+    if toc:
+        document.set_toc(toc)
+    return save_document(document, target, garbage=3, deflate=True)
+
+
+def render_chunked(html: Union[bytes, List[bytes]], files: Optional[MultiDict], options: RenderOptions,
+                   target: Optional[BinaryIO] = None) -> Union[bytes, BinaryIO]:
+    """
+    Like `render_pdf`, but the chunks of the document (see :func:`split_chunks`) are rendered in
+    parallel on the render pool and joined into one PDF. The render processes are forked from the
+    worker, so they share its parsed `CSS_PATH` stylesheets and loaded fonts. A document without
+    chunks is rendered by `render_pdf`, or by :func:`render_in_pool` if the timer of the deadline
+    can't interrupt the current thread.
+
+    Chunks are rendered with the page counters of their own pages first. If page margins show page
+    counters, the chunks are rendered again with the page numbers of the whole document, as these
+    are only known once all chunks are laid out.
+
+    :raise: :class:`RenderError` if a chunk failed
+    """
+    parts = html if isinstance(html, list) else [html]
+    chunks = [chunk for part in parts for chunk in split_chunks(part)]
+    if len(chunks) == 1:
+        render = render_pdf if interruptible() else render_in_pool
+        return render(html, files, options, target=target)
+
+    # Chunks are encrypted by the caller once they are joined
+    options = options._replace(password=None)
+    with tempfile.TemporaryDirectory(prefix='pdf-service-chunks') as directory:
+        assets = _save_assets(files, directory)
+
+        with stage('render'):
+            results = _render_all(dict(enumerate(chunks)), assets, options,
+                                  {index: PageNumbering() for index in range(len(chunks))})
+
+            numberings = [results[index][1] for index in range(len(chunks))]
+            total = sum(numbering.pages for numbering in numberings)
+            check_page_count(total)
+
+            offset = 0
+            renumbered = {}
+            for index, numbering in enumerate(numberings):
+                if numbering.used:
+                    renumbered[index] = PageNumbering(offset, total)
+                offset += numbering.pages
+            if renumbered:
+                results.update(_render_all({index: chunks[index] for index in renumbered}, assets, options, renumbered))
+
+    with stage('write-pdf'):
+        pdf = join_pdfs([results[index][0] for index in range(len(chunks))], target or BytesIO())
+    return pdf if target is not None else pdf.getvalue()
@@ -1,7 +1,9 @@
+import binascii
 import re
 
 from base64 import urlsafe_b64decode
-from urllib.parse import unquote
+from typing import NamedTuple, Optional
+from urllib.parse import unquote, unquote_to_bytes
 from .errors import InvalidDataURI
 
 # Adapted from https://github.com/fcurella/python-datauri
@@ -39,3 +41,54 @@ def parse(self):
         data = unquote(match.group("data"))
 
     return mimetype, name, charset, bool(match.group("base64")), data
+
+
+_HEADER_RE = re.compile(
+    r"(?P<mimetype>{})?".format(MIMETYPE_REGEX)
+    + r"(?:\;name\=[\w\.\-%!*'~\(\)]+)?"
+    + r"(?:\;charset\=(?P<charset>{}))?".format(CHARSET_REGEX)
+    + r"(?P<base64>\;base64)?"
+)
+
+_URLSAFE = str.maketrans('-_', '+/')
+
+
+class DataURI(NamedTuple):
+    mimetype: Optional[str]
+    charset: Optional[str]
+    data: bytes
+
+
+def decode(uri: str) -> DataURI:
+    """
+    Decode a data URI. Only the header is matched with a regular expression, the payload is decoded
+    straight from `uri`, with a single copy for slicing it off.
+
+    Base64 payloads may be URL-safe and unpadded, like with :func:`parse`.
+
+    :raise: :class:`InvalidDataURI` for an invalid header or payload
+    """
+    # The header is short, the payload isn't scanned for its comma
+    comma = uri.find(',', 5, 512)
+    match = _HEADER_RE.fullmatch(uri, 5, comma) if comma >= 0 and uri.startswith('data:') else None
+    if not match:
+        raise InvalidDataURI("Not a valid data URI: %r" % uri[:64])
+
+    payload = uri[comma + 1:]
+    if not match.group('base64'):
+        data = unquote_to_bytes(payload)
+    else:
+        if '%' in payload:
+            payload = unquote(payload)
+        if '-' in payload or '_' in payload:
+            payload = payload.translate(_URLSAFE)
+        try:
+            try:
+                data = binascii.a2b_base64(payload)
+            except binascii.Error:
+                # Unpadded, surplus padding is ignored
+                data = binascii.a2b_base64(payload + '==')
+        except (binascii.Error, ValueError) as e:
+            raise InvalidDataURI("Invalid base64 payload of data URI: %s" % e)
+
+    return DataURI(match.group('mimetype') or None, match.group('charset') or None, data)
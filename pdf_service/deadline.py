@@ -0,0 +1,193 @@
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from flask import request
+
+from .errors import make_error
+
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT') or 60)
+MAX_RENDER_TIMEOUT = float(os.environ.get('MAX_RENDER_TIMEOUT') or 300)
+
+# Interval of the deadline and client disconnect checks
+CHECK_INTERVAL = 0.5
+
+
+class DeadlineExceeded(BaseException):
+    """
+    The deadline of the request passed. A :class:`BaseException`, so it isn't swallowed by the
+    `except Exception` blocks of WeasyPrint, which demote failures to warnings.
+    """
+
+
+class ClientDisconnected(BaseException):
+    """
+    The client closed the connection, nobody waits for the result anymore.
+    """
+
+
+class Stopped(BaseException):
+    """
+    The work was stopped by whoever waits for it, e.g. the other chunks of a document that failed.
+    """
+
+
+class Deadline:
+    def __init__(self, timeout: float, client: Optional[socket.socket] = None, marker: Optional[str] = None):
+        """
+        :param client: Socket of the client, the work stops when it disconnects
+        :param marker: Path of a file, the work stops when it's removed
+        """
+        self.timeout = timeout
+        self.expires = time.monotonic() + timeout
+        self.client = client
+        self.marker = marker
+        # Depth of `shielded` blocks, the timer of `deadline_scope` doesn't interrupt them
+        self.shields = 0
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def check(self):
+        """
+        :raise: :class:`DeadlineExceeded` if the deadline passed
+        :raise: :class:`ClientDisconnected` if the client closed the connection
+        :raise: :class:`Stopped` if the marker file was removed
+        """
+        if time.monotonic() >= self.expires:
+            raise DeadlineExceeded()
+        if self.client is not None and _is_disconnected(self.client):
+            raise ClientDisconnected()
+        if self.marker is not None and not os.path.exists(self.marker):
+            raise Stopped()
+
+
+def _is_disconnected(client: socket.socket) -> bool:
+    try:
+        readable, _, _ = select.select([client], [], [], 0)
+        # A closed connection is readable, but there's nothing to read
+        return bool(readable) and client.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar('deadline', default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """
+    Deadline of the current request, if any.
+    """
+    return _current.get()
+
+
+def clear_deadline():
+    """
+    Forget the deadline of the current context. Render processes call it when they start, as they
+    may be forked while a request with a deadline is running.
+    """
+    _current.set(None)
+
+
+def interruptible() -> bool:
+    """
+    Whether the timer of :func:`deadline_scope` can interrupt the current thread. Signals are only
+    handled by the main thread, so the requests of threaded workers (`WORKER_THREADS`) can't be
+    interrupted and have to render in a process of the render pool instead (see `render_in_pool`).
+    """
+    return threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def shielded():
+    """
+    Defer the interruption by the timer of :func:`deadline_scope` until the block is left, for code
+    that must not stop halfway, like the bookkeeping of locks and claims shared with other requests.
+    The deadline is checked again at the next tick of the timer.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        yield
+        return
+
+    deadline.shields += 1
+    try:
+        yield
+    finally:
+        deadline.shields -= 1
+
+
+def request_timeout() -> float:
+    """
+    Timeout of the current request in seconds, from the `X-Deadline` header or the `timeout`
+    parameter, `RENDER_TIMEOUT` by default and at most `MAX_RENDER_TIMEOUT`.
+
+    :raise: :class:`ValueError` for an invalid value
+    """
+    value = request.headers.get('X-Deadline') or request.args.get('timeout')
+    if not value:
+        return RENDER_TIMEOUT
+
+    timeout = float(value)
+    if not timeout > 0:
+        raise ValueError(value)
+    return min(timeout, MAX_RENDER_TIMEOUT)
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline):
+    """
+    Enforce `deadline` for the code in the scope.
+
+    Fetches check the deadline themselves (see :func:`current_deadline`). On the main thread, which
+    runs the requests of gunicorn's sync workers, a timer also interrupts CPU bound stages like the
+    layout, so a render can't hold a worker beyond its deadline or after the client disconnected.
+    The timer raises wherever the code happens to be, except in :func:`shielded` blocks.
+    """
+    token = _current.set(deadline)
+    on_main_thread = interruptible()
+    if on_main_thread:
+        def on_timer(signum, frame):
+            if not deadline.shields:
+                deadline.check()
+
+        previous = signal.signal(signal.SIGALRM, on_timer)
+        signal.setitimer(signal.ITIMER_REAL, max(min(CHECK_INTERVAL, deadline.remaining()), 0.001), CHECK_INTERVAL)
+    try:
+        yield deadline
+    finally:
+        if on_main_thread:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+        _current.reset(token)
+
+
+def with_deadline(view):
+    """
+    Decorate a view to run it with the deadline of the request. It's answered with `504` when the
+    deadline passes.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            timeout = request_timeout()
+        except ValueError:
+            return make_error('Invalid deadline! Expected the timeout in seconds.', 400)
+
+        deadline = Deadline(timeout, request.environ.get('gunicorn.socket'))
+        try:
+            with deadline_scope(deadline):
+                return view(*args, **kwargs)
+        except DeadlineExceeded:
+            return make_error(f'Rendering exceeded the deadline of {deadline.timeout:g} seconds', 504)
+        except ClientDisconnected:
+            # Nobody reads the response
+            return make_error('Client disconnected', 499)
+    return wrapper
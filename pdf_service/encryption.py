@@ -1,48 +1,264 @@
+import json
+import os
+import re
+import secrets
 from io import BytesIO
-from os import read
-from urllib import response
+from typing import BinaryIO, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
-from flask import make_response, request, Response
-from sentry_sdk import start_span
+from flask import request, Response
+import fitz
 import pypdf
-import sys
 
-from .errors import make_error
+from .errors import make_error, RenderError
+from .metrics import stage
+from .postprocess import postprocess
+from .spool import file_response, request_body, save_document, spooled
+from .streaming import FORMATS, Part, streaming_response
 
-def encrypt(data: bytes, password: str) -> bytes:
-    reader = pypdf.PdfReader(BytesIO(data))
+BACKENDS = ('pypdf', 'pymupdf')
+ENCRYPTION_BACKEND = os.environ.get('ENCRYPTION_BACKEND') or 'pypdf'
+# Recipients of a single `/encrypt/batch` request
+MAX_RECIPIENTS = int(os.environ.get('MAX_RECIPIENTS') or 1000)
 
-    if reader.is_encrypted:
-        raise Exception('PDF is already encrypted. Can not re-encrypt encrypted PDF.');
+# Permission bits of the `P` entry, the same for pypdf and PyMuPDF
+PERMISSIONS = {
+    'print': 4,
+    'modify': 8,
+    'copy': 16,
+    'annotate': 32,
+    'fill-forms': 256,
+    'accessibility': 512,
+    'assemble': 1024,
+    'print-high-quality': 2048,
+}
+# All permissions with the reserved bits set, like pypdf's default
+_ALL_PERMISSIONS = 2 ** 31 - 1 - 3
+# Longest password PyMuPDF encrypts with
+PYMUPDF_MAX_PASSWORD = 40
+
+_NAME_RE = re.compile(r'^[A-Za-z0-9_.-]{1,100}$')
+_ALREADY_ENCRYPTED = 'PDF is already encrypted. Can not re-encrypt encrypted PDF.'
+
+
+class Recipient(NamedTuple):
+    """
+    An encrypted copy of a PDF.
+    """
+    name: str
+    password: str
+    # Names of `PERMISSIONS`, all permissions if `None`
+    permissions: Optional[Tuple[str, ...]] = None
+    # Random if permissions are restricted, as the owner of the PDF has all permissions anyway
+    owner_password: Optional[str] = None
+
+    def flags(self) -> int:
+        if self.permissions is None:
+            return _ALL_PERMISSIONS
+        flags = _ALL_PERMISSIONS & ~sum(PERMISSIONS.values())
+        for name in self.permissions:
+            flags |= PERMISSIONS[name]
+        return flags
+
+    def owner(self) -> str:
+        if self.owner_password:
+            return self.owner_password
+        return self.password if self.permissions is None else secrets.token_urlsafe(24)
 
-    writer = pypdf.PdfWriter(reader)
 
+def _pypdf_writer(pdf: Union[bytes, BinaryIO]) -> pypdf.PdfWriter:
+    reader = pypdf.PdfReader(BytesIO(pdf) if isinstance(pdf, bytes) else pdf)
+    if reader.is_encrypted:
+        raise Exception(_ALREADY_ENCRYPTED)
+
+    writer = pypdf.PdfWriter()
     for page in reader.pages:
         writer.add_page(page)
+    return writer
+
 
-    writer.encrypt(password, algorithm="AES-256")
+def _pypdf_copy(writer: pypdf.PdfWriter, recipient: Recipient) -> bytes:
+    # The objects are encrypted while they're written, so the writer can be encrypted again
+    writer.encrypt(recipient.password, recipient.owner(), permissions_flag=recipient.flags(), algorithm='AES-256')
     with BytesIO() as output:
         writer.write(output)
-        output.seek(0)
-        return output.read()
+        return output.getvalue()
+
+
+def _pymupdf_document(pdf: Union[bytes, BinaryIO]) -> fitz.Document:
+    document = fitz.open(stream=pdf if isinstance(pdf, bytes) else pdf.read(), filetype='pdf')
+    if document.is_encrypted or document.needs_pass:
+        raise Exception(_ALREADY_ENCRYPTED)
+    return document
+
+
+def _check_pymupdf_password(recipient: Recipient):
+    if len(recipient.password) > PYMUPDF_MAX_PASSWORD or len(recipient.owner_password or '') > PYMUPDF_MAX_PASSWORD:
+        raise RenderError(f'Passwords of the pymupdf backend must not be longer than {PYMUPDF_MAX_PASSWORD} characters', 400)
+
+
+def _pymupdf_options(recipient: Recipient) -> dict:
+    return {
+        'encryption': fitz.PDF_ENCRYPT_AES_256,
+        'user_pw': recipient.password,
+        'owner_pw': recipient.owner(),
+        'permissions': recipient.flags(),
+    }
+
+
+def encrypt_copies(pdf: Union[bytes, BinaryIO], recipients: Iterable[Recipient],
+                   backend: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Encrypted copies of `pdf` for `recipients` (AES-256), in order. The PDF is parsed once, right
+    away, the copies are written as they are consumed.
+
+    :param backend: `pypdf` or `pymupdf`, `ENCRYPTION_BACKEND` by default. PyMuPDF writes the
+     copies without copying the pages first and is considerably faster for large documents.
+    :raise: :class:`RenderError` if a password is too long for PyMuPDF
+    :raise: :class:`Exception` if the PDF is encrypted already or can't be parsed
+    """
+    if (backend or ENCRYPTION_BACKEND) == 'pymupdf':
+        recipients = list(recipients)
+        for recipient in recipients:
+            _check_pymupdf_password(recipient)
+        document = _pymupdf_document(pdf)
+        return (document.tobytes(**_pymupdf_options(recipient)) for recipient in recipients)
+
+    writer = _pypdf_writer(pdf)
+    return (_pypdf_copy(writer, recipient) for recipient in recipients)
+
+
+def encrypt_file(pdf: Union[bytes, BinaryIO], password: str, target: BinaryIO,
+                 backend: Optional[str] = None) -> BinaryIO:
+    """
+    Encrypt `pdf` with `password` into `target`, e.g. a :func:`spooled` file, and rewind it.
+    """
+    if (backend or ENCRYPTION_BACKEND) == 'pymupdf':
+        recipient = Recipient('', password)
+        _check_pymupdf_password(recipient)
+        return save_document(_pymupdf_document(pdf), target, **_pymupdf_options(recipient))
+    return postprocess(pdf, password=password, target=target)
+
+
+def encrypt(data: bytes, password: str) -> bytes:
+    return next(encrypt_copies(data, [Recipient('', password)]))
+
+
+def request_backend() -> str:
+    """
+    :raise: :class:`RenderError` for an unknown `backend` parameter
+    """
+    backend = request.args.get('backend') or ENCRYPTION_BACKEND
+    if backend not in BACKENDS:
+        raise RenderError(f'Invalid "backend" parameter backend={backend}! Supported values are: {", ".join(BACKENDS)}.', 400)
+    return backend
+
 
 def encryptPdf() -> Response:
-    with start_span(op='decode'):
-        pdf = request.get_data()
-    
+    with stage('decode'):
+        pdf = request_body()
+
     password = request.headers.get('X-Password') or request.args.get("password")
     if not password:
+        pdf.close()
         return make_error('Password must not be empty', 400);
 
     try:
-        with start_span(op='encrypt'):
-            pdf = encrypt(pdf, password);
+        backend = request_backend()
+    except RenderError as e:
+        pdf.close()
+        return make_error(e.message, e.status)
+
+    try:
+        with stage('encrypt'), pdf:
+            encrypted = encrypt_file(pdf, password, spooled(), backend)
+    except RenderError as e:
+        return make_error(e.message, e.status)
     except Exception as e:
         return make_error(str(e.args[0]), 500)
 
-    response = make_response(pdf)
+    return file_response(encrypted, 'encrypted.pdf')
+
+
+def parse_recipients(value: Union[str, bytes]) -> List[Recipient]:
+    """
+    Recipients of a JSON list like `[{"name": "alice", "password": "...", "permissions": ["print"]}]`.
+    Names default to `recipient-<n>`.
+
+    :raise: :class:`RenderError` for invalid recipients
+    """
+    try:
+        items = json.loads(value)
+    except ValueError as e:
+        raise RenderError('Invalid recipients. ' + str(e), 400)
+    if not isinstance(items, list) or not items:
+        raise RenderError('Recipients must be a non-empty JSON list', 400)
+    if len(items) > MAX_RECIPIENTS:
+        raise RenderError(f'Too many recipients, at most {MAX_RECIPIENTS} are supported.', 400)
+
+    recipients = []
+    names = set()
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict) or not item.get('password') or not isinstance(item['password'], str):
+            raise RenderError(f'Recipient {number} has no password', 400)
+
+        name = item.get('name') or f'recipient-{number}'
+        if not isinstance(name, str) or not _NAME_RE.match(name) or name in names:
+            raise RenderError(f'Invalid or duplicate name of recipient {number}', 400)
+        names.add(name)
+
+        permissions = item.get('permissions')
+        if permissions is not None:
+            if not isinstance(permissions, list) or not all(isinstance(name, str) and name in PERMISSIONS for name in permissions):
+                raise RenderError(f'Invalid permissions of recipient {number}! Supported values are: {", ".join(PERMISSIONS)}.', 400)
+            permissions = tuple(permissions)
+
+        owner_password = item.get('owner_password')
+        if owner_password is not None and not isinstance(owner_password, str):
+            raise RenderError(f'Invalid owner password of recipient {number}', 400)
+
+        recipients.append(Recipient(name, item['password'], permissions, owner_password))
+    return recipients
+
+
+def _encrypted_parts(copies: Iterator[bytes], recipients: List[Recipient]) -> Iterator[Part]:
+    for recipient in recipients:
+        with stage('encrypt'):
+            data = next(copies)
+        yield Part(recipient.name + '.pdf', data)
+
+
+def encrypt_batch() -> Response:
+    """
+    Encrypt one PDF for many recipients, each with its own password and permissions. The PDF is
+    parsed once and the copies are streamed as they are encrypted.
+    """
+    output_format = request.args.get('format', default='zip')
+    if output_format not in FORMATS:
+        return make_error(f'Invalid "format" parameter format={output_format}! Supported values are: {", ".join(FORMATS)}.', 400)
+
+    try:
+        backend = request_backend()
+        with stage('decode'):
+            if not request.content_type or not request.content_type.startswith("multipart/form-data"):
+                raise RenderError("Invalid content type. Expected 'multipart/form-data'", 400)
+            pdf = request.files.get('pdf')
+            if pdf is None:
+                raise RenderError('No pdf present', 400)
+            recipients = request.form.get('recipients')
+            if recipients is None and 'recipients' in request.files:
+                recipients = request.files['recipients'].read()
+            if recipients is None:
+                raise RenderError('No recipients present', 400)
+            recipients = parse_recipients(recipients)
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    try:
+        with stage('decode'):
+            copies = encrypt_copies(pdf.stream, recipients, backend)
+    except RenderError as e:
+        return make_error(e.message, e.status)
+    except Exception as e:
+        return make_error(str(e), 500)
 
-    response.headers.set('Content-Type', 'application/pdf')
-    response.headers.set('Content-Disposition', 'attachment; filename="encrypted.pdf"')
-    
-    return response
+    return streaming_response(_encrypted_parts(copies, recipients), output_format, 'encrypted')
@@ -8,6 +8,14 @@ class URLFetcherCalledAfterExitException(Exception):
 class InvalidDataURI(ValueError):
     pass
 
+
+class RenderError(Exception):
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
 def make_error(message, status):
     response = make_response(message, status)
     response.headers.set('Content-Type', 'text/plain')
@@ -1,33 +1,54 @@
-from io import BytesIO
-from os import write
-import os
 from flask import make_response, request, Response
-from sentry_sdk import start_span
 import pypdf
-import fitz
 
-from .errors import make_error
+from .admission import check_page_count
+from .errors import make_error, RenderError
+from .form_fill import draw_values, field_index, form_layout, open_form, set_values
+from .metrics import stage
+from .spool import file_response, file_size, request_body, save_document, spooled
 
 def get_fields() -> Response:
-    with start_span(op='decode'):
-        pdf = request.get_data()
-
-    if not pdf:
-        return make_error("Request body is empty. Body content must be application/pdf.", 400)
-
-    try:
-        reader = pypdf.PdfReader(BytesIO(pdf))
-        fields = reader.get_form_text_fields()
-    except Exception as e:
-        return make_error(str(e.args[0]), 500)
+    with stage('decode'):
+        pdf = request_body()
+
+    details = request.args.get('details', default=False, type=_flag)
+    with pdf:
+        if not file_size(pdf):
+            return make_error("Request body is empty. Body content must be application/pdf.", 400)
+
+        try:
+            if details:
+                with open_form(pdf) as document:
+                    index = field_index(document)
+            else:
+                # Values of the text fields by pypdf's names, including fields without widgets
+                fields = pypdf.PdfReader(pdf).get_form_text_fields()
+        except RenderError as e:
+            return make_error(e.message, e.status)
+        except Exception as e:
+            return make_error(str(e.args[0]), 500)
+
+    if details:
+        fields = {
+            name: {
+                'type': widgets[0].type,
+                'value': widgets[0].value,
+                'widgets': [{'page': field.page, 'rect': list(field.rect)} for field in widgets],
+            }
+            for name, widgets in index.items()
+        }
 
     response = make_response(fields)
     response.headers.set('Content-Type', 'text/json')
     return response
 
 
+def _flag(value: str) -> bool:
+    return value.lower() not in ('0', 'false', 'no')
+
+
 def set_fields() -> Response:
-    with start_span(op='decode'):
+    with stage('decode'):
         if not request.content_type.startswith("multipart/form-data"):
             return make_error("Invalid content type. Expected 'multipart/form-data'", 400)
 
@@ -36,8 +57,8 @@ def set_fields() -> Response:
         if not pdf:
             return make_error("Body form-data is missing pdf key with pdf binary data", 400)
 
-        pdf = pdf.stream.read()
-        if not pdf:
+        pdf = pdf.stream
+        if not file_size(pdf):
             return make_error("PDF file was empty.", 400)
 
         fields = {}
@@ -46,36 +67,26 @@ def set_fields() -> Response:
                 continue
             fields[item] = request.form.get(item)
 
+        flatten = request.args.get('flatten', default=True, type=_flag)
+
     try:
-        pdf_document = fitz.open(stream=pdf, filetype="pdf")
-        root_dir  = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        font_path = os.path.join(root_dir, "fonts", "DejaVuSansCondensed.ttf")
-
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-
-            widgets = page.widgets()
-            for widget in widgets:
-                if widget.field_name in fields:
-                    field_rect = widget.rect
-                    field_value = fields[widget.field_name]
-                    page.insert_text(field_rect.bl, field_value, fontfile=font_path, fontname="EXT_1", color=(0, 0, 0))
-                    page.delete_widget(widget)
-        
-        pdf_document.subset_fonts()
-
-        with BytesIO() as output:
-            pdf_document.save(output, 7)
-            output.seek(0)
-            pdf_data = output.read()
+        with open_form(pdf) as pdf_document:
+            check_page_count(len(pdf_document))
+            index = field_index(pdf_document)
+
+            if flatten:
+                layout = form_layout(pdf_document, fields.keys(), index)
+                draw_values(pdf_document, layout, fields)
+            else:
+                set_values(pdf_document, index, fields)
 
+            output = save_document(pdf_document, spooled(), garbage=3, deflate=True)
+
+    except RenderError as e:
+        return make_error(e.message, e.status)
     except Exception as e:
         response = make_response(str(e.args[0]), 500)
         response.headers.set('Content-Type', 'text/plain')
         return response
    
-    response = make_response(pdf_data)
-    response.headers.set('Content-Type', 'application/pdf')
-    response.headers.set('Content-Disposition', 'attachment; filename="form.pdf"')
-
-    return response
\ No newline at end of file
+    return file_response(output, 'form.pdf')
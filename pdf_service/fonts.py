@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from io import BytesIO
+from typing import Callable, Optional
+
+from fontTools.ttLib import TTFont, woff2
+from weasyprint.text.ffi import ffi, fontconfig, pangoft2
+from weasyprint.text.fonts import FontConfiguration
+from weasyprint.urls import FILESYSTEM_ENCODING
+
+from .URLFetchHandler import read_url
+from .cache import MemoryCache
+
+FONT_DIR = os.environ.get('FONT_DIR') or os.path.join(os.path.dirname(__file__), '..', 'fonts')
+FONT_CACHE_MEMORY_BYTES = int(os.environ.get('FONT_CACHE_MEMORY_BYTES') or 64 * 1024 * 1024)
+
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+# Decompressed WOFF and WOFF2 fonts by the hash of their content
+font_files = MemoryCache(FONT_CACHE_MEMORY_BYTES)
+
+
+def decode_font(font: bytes) -> bytes:
+    """
+    `font` with WOFF and WOFF2 compression removed, like WeasyPrint does before loading a font.
+    Decompressed fonts are cached by their content, so a web font used by many documents is
+    decompressed once per worker.
+    """
+    if font[:3] != b'wOF' or font[3:4] not in (b'F', b'2'):
+        return font
+
+    key = hashlib.sha256(font).hexdigest()
+    decoded = font_files.get(key)
+    if decoded is None:
+        with BytesIO() as output:
+            if font[3:4] == b'2':
+                woff2.decompress(BytesIO(font), output)
+            else:
+                ttfont = TTFont(BytesIO(font))
+                ttfont.flavor = ttfont.flavorData = None
+                ttfont.save(output)
+            decoded = output.getvalue()
+        font_files.set(key, decoded)
+    return decoded
+
+
+class FontDirConfiguration(FontConfiguration):
+    """
+    Font configuration with the fonts of a directory, `FONT_DIR` by default.
+    """
+
+    def __init__(self, font_dir: Optional[str] = FONT_DIR):
+        super().__init__()
+        if font_dir and os.path.isdir(font_dir):
+            self.add_font_dir(font_dir)
+
+    def add_font_dir(self, path: str):
+        """
+        Make the fonts of a directory available by their own family names.
+        """
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(FONT_EXTENSIONS):
+                filename = os.path.abspath(os.path.join(path, name)).encode(FILESYSTEM_ENCODING)
+                fontconfig.FcConfigAppFontAddFile(self._fontconfig_config, filename)
+        pangoft2.pango_fc_font_map_config_changed(ffi.cast('PangoFcFontMap *', self.font_map))
+
+
+class DocumentFontConfiguration:
+    """
+    Font configuration of a single document: the fonts of `FONT_DIR` and the faces of the
+    document's own `@font-face` rules, but none of other documents.
+
+    A document without `@font-face` rules is laid out with the configuration shared by the
+    documents of this worker (see :func:`font_configuration`), which is never given any faces. The
+    first face of a document creates a configuration of its own. Its fonts are decompressed with
+    :func:`decode_font`, so only registering them is repeated for every document.
+    """
+
+    def __init__(self):
+        self._own: Optional[FontDirConfiguration] = None
+
+    @property
+    def font_map(self):
+        return (self._own or font_configuration()).font_map
+
+    def add_font_face(self, rule_descriptors: dict, url_fetcher: Callable):
+        if self._own is None:
+            self._own = FontDirConfiguration()
+
+        def fetched(url: str) -> dict:
+            result = read_url(url_fetcher, url)
+            try:
+                result['string'] = decode_font(result['string'])
+            except Exception:
+                # Passed on as is, WeasyPrint reports fonts it can't load
+                pass
+            return result
+
+        return self._own.add_font_face(rule_descriptors, fetched)
+
+
+_shared: Optional[FontDirConfiguration] = None
+_shared_lock = threading.Lock()
+
+
+def font_configuration() -> FontDirConfiguration:
+    """
+    The font configuration with the fonts of `FONT_DIR`, shared by the documents of this worker.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = FontDirConfiguration()
+        return _shared
+
+
+# Load the fonts of FONT_DIR when the worker starts
+font_configuration()
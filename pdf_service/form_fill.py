@@ -0,0 +1,398 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Collection, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+from flask import request, Response
+from fontTools import subset
+from fontTools.ttLib import TTFont
+import fitz
+
+from .admission import check_page_count
+from .errors import make_error, RenderError
+from .metrics import stage
+from .pool import RENDER_PROCESSES, render_pool, reset_render_pool
+from .spool import file_path, file_response, save_document, spooled
+from .streaming import FORMATS, Part, streaming_response
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), '..', 'fonts', 'DejaVuSansCondensed.ttf')
+FONT_SIZE = 11
+TERMINATED = 'Render process terminated unexpectedly'
+
+# Records filled by one task of a render process
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE') or 50)
+
+# Values of a record: field name -> value
+Record = Dict[str, str]
+
+# Characters of the fill font loaded once per process: Basic Latin, Latin-1, Latin Extended-A,
+# general punctuation and the euro sign
+COMMON_CHARACTERS = frozenset(map(chr, [*range(0x20, 0x7f), *range(0xa0, 0x180), *range(0x2010, 0x2030), 0x20ac]))
+
+_font = None
+_font_lock = threading.Lock()
+
+
+def subset_font(characters: Collection[str]) -> bytes:
+    """
+    The fill font reduced to the glyphs of `characters`. Documents filled with it embed a small font
+    without subsetting each document.
+    """
+    options = subset.Options()
+    options.drop_tables += ['FFTM']
+    font = TTFont(FONT_PATH, lazy=True)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=''.join(characters))
+    subsetter.subset(font)
+    with io.BytesIO() as output:
+        font.save(output)
+        return output.getvalue()
+
+
+def fill_font(text: str = '') -> fitz.Font:
+    """
+    The font to draw `text` with. The subset with the `COMMON_CHARACTERS` is loaded once per process,
+    text with other characters gets a subset of its own.
+    """
+    global _font
+    if not COMMON_CHARACTERS.issuperset(text):
+        return fitz.Font(fontbuffer=subset_font(set(text)))
+
+    with _font_lock:
+        if _font is None:
+            _font = fitz.Font(fontbuffer=subset_font(COMMON_CHARACTERS))
+        return _font
+
+
+class Field(NamedTuple):
+    """
+    A widget of a form field.
+    """
+    name: str
+    # Field type, e.g. "text", "checkbox" or "combobox"
+    type: str
+    value: Optional[str]
+    page: int
+    rect: fitz.Rect
+    xref: int
+
+
+def open_form(pdf: Union[bytes, BinaryIO]) -> fitz.Document:
+    """
+    :param pdf: The PDF, or a :func:`spooled` file with it. A spooled file on disk is opened by its
+        path, so only one in memory is read.
+    :raise: :class:`RenderError` if `pdf` is not a PDF or is encrypted
+    """
+    try:
+        if isinstance(pdf, bytes):
+            document = fitz.open(stream=pdf, filetype='pdf')
+        elif file_path(pdf):
+            document = fitz.open(file_path(pdf), filetype='pdf')
+        else:
+            document = fitz.open(stream=pdf.read(), filetype='pdf')
+    except Exception as e:
+        raise RenderError('Invalid PDF. ' + str(e), 400)
+    if document.needs_pass:
+        raise RenderError('PDF is encrypted. Can not fill encrypted PDF.', 400)
+    return document
+
+
+def field_index(document: fitz.Document) -> Dict[str, List[Field]]:
+    """
+    Field name -> widgets of the field, built in one pass over the pages with widgets.
+    """
+    index = {}
+    for page in document:
+        if page.first_widget is None:
+            continue
+        for widget in page.widgets():
+            index.setdefault(widget.field_name, []).append(Field(
+                widget.field_name,
+                widget.field_type_string.lower(),
+                widget.field_value,
+                page.number,
+                fitz.Rect(widget.rect),
+                widget.xref,
+            ))
+    return index
+
+
+class FormLayout(NamedTuple):
+    """
+    A form prepared to be filled, possibly many times.
+    """
+    # The form without the widgets of the filled fields
+    base: fitz.Document
+    # Field name -> (page number, rectangle) of its widgets
+    fields: Dict[str, List[Tuple[int, fitz.Rect]]]
+
+
+def form_layout(pdf: Union[bytes, fitz.Document], names: Collection[str],
+                index: Optional[Dict[str, List[Field]]] = None) -> FormLayout:
+    """
+    Remove the widgets of the fields `names` from a form, their values are drawn as text.
+
+    :param pdf: The form, a document is changed in place.
+    :param index: The :func:`field_index` of `pdf`, if it's already built.
+    :raise: :class:`RenderError` if `pdf` is not a PDF or is encrypted
+    """
+    base = open_form(pdf) if isinstance(pdf, bytes) else pdf
+    if index is None:
+        index = field_index(base)
+
+    fields = {}
+    for name in names:
+        for field in index.get(name, ()):
+            fields.setdefault(name, []).append((field.page, field.rect))
+            page = base[field.page]
+            page.delete_widget(page.load_widget(field.xref))
+    return FormLayout(base, fields)
+
+
+def draw_values(document: fitz.Document, layout: FormLayout, values: Mapping[str, str], first_page: int = 0,
+                font: Optional[fitz.Font] = None):
+    """
+    Draw `values` into the fields of a copy of `layout.base` whose pages start at `first_page` of
+    `document`. Text is collected per page and written once. The lines of a value are spaced like
+    `Page.insert_text` does.
+
+    :param font: The font to draw with, :func:`fill_font` of the values by default.
+    """
+    font = font or fill_font(''.join(values.values()))
+    line_height = FONT_SIZE * (font.ascender - font.descender if font.ascender - font.descender > 1 else 1.2)
+    writers: Dict[int, fitz.TextWriter] = {}
+    for name, value in values.items():
+        lines = value.splitlines()
+        for page_number, rect in layout.fields.get(name, ()):
+            page_number += first_page
+            writer = writers.get(page_number)
+            if writer is None:
+                writer = writers[page_number] = fitz.TextWriter(document[page_number].rect)
+            for number, line in enumerate(lines):
+                writer.append(rect.bl + (0, number * line_height), line, font=font, fontsize=FONT_SIZE)
+
+    for page_number, writer in writers.items():
+        writer.write_text(document[page_number], color=(0, 0, 0))
+
+
+_CHECKED = ('1', 'on', 'yes', 'true')
+
+
+def set_values(document: fitz.Document, index: Dict[str, List[Field]], values: Mapping[str, str]):
+    """
+    Set `values` as the values of the form fields, the fields stay editable. Check boxes and radio
+    buttons are checked by "1", "on", "yes", "true" or the name of their on state.
+    """
+    for name, value in values.items():
+        for field in index.get(name, ()):
+            # The widget needs its page while it's updated
+            page = document[field.page]
+            widget = page.load_widget(field.xref)
+            if field.type in ('checkbox', 'radiobutton'):
+                on_state = widget.on_state()
+                widget.field_value = on_state if value.lower() in _CHECKED or value == on_state else 'Off'
+            else:
+                widget.field_value = value
+            widget.update()
+
+
+# Layouts and fonts of recently filled batches of this process, keyed by the digest of the form,
+# the names and the characters of the values
+_prepared: 'OrderedDict[str, Tuple[FormLayout, fitz.Font]]' = OrderedDict()
+
+
+def _prepare(directory: str, key: str, names: Collection[str], text: str) -> Tuple[FormLayout, fitz.Font]:
+    prepared = _prepared.get(key)
+    if prepared is None:
+        with open(os.path.join(directory, 'form.pdf'), 'rb') as f:
+            layout = form_layout(f.read(), names)
+        prepared = _prepared[key] = (layout, fill_font(text))
+        while len(_prepared) > 4:
+            _prepared.popitem(last=False)
+    else:
+        _prepared.move_to_end(key)
+    return prepared
+
+
+def fill_records(directory: str, key: str, names: List[str], text: str, records: List[Record], concatenate: bool) -> List[bytes]:
+    """
+    Fill the form of a batch with every record. Runs in a render process, which parses the form
+    and picks the font for the characters of the batch (`text`) only once, so a record costs only
+    drawing its values.
+
+    :return: A PDF per record, or a single PDF with all records if `concatenate` is set.
+    """
+    layout, font = _prepare(directory, key, names, text)
+
+    if concatenate:
+        document = fitz.open()
+        for record in records:
+            first_page = len(document)
+            document.insert_pdf(layout.base)
+            draw_values(document, layout, record, first_page, font)
+        return [document.tobytes(garbage=3, deflate=True)]
+
+    results = []
+    for record in records:
+        document = fitz.open()
+        document.insert_pdf(layout.base)
+        draw_values(document, layout, record, font=font)
+        results.append(document.tobytes(garbage=3, deflate=True))
+    return results
+
+
+def _value(value) -> str:
+    return '' if value is None else str(value)
+
+
+def _read_records() -> List[Record]:
+    """
+    Records of the `records` part. A file is CSV with a header row if it's named `.csv` or has a CSV
+    content type, newline delimited JSON objects otherwise. A field is newline delimited JSON.
+    """
+    file = request.files.get('records')
+    if file is not None:
+        is_csv = (file.filename or '').lower().endswith('.csv') or 'csv' in (file.content_type or '')
+        text = io.TextIOWrapper(file.stream, encoding='utf-8-sig')
+    elif 'records' in request.form:
+        is_csv = False
+        text = io.StringIO(request.form['records'])
+    else:
+        raise RenderError("Body form-data is missing records key with the records", 400)
+
+    if is_csv:
+        return [{name: _value(value) for name, value in row.items() if name is not None} for row in csv.DictReader(text)]
+
+    records = []
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise RenderError(f'Record on line {number} is not valid JSON', 400)
+        if not isinstance(record, dict):
+            raise RenderError(f'Record on line {number} is not a JSON object', 400)
+        records.append({name: _value(value) for name, value in record.items()})
+    return records
+
+
+def _fill_all(directory: str, key: str, names: List[str], text: str, records: List[Record], concatenate: bool) -> Iterator[Tuple[int, int, Union[List[bytes], str]]]:
+    """
+    Fill `records` in chunks of `BULK_CHUNK_SIZE` on the render pool and yield the chunks in order,
+    with the number of their first record, their number of records and either their PDFs or the
+    error they failed with. At most two chunks per render process are in flight.
+    """
+    chunks = ((start, records[start:start + BULK_CHUNK_SIZE]) for start in range(0, len(records), BULK_CHUNK_SIZE))
+    pending = deque()
+
+    def submit_next():
+        chunk = next(chunks, None)
+        if chunk is not None:
+            start, chunk_records = chunk
+            # The pool is replaced after a render process died, so it's looked up for every chunk
+            try:
+                future = render_pool().submit(fill_records, directory, key, names, text, chunk_records, concatenate)
+            except BrokenProcessPool:
+                reset_render_pool()
+                future = render_pool().submit(fill_records, directory, key, names, text, chunk_records, concatenate)
+            pending.append((start, len(chunk_records), future))
+
+    for _ in range(2 * RENDER_PROCESSES):
+        submit_next()
+
+    while pending:
+        start, count, future = pending.popleft()
+        try:
+            results = future.result()
+        except BrokenProcessPool:
+            reset_render_pool()
+            results = TERMINATED
+        except CancelledError:
+            # Queued on a pool that was reset
+            results = TERMINATED
+        except Exception as e:
+            results = 'An error while filling the form. ' + str(e)
+        submit_next()
+        yield start, count, results
+
+
+def _parts(directory: str, key: str, names: List[str], text: str, records: List[Record]) -> Iterator[Part]:
+    report = []
+    for start, count, results in _fill_all(directory, key, names, text, records, False):
+        if isinstance(results, str):
+            # The records of a failed chunk fail together, the others are filled
+            file = f'records-{start + 1}-{start + count}.error.txt'
+            for number in range(start + 1, start + count + 1):
+                report.append({'record': number, 'status': 500, 'file': file, 'error': results})
+            yield Part(file, results.encode('utf-8'), 'text/plain', 500)
+            continue
+
+        for number, pdf in enumerate(results, start=start + 1):
+            report.append({'record': number, 'status': 200, 'file': f'record-{number}.pdf'})
+            yield Part(f'record-{number}.pdf', pdf)
+
+    yield Part('report.json', json.dumps(report).encode('utf-8'), 'application/json')
+
+
+def fill_bulk() -> Response:
+    output_format = request.args.get('format', default='zip')
+    if output_format not in FORMATS + ('pdf',):
+        return make_error(f'Invalid "format" parameter format={output_format}! Supported values are: pdf, {", ".join(FORMATS)}.', 400)
+
+    if not request.content_type or not request.content_type.startswith("multipart/form-data"):
+        return make_error("Invalid content type. Expected 'multipart/form-data'", 400)
+
+    directory = tempfile.mkdtemp(prefix='pdf-forms-')
+    try:
+        with stage('decode'):
+            pdf = request.files.get("pdf")
+            if not pdf:
+                raise RenderError("Body form-data is missing pdf key with pdf binary data", 400)
+            data = pdf.read()
+            with open(os.path.join(directory, 'form.pdf'), 'wb') as f:
+                f.write(data)
+
+            records = _read_records()
+            if not records:
+                raise RenderError("No records present", 400)
+
+        with open_form(data) as form:
+            pages = len(form)
+        check_page_count(pages * len(records) if output_format == 'pdf' else pages)
+
+        names = sorted({name for record in records for name in record})
+        text = ''.join(sorted({char for record in records for value in record.values() for char in value}))
+        key = hashlib.sha256(data + '\0'.join(names + [text]).encode('utf-8')).hexdigest()
+    except RenderError as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        return make_error(e.message, e.status)
+
+    if output_format != 'pdf':
+        response = streaming_response(_parts(directory, key, names, text, records), output_format, 'forms')
+        response.call_on_close(lambda: shutil.rmtree(directory, ignore_errors=True))
+        return response
+
+    try:
+        with stage('fill'):
+            document = fitz.open()
+            for _, _, results in _fill_all(directory, key, names, text, records, True):
+                if isinstance(results, str):
+                    return make_error(results, 500)
+                with fitz.open(stream=results[0], filetype='pdf') as chunk:
+                    document.insert_pdf(chunk)
+            output = save_document(document, spooled(), garbage=3, deflate=True)
+    except Exception as e:
+        return make_error(str(e.args[0]), 500)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return file_response(output, 'forms.pdf')
@@ -0,0 +1,399 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple, Union
+
+from flask import request
+from weasyprint import HTML
+
+from . import pdf_service, pool
+from .admission import RENDER_QUEUE_SIZE, RETRY_AFTER
+from .deadline import Deadline, DeadlineExceeded, clear_deadline, deadline_scope, request_timeout
+from .errors import RenderError
+from .generate import request_html, request_options
+from .metrics import GATEWAY_ACTIVE, GATEWAY_WAITING, live_gauges, stage
+from .prefetch import collect_urls, prefetched_scope
+from .spool import CHUNK_SIZE, SPOOL_THRESHOLD
+from .URLFetchHandler import URLFetchHandler
+
+# Per worker, together the workers run a gateway process per CPU
+GATEWAY_PROCESSES = int(os.environ.get('GATEWAY_PROCESSES') or max(1, (os.cpu_count() or 1) // pool.WORKER_COUNT))
+
+# Cheap endpoints, answered by the gateway itself
+LOCAL_PATHS = ('/', '/health', '/ready', '/queue', '/metrics')
+# Endpoints rendering the HTML of the request, their external resources are fetched by the gateway
+PREFETCH_PATHS = ('/generate', '/preview')
+
+# A body in memory, or the path of a temporary file if it's larger than `SPOOL_THRESHOLD`
+Body = Union[bytes, str]
+# Status line, headers and body of a response
+Result = Tuple[str, List[Tuple[str, str]], Body]
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Requests of this gateway waiting for or running in a gateway process
+_queued = 0
+
+
+class _TooLarge(Exception):
+    pass
+
+
+class _Spool:
+    """
+    Bytes in memory, moved to a temporary file once they grow larger than `SPOOL_THRESHOLD`. Unlike
+    :func:`pdf_service.spool.spooled`, the file stays when it's closed, so its path can be passed to
+    another process.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._buffer = BytesIO()
+        self._file = None
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self._file is None and self.size > SPOOL_THRESHOLD:
+            self._file = tempfile.NamedTemporaryFile(prefix='pdf-service-gateway-', delete=False)
+            self._file.write(self._buffer.getvalue())
+            self._buffer = None
+        (self._buffer if self._file is None else self._file).write(data)
+
+    def value(self) -> Body:
+        if self._file is None:
+            return self._buffer.getvalue()
+        self._file.close()
+        return self._file.name
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            _remove(self._file.name)
+
+
+def _remove(body: Body):
+    if isinstance(body, str):
+        try:
+            os.remove(body)
+        except FileNotFoundError:
+            pass
+
+
+def _init_process():
+    clear_deadline()
+    # The render processes of the worker (e.g. for batches) are split between its gateway processes
+    pool.RENDER_PROCESSES = max(1, pool.RENDER_PROCESSES // GATEWAY_PROCESSES)
+
+
+def _processes() -> ProcessPoolExecutor:
+    """
+    Pool of gateway processes, created on first use. Like the render pool (see `pdf_service.pool`),
+    the processes are forked, so they start with everything the gateway already loaded. The gateway
+    doesn't render itself, so the processes start render pools of their own, e.g. for batches,
+    which share the `RENDER_PROCESSES` of the worker.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=GATEWAY_PROCESSES,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_process,
+        )
+    return _executor
+
+
+def _reset_processes():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _environ(scope: dict, length: int) -> Dict[str, str]:
+    """
+    WSGI environ of an ASGI `http` scope, without the streams, so it can be passed to another process.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        # The body is read completely, whatever the client sent
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name not in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+            key = 'HTTP_' + name
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _with_input(environ: Dict[str, str], body: Body) -> dict:
+    return dict(environ, **{
+        'wsgi.input': open(body, 'rb') if isinstance(body, str) else BytesIO(body),
+        'wsgi.errors': sys.stderr,
+    })
+
+
+def handle(environ: Dict[str, str], body: Body, prefetched: Dict[str, dict]) -> Result:
+    """
+    Run a request on the Flask app. Runs in a gateway process, or in the gateway for `LOCAL_PATHS`.
+    A response body larger than `SPOOL_THRESHOLD` is returned as temporary file, which the
+    gateway removes once it's sent.
+
+    :param prefetched: External resources fetched by the gateway, by URL
+    """
+    environ = _with_input(environ, body)
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    output = _Spool()
+    try:
+        with prefetched_scope(prefetched):
+            result = pdf_service(environ, start_response)
+            try:
+                for chunk in result:
+                    output.write(chunk)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+    except BaseException:
+        output.discard()
+        raise
+    finally:
+        environ['wsgi.input'].close()
+
+    status, headers = started
+    return status, headers, output.value()
+
+
+def prefetch_deadline(environ: Dict[str, str]) -> Optional[Deadline]:
+    """
+    Deadline of a `/generate` or `/preview` request that allows external resources, which the
+    gateway prefetches. Only reads the query and the headers, so it's cheap enough for the gateway.
+
+    :return: `None` for other requests. Invalid requests aren't answered here, that's left to the
+     Flask app.
+    """
+    if environ['PATH_INFO'] not in PREFETCH_PATHS:
+        return None
+
+    try:
+        with pdf_service.request_context(_with_input(environ, b'')):
+            if not request_options().isAllowExternal:
+                return None
+            return Deadline(request_timeout())
+    except (RenderError, ValueError):
+        return None
+
+
+def collect_resources(environ: Dict[str, str], body: Body, timeout: float) -> List[str]:
+    """
+    URLs of the external resources of the HTML of a request. Runs in a gateway process, as parsing
+    the HTML is CPU bound and would hold up the event loop of the gateway.
+    """
+    environ = _with_input(environ, body)
+    try:
+        with pdf_service.request_context(environ):
+            if request.mimetype == 'application/pdf' or 'pdf' in request.files:
+                return []
+
+            with deadline_scope(Deadline(timeout)):
+                html, _ = request_html()
+                htmls = [HTML(file_obj=BytesIO(part), base_url=request_options().baseUrl or '/', encoding='UTF-8')
+                         for part in (html if isinstance(html, list) else [html])]
+                return [url for html in htmls for url in collect_urls(html)]
+    except (Exception, DeadlineExceeded):
+        return []
+    finally:
+        environ['wsgi.input'].close()
+
+
+def prefetch_resources(urls: List[str], deadline: Deadline) -> Dict[str, dict]:
+    """
+    Fetch the external resources of a request within its deadline. Runs in the gateway.
+
+    :return: Results by URL
+    """
+    try:
+        with deadline_scope(deadline), stage('prefetch'):
+            url_fetcher = URLFetchHandler(isAllowExternal=True)
+            url_fetcher.prefetch(urls)
+            return url_fetcher.prefetched
+    except (Exception, DeadlineExceeded):
+        return {}
+
+
+async def _read_body(receive, max_bytes: Optional[int]) -> Optional[Body]:
+    """
+    :return: The request body, `None` if the client disconnected.
+    :raise: :class:`_TooLarge` if the body exceeds `max_bytes`
+    """
+    spool = _Spool()
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                spool.discard()
+                return None
+
+            spool.write(message.get('body', b''))
+            if max_bytes is not None and spool.size > max_bytes:
+                raise _TooLarge()
+            if not message.get('more_body'):
+                return spool.value()
+    except BaseException:
+        spool.discard()
+        raise
+
+
+def _error(message: str, status: int, headers: Optional[List[Tuple[str, str]]] = None) -> Result:
+    return f'{status} {message}', [('Content-Type', 'text/plain')] + (headers or []), message.encode('utf-8')
+
+
+async def _send(send, result: Result):
+    status, headers, body = result
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    if isinstance(body, bytes):
+        await send({'type': 'http.response.body', 'body': body})
+        return
+
+    loop = asyncio.get_running_loop()
+    try:
+        with open(body, 'rb') as file:
+            while True:
+                chunk = await loop.run_in_executor(None, file.read, CHUNK_SIZE)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(chunk)})
+                if not chunk:
+                    break
+    finally:
+        _remove(body)
+
+
+def _count(change: int):
+    global _queued
+    _queued += change
+    active = min(_queued, GATEWAY_PROCESSES)
+    GATEWAY_ACTIVE.set(active)
+    GATEWAY_WAITING.set(_queued - active)
+
+
+def queue_status() -> Result:
+    """
+    `/queue` of the gateway: its requests handled by and waiting for a gateway process. Like
+    :func:`pdf_service.admission.queue_status`, summed over all workers with shared metrics.
+    """
+    gauges = live_gauges()
+    if gauges is None:
+        active = min(_queued, GATEWAY_PROCESSES)
+        waiting, workers = _queued - active, 1
+    else:
+        active = int(gauges.get('pdf_service_gateway_requests_active', 0))
+        waiting = int(gauges.get('pdf_service_gateway_requests_waiting', 0))
+        workers = pool.WORKER_COUNT
+
+    body = json.dumps({
+        'active': active,
+        'waiting': waiting,
+        'capacity': GATEWAY_PROCESSES * workers,
+        'queue_size': RENDER_QUEUE_SIZE * workers,
+    }).encode('utf-8')
+    return '200 OK', [('Content-Type', 'application/json')], body
+
+
+async def _dispatch(environ: Dict[str, str], body: Body) -> Result:
+    loop = asyncio.get_running_loop()
+    if environ['PATH_INFO'] == '/queue':
+        # The gateway processes don't see the requests waiting for them
+        return await loop.run_in_executor(None, queue_status)
+    if environ['PATH_INFO'] in LOCAL_PATHS:
+        return await loop.run_in_executor(None, handle, environ, body, {})
+
+    if _queued >= GATEWAY_PROCESSES + RENDER_QUEUE_SIZE:
+        return _error('Service is saturated, retry later', 503, [('Retry-After', str(RETRY_AFTER))])
+
+    _count(1)
+    try:
+        prefetched = {}
+        deadline = prefetch_deadline(environ)
+        if deadline is not None:
+            urls = await loop.run_in_executor(_processes(), collect_resources, environ, body, deadline.remaining())
+            if urls:
+                prefetched = await loop.run_in_executor(None, prefetch_resources, urls, deadline)
+        return await loop.run_in_executor(_processes(), handle, environ, body, prefetched)
+    except BrokenProcessPool:
+        _reset_processes()
+        return _error('Render process terminated unexpectedly', 500)
+    finally:
+        _count(-1)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Fork the gateway processes right away, before the event loop starts any threads
+            await asyncio.get_running_loop().run_in_executor(_processes(), os.getpid)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _reset_processes()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application around the Flask routes, e.g. `uvicorn pdf_service.gateway:app`, or gunicorn
+    with `GATEWAY=true`.
+
+    Request bodies are read, external resources are fetched and responses are sent on the event
+    loop, so slow clients and slow asset servers only hold a coroutine. Requests are handed to the
+    gateway processes once their inputs are complete, which run the Flask app like a sync worker.
+    """
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise ValueError(f'Unsupported scope type {scope["type"]}')
+
+    try:
+        body = await _read_body(receive, pdf_service.config['MAX_CONTENT_LENGTH'])
+    except _TooLarge:
+        return await _send(send, _error('Request Entity Too Large', 413))
+    if body is None:
+        # Nobody reads the response
+        return
+
+    environ = _environ(scope, len(body) if isinstance(body, bytes) else os.path.getsize(body))
+    try:
+        result = await _dispatch(environ, body)
+    finally:
+        _remove(body)
+    await _send(send, result)
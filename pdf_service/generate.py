@@ -1,99 +1,344 @@
+from contextvars import ContextVar
 from io import BytesIO
-from typing import Optional
-from os import listdir
-from os.path import isfile, join
-from PIL.Image import ROTATE_180, ROTATE_270, ROTATE_90
+from itertools import islice
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple, Union
 
 from flask import make_response, request, Response
-from sentry_sdk import start_span, set_context
+from sentry_sdk import set_context
 from weasyprint import HTML
-from werkzeug.datastructures import FileStorage
+from weasyprint.css.counters import CounterStyle
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import HTTPException
 
-import os
+import hashlib
 import werkzeug
 import weasyprint
+import weasyprint.layout
 
 from .URLFetchHandler import URLFetchHandler
-from .encryption import encrypt
-from .rotation import rotate_pdf
-from .errors import make_error
+from .admission import check_page_count, page_limit
+from .assets import keep_assets, parse_manifest
+from .cache import cache_from_env, digest
+from .deadline import interruptible
+from .encryption import encrypt, encrypt_file
+from .prefetch import collect_urls
+from .postprocess import rotation_finisher
+from .spool import file_response, file_size, spooled
+from .errors import make_error, RenderError
+from .fonts import DocumentFontConfiguration
+from .metrics import PAGES, stage
+from .pdf_options import PdfOptions, parse_options
+from .stylesheets import ParsedStylesheet, style_profile
 
-css = [];
+# Rendered PDFs (before encryption) keyed by `cache_key`, see `cache_from_env` for configuration.
+result_cache = cache_from_env('PDF')
 
-def loadCustomCss():
-    path = os.environ.get('CSS_PATH') or './pdf_service/css'
-    css.clear()
-    for f in os.listdir(path):
-        if not f.endswith('.css'):
-            continue;
-        filename = os.path.join(path, f)
-        if os.path.isfile(filename):
-            css.append(weasyprint.CSS(filename= filename))
+# Pages left to lay out in `render_pdf`, `None` for all pages
+_layout_limit: ContextVar[Optional[int]] = ContextVar('layout_limit', default=None)
+_make_all_pages = weasyprint.layout.make_all_pages
 
-loadCustomCss()
 
-def generate() -> Response:
-    with start_span(op='decode'):
-        if request.content_type.startswith("multipart/form-data"):
-            # Multipart
-            html_file: Optional[FileStorage] = request.files.get("index.html")
-            if html_file is None:
-                raise werkzeug.exceptions.BadRequest(description="No index.html present")
-            html_size = html_file.content_length
+def make_all_pages(context, root_box, html, pages):
+    """
+    Replaces :func:`weasyprint.layout.page.make_all_pages`, so the layout stops after the pages
+    `render_pdf` was asked for. The remaining pages are never laid out.
+    """
+    return islice(_make_all_pages(context, root_box, html, pages), _layout_limit.get())
 
-        else:
-            # Basic
-            html_file: BytesIO = BytesIO(request.get_data())
-            html_size = html_file.getbuffer().nbytes
 
+weasyprint.layout.make_all_pages = make_all_pages
+
+
+class PageNumbering:
+    """
+    Page numbers of a document that is a part of a larger document, see `render_pdf`.
+    """
+
+    def __init__(self, offset: int = 0, total: Optional[int] = None):
+        # Pages of the preceding parts, added to the `page` counter
+        self.offset = offset
+        # Pages of all parts, the `pages` counter, or `None` for the pages of this part
+        self.total = total
+        # Set by `render_pdf`: the pages of this part and whether page margins show page counters
+        self.pages = 0
+        self.used = False
+
+
+# Page numbers of the document `render_pdf` renders, `None` for a whole document
+_page_numbering: ContextVar[Optional[PageNumbering]] = ContextVar('page_numbering', default=None)
+_make_margin_boxes = weasyprint.layout.make_margin_boxes
+
+
+def _shows_page_numbers(box) -> bool:
+    return box.is_generated and any(
+        type_ in ('counter()', 'counters()') and value[0] in ('page', 'pages')
+        for type_, value in box.style['content']
+    )
+
+
+def make_margin_boxes(context, page, state):
+    """
+    Replaces :func:`weasyprint.layout.page.make_margin_boxes`, so the `page` and `pages` counters
+    of page margins count the pages of all parts when a part is rendered with `_page_numbering`.
+    """
+    numbering = _page_numbering.get()
+    if numbering is None:
+        return _make_margin_boxes(context, page, state)
+
+    quote_depth, counter_values, counter_scopes = state
+    counter_values = dict(counter_values)
+    counter_values['page'] = [value + numbering.offset for value in counter_values.get('page', [])]
+    if numbering.total is not None:
+        counter_values['pages'] = [numbering.total]
+    boxes = tuple(_make_margin_boxes(context, page, (quote_depth, counter_values, counter_scopes)))
+    numbering.used = numbering.used or any(_shows_page_numbers(box) for box in boxes)
+    return boxes
+
+
+weasyprint.layout.make_margin_boxes = make_margin_boxes
+
+class RenderOptions(NamedTuple):
+    baseUrl: Optional[str] = None
+    isAllowExternal: bool = False
+    rotation: Optional[int] = None
+    password: Optional[str] = None
+    style: Optional[str] = None
+    # Unset options fall back to the style profile
+    pdf: PdfOptions = PdfOptions()
+    # Names of the multipart API mapped to stored assets, from the `X-Assets` header
+    assets: Tuple[Tuple[str, str], ...] = ()
+
+def request_options() -> RenderOptions:
+    """
+    Rendering options of the current request, shared by `/generate` and the endpoints built on it.
+
+    :raise: :class:`RenderError` for invalid options
+    """
     baseUrl = request.headers.get('X-BaseUrl') or request.args.get("base-url")
     isAllowExternal = bool(baseUrl) or request.args.get("isAllowExternalResources", default= False, type= bool);
 
+    rotation = request.args.get("rotate", type= int)
+    if rotation and rotation != 90 and rotation != 180 and rotation != 270:
+        raise RenderError(f'Invalid "rotate" parameter rotate={rotation}! Supported values are: 90, 180, 270.', 500)
+
+    password = request.headers.get('X-Password') or request.args.get("password")
+
+    style = request.args.get("style")
+    if style:
+        style_profile(style)
+
+    pdf = parse_options(request.args, dashed=True)
+
+    assets = parse_manifest(request.headers.get('X-Assets'))
+
+    return RenderOptions(baseUrl, isAllowExternal, rotation, password, style, pdf, assets)
+
+def cache_key(html: Union[bytes, List[bytes]], files: Optional[MultiDict], options: RenderOptions) -> str:
+    assets = []
+    for name, file in sorted((files or MultiDict()).items(multi=True), key=lambda item: item[0]):
+        if name == 'index.html':
+            continue
+        h = hashlib.sha256()
+        for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+            h.update(chunk)
+        file.stream.seek(0)
+        assets.append(f'{name}={file.content_type}:{h.hexdigest()}')
+
+    # The password is left out on purpose, cached PDFs are not encrypted
+    parts = html if isinstance(html, list) else [html]
+    return digest(str(len(parts)), *parts, '\n'.join(assets), options.baseUrl, str(options.isAllowExternal), str(options.rotation or 0), style_profile(options.style).digest, repr(tuple(options.pdf)), repr(options.assets))
+
+def render_pdf(html: Union[bytes, List[bytes]], files: Optional[MultiDict], options: RenderOptions,
+               stylesheets: Optional[List[ParsedStylesheet]] = None,
+               target: Optional[BinaryIO] = None,
+               max_pages: Optional[int] = None,
+               numbering: Optional[PageNumbering] = None) -> Union[bytes, BinaryIO]:
+    """
+    Render `html` to PDF bytes, or write it to `target` and return the rewound `target`. Rotation
+    is applied while writing the PDF, encryption is left to the caller (see :func:`postprocess`).
+
+    A list of HTML documents is rendered part by part and the pages are joined into one document,
+    which is written once, so fonts and images shared by the parts are embedded only once.
+
+    `stylesheets` are applied after the `CSS_PATH` stylesheets of the `style` profile
+    (see :func:`style_profile`). Their fonts are fetched like the resources of the document.
+
+    The PDF options of `options` that aren't set are taken from the `style` profile.
+
+    With `max_pages` only the first pages are laid out and written, e.g. for previews. Page
+    counters like `counter(pages)` then count these pages only.
+
+    With `numbering` the document is rendered as part of a larger document (see `chunks`), the
+    page counters of page margins are offset and its pages are recorded in `numbering`.
+
+    :raise: :class:`werkzeug.exceptions.HTTPException` for invalid inputs (see :class:`URLFetchHandler`)
+    :raise: :class:`RenderError` if any stage failed
+    """
+    parts = html if isinstance(html, list) else [html]
     try:
-        with URLFetchHandler(request.files, isAllowExternal) as url_fetcher:
-            with start_span(op='parse'):
-                html = HTML(
-                    file_obj=html_file,
-                    base_url=baseUrl  or '/',
-                    url_fetcher=url_fetcher,
-                    encoding = 'UTF-8'
-                )
-
-            with start_span(op='render'):
-                doc = html.render(presentational_hints=True, stylesheets=css)
+        profile = style_profile(options.style)
+        pdf_options = options.pdf.merge(profile.pdf_options)
+        with URLFetchHandler(files, options.isAllowExternal, pdf_options, dict(options.assets)) as url_fetcher:
+            with stage('parse'):
+                htmls = [
+                    HTML(
+                        file_obj=BytesIO(part),
+                        base_url=options.baseUrl  or '/',
+                        url_fetcher=url_fetcher,
+                        encoding = 'UTF-8'
+                    )
+                    for part in parts
+                ]
+
+            if options.isAllowExternal:
+                with stage('prefetch'):
+                    url_fetcher.prefetch([url for html in htmls for url in collect_urls(html)])
+
+            with stage('render'):
+                def render(html: HTML, font_config: DocumentFontConfiguration):
+                    counter_style = CounterStyle()
+                    for sheet in profile.stylesheets:
+                        sheet.register(font_config, counter_style, weasyprint.default_url_fetcher)
+                    for sheet in stylesheets or []:
+                        sheet.register(font_config, counter_style, url_fetcher)
+                    return html.render(
+                        presentational_hints=True,
+                        stylesheets=[sheet.css for sheet in profile.stylesheets + (stylesheets or [])],
+                        font_config=font_config,
+                        counter_style=counter_style,
+                    )
+
+                # Shared by the parts, which are written as one document
+                font_config = DocumentFontConfiguration()
+                documents = []
+                numbering_token = _page_numbering.set(numbering)
+                layout_pages = max_pages
+                if page_limit() is not None and (max_pages is None or max_pages > page_limit()):
+                    # Documents over `MAX_PAGES` are rejected, laying out the rest is wasted
+                    layout_pages = page_limit()
+                try:
+                    for html in htmls:
+                        if layout_pages is not None:
+                            remaining = layout_pages - sum(len(document.pages) for document in documents)
+                            if remaining <= 0:
+                                break
+                            limit = _layout_limit.set(remaining)
+                        try:
+                            documents.append(render(html, font_config))
+                        finally:
+                            if layout_pages is not None:
+                                _layout_limit.reset(limit)
+                finally:
+                    _page_numbering.reset(numbering_token)
+
+                pages = sum(len(document.pages) for document in documents)
+                if numbering is not None:
+                    numbering.pages = pages
+                PAGES.observe(pages)
+                check_page_count(pages)
+                if len(documents) == 1:
+                    doc = documents[0]
+                else:
+                    doc = documents[0].copy([page for document in documents for page in document.pages])
+
+        if any(url_fetcher.cache_stats.values()):
+            set_context("url-cache", url_fetcher.cache_stats)
+    except (HTTPException, RenderError):
+        raise
     except Exception as e:
-        return make_error('An error while rendering pdf. ' + str(e.args[0]), 500);
+        raise RenderError('An error while rendering pdf. ' + str(e))
 
     try:
-        with start_span(op='write-pdf'):
-            pdf = doc.write_pdf()
+        with stage('write-pdf'):
+            finisher = rotation_finisher(options.rotation) if options.rotation else None
+            if target is None:
+                return doc.write_pdf(finisher=finisher, **pdf_options.write_pdf_options())
+
+            doc.write_pdf(target=target, finisher=finisher, **pdf_options.write_pdf_options())
+            target.seek(0)
+            return target
     except Exception as e:
-        return make_error('An error while writing pdf. ' + str(e.args[0]), 500);
+        raise RenderError('An error while writing pdf. ' + str(e))
+
+def request_html() -> Tuple[Union[bytes, List[bytes]], int]:
+    """
+    HTML of the current request, a list if several parts are combined, and its total size.
+
+    :raise: :class:`werkzeug.exceptions.BadRequest` if a multipart request has no `index.html`
+    """
+    if request.content_type.startswith("multipart/form-data"):
+        # Multipart, several index.html parts are combined into one PDF
+        html_files: List[FileStorage] = request.files.getlist("index.html")
+        if not html_files:
+            raise werkzeug.exceptions.BadRequest(description="No index.html present")
+        html = [html_file.read() for html_file in html_files]
+        html_size = sum(len(part) for part in html)
+        if len(html) == 1:
+            html = html[0]
+
+    else:
+        # Basic
+        html = request.get_data()
+        html_size = len(html)
+
+    return html, html_size
+
+def encrypt_output(pdf: Union[bytes, BinaryIO], password: str) -> Union[bytes, BinaryIO]:
+    """
+    Encrypt a rendered PDF. A spooled PDF is encrypted file to file, the rendered file is closed.
+    """
+    if isinstance(pdf, bytes):
+        return encrypt(pdf, password)
+
+    with pdf:
+        return encrypt_file(pdf, password, spooled())
+
+
+def generate() -> Response:
+    with stage('decode'):
+        html, html_size = request_html()
+        keep_assets(request.files)
 
     try:
-        rotation = request.args.get("rotate", type= int)
-        if rotation:
-            if rotation != 90 and rotation != 180 and rotation != 270:
-                 return make_error(f'Invalid "rotate" parameter rotate={rotation}! Supported values are: 90, 180, 270.', 500)
-            pdf = rotate_pdf(pdf, rotation);
-    except Exception as e:
-        return make_error('An error while rotating pdf. ' + str(e.args[0]), 500);
+        options = request_options()
+        render = render_pdf
+        chunked = request.args.get('chunked', 'false').lower() in ('1', 'true', 'yes')
+        if chunked:
+            # Imported here, as chunks are rendered with `render_pdf`
+            from .chunks import render_chunked as render
+        elif not interruptible():
+            # A threaded worker, only a render process can be stopped at the deadline
+            from .chunks import render_in_pool as render
+
+        if result_cache is None:
+            pdf = render(html, request.files, options, target=spooled())
+        else:
+            key = cache_key(html, request.files, options)
+            if chunked:
+                key = digest(key, 'chunked')
+            pdf = result_cache.get_or_create(key, lambda: render(html, request.files, options))
+    except RenderError as e:
+        return make_error(e.message, e.status)
 
     try:
-        password = request.headers.get('X-Password') or request.args.get("password")
-        if password:
-            pdf = encrypt(pdf, password)
+        if options.password:
+            with stage('encrypt'):
+                pdf = encrypt_output(pdf, options.password)
     except Exception as e:
         return make_error('An error while encrypting pdf. ' + str(e.args[0]), 500);
 
+    if isinstance(pdf, bytes):
+        pdf_size = len(pdf)
+        response = make_response(pdf)
+        response.headers.set('Content-Type', 'application/pdf')
+        response.headers.set('Content-Disposition', 'attachment; filename="generated.pdf"')
+    else:
+        pdf_size = file_size(pdf)
+        response = file_response(pdf, 'generated.pdf')
+
     set_context("pdf-details", {
         "html_size": html_size,
-        "pdf_size": len(pdf),
+        "pdf_size": pdf_size,
     })
 
-    response = make_response(pdf)
-
-    response.headers.set('Content-Type', 'application/pdf')
-    response.headers.set('Content-Disposition', 'attachment; filename="generated.pdf"')
-
     return response
@@ -0,0 +1,102 @@
+import email.message
+import os
+import threading
+from typing import Optional, Tuple
+from urllib.error import HTTPError
+
+import urllib3
+from weasyprint.urls import HTTP_HEADERS, iri_to_uri
+
+# Keep-alive connections to external hosts, shared by all requests of this worker.
+pool = urllib3.PoolManager(
+    maxsize=int(os.environ.get('PREFETCH_CONNECTIONS') or 8),
+    retries=urllib3.Retry(total=None, connect=0, read=0, status=0, other=0, redirect=5),
+)
+
+
+class ResponseTooLarge(Exception):
+    def __init__(self, url: str, max_bytes: int):
+        super().__init__(f'Response of {url} exceeds {max_bytes} bytes')
+
+
+class ByteBudget:
+    """
+    Bytes that concurrent fetches may read together, e.g. the prefetches of a request. Every fetch
+    takes the chunks it reads, so the budget bounds the bytes in flight, not only those finished.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.remaining = max_bytes
+        self._lock = threading.Lock()
+
+    def take(self, url: str, size: int):
+        """
+        :raise: :class:`ResponseTooLarge` once the budget is used up
+        """
+        with self._lock:
+            if size > self.remaining:
+                self.remaining = 0
+                raise ResponseTooLarge(url, self.max_bytes)
+            self.remaining -= size
+
+
+def request(url: str, headers: Optional[dict] = None, timeout: float = 10, max_bytes: Optional[int] = None,
+            budget: Optional[ByteBudget] = None) -> Tuple[str, email.message.Message, bytes]:
+    """
+    GET `url` over a pooled connection. Behaves like :func:`urllib.request.urlopen`: redirects are
+    followed, the body is decompressed and non 2xx responses raise.
+
+    :return: The final URL, the response headers and the body.
+    :raise: :class:`urllib.error.HTTPError` for non 2xx responses
+    :raise: :class:`ResponseTooLarge` if the body exceeds `max_bytes` or `budget`
+    """
+    response = pool.request(
+        'GET',
+        iri_to_uri(url),
+        headers=headers or HTTP_HEADERS,
+        timeout=timeout,
+        preload_content=False,
+    )
+
+    info = email.message.Message()
+    for name, value in response.headers.items():
+        info[name] = value
+
+    if not 200 <= response.status < 300:
+        response.drain_conn()
+        response.release_conn()
+        raise HTTPError(url, response.status, response.reason, info, None)
+
+    try:
+        chunks = []
+        size = 0
+        for chunk in response.stream(64 * 1024):
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise ResponseTooLarge(url, max_bytes)
+            if budget is not None:
+                budget.take(url, len(chunk))
+            chunks.append(chunk)
+    except BaseException:
+        # Don't return a half read connection to the pool
+        response.close()
+        raise
+    finally:
+        response.release_conn()
+
+    return response.url or url, info, b''.join(chunks)
+
+
+def fetch(url: str, timeout: float = 10, budget: Optional[ByteBudget] = None) -> dict:
+    """
+    WeasyPrint url_fetcher result for `url`, fetched with :func:`request`.
+    """
+    redirected_url, info, body = request(url, timeout=timeout, budget=budget)
+    return {
+        'string': body,
+        'mime_type': info.get_content_type(),
+        'encoding': info.get_param('charset'),
+        'redirected_url': redirected_url,
+        'filename': info.get_filename(),
+    }
@@ -0,0 +1,84 @@
+import hashlib
+import os
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+from .cache import cache_from_env, digest
+
+# Images are downscaled to at most the longer side of an A4 page at the requested resolution. The
+# exact size an image is shown at is only known while writing the PDF, where WeasyPrint's `dpi`
+# option downscales it further.
+PAGE_INCHES = 11.7
+DEFAULT_DPI = int(os.environ.get('IMAGE_DPI') or 300)
+DEFAULT_JPEG_QUALITY = 85
+
+# Optimized images keyed by the hash of the original and the settings. An empty value marks images
+# that are kept as they are.
+image_cache = cache_from_env('IMAGE', memory_bytes=64 * 1024 * 1024)
+
+_FORMATS = {b'\xff\xd8\xff': 'JPEG', b'\x89PNG\r\n\x1a\n': 'PNG'}
+_MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+
+def image_format(data: bytes) -> Optional[str]:
+    """
+    `JPEG` or `PNG` by the signature of `data`, `None` for other formats, which aren't optimized.
+    """
+    for signature, name in _FORMATS.items():
+        if data.startswith(signature):
+            return name
+    return None
+
+
+def _optimize(data: bytes, format: str, max_size: int, jpeg_quality: int) -> bytes:
+    with Image.open(BytesIO(data)) as image:
+        if format == 'JPEG':
+            # Decode large JPEGs at a fraction of their size right away
+            image.draft(image.mode, (max_size, max_size))
+        icc_profile = image.info.get('icc_profile')
+        # Metadata isn't copied, the orientation is applied to the pixels instead
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > max_size:
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        output = BytesIO()
+        if format == 'JPEG':
+            image.save(output, 'JPEG', quality=jpeg_quality, optimize=True, icc_profile=icc_profile)
+        else:
+            image.save(output, 'PNG', optimize=True, icc_profile=icc_profile)
+        return output.getvalue()
+
+
+def optimize_image(data: bytes, dpi: Optional[int] = None, jpeg_quality: Optional[int] = None) -> Optional[bytes]:
+    """
+    Downscale a JPEG or PNG image to `dpi` (see `PAGE_INCHES`), recompress it and remove its
+    metadata. Results are cached by the hash of `data` and the settings.
+
+    :return: The optimized image, or `None` if the image is kept as it is: it's not a JPEG or PNG,
+     it couldn't be decoded or the result isn't smaller.
+    """
+    format = image_format(data)
+    if format is None:
+        return None
+
+    max_size = round(PAGE_INCHES * (dpi or DEFAULT_DPI))
+    jpeg_quality = DEFAULT_JPEG_QUALITY if jpeg_quality is None else jpeg_quality
+    key = digest('image', hashlib.sha256(data).digest(), str(max_size), str(jpeg_quality))
+
+    def create() -> bytes:
+        try:
+            optimized = _optimize(data, format, max_size, jpeg_quality)
+        except Exception:
+            # Broken or unsupported images are left to WeasyPrint
+            return b''
+        return optimized if len(optimized) < len(data) else b''
+
+    if image_cache is None:
+        return create() or None
+    return image_cache.get_or_create(key, create) or None
+
+
+def mime_type(data: bytes) -> Optional[str]:
+    return _MIME_TYPES.get(image_format(data))
@@ -0,0 +1,296 @@
+import ipaddress
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Union
+from urllib.parse import urlsplit
+
+from flask import make_response, request, Response, send_file
+from werkzeug.exceptions import HTTPException
+
+from . import http_pool
+from .batch import Assets, render_document
+from .deadline import MAX_RENDER_TIMEOUT, Deadline, DeadlineExceeded, deadline_scope
+from .errors import make_error, RenderError
+from .generate import RenderOptions, request_html, request_options
+from .metrics import JOBS_PENDING, stage
+from .pool import job_pool, reset_job_pool
+
+JOB_DIR = os.environ.get('JOB_DIR') or os.path.join(tempfile.gettempdir(), 'pdf-service-jobs')
+JOB_TTL = int(os.environ.get('JOB_TTL') or 3600)
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE') or 100)
+JOB_TIMEOUT = float(os.environ.get('JOB_TIMEOUT') or MAX_RENDER_TIMEOUT)
+# Webhooks may only call these hosts, internal ones included. Without, only public addresses.
+WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in (os.environ.get('WEBHOOK_ALLOWED_HOSTS') or '').split(',')
+                         if host.strip()]
+
+# Jobs that are still queued or running after this long were lost, e.g. with a restarted worker
+_LOST_AFTER = 24 * 3600
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+logger = logging.getLogger(__name__)
+
+# Jobs submitted by this worker that are queued or running
+_pending = 0
+_pending_lock = threading.Lock()
+_last_expiry = 0.0
+
+
+def _job_path(job_id: str) -> str:
+    if not _JOB_ID_RE.match(job_id):
+        raise RenderError('Job not found', 404)
+    return os.path.join(JOB_DIR, job_id)
+
+
+def _read_state(path: str) -> dict:
+    try:
+        with open(os.path.join(path, 'job.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise RenderError('Job not found', 404)
+
+
+def _update_state(path: str, **changes) -> dict:
+    """
+    Update the state of a job. The state file is replaced atomically, so readers in other workers
+    never see a partial state.
+    """
+    try:
+        state = _read_state(path)
+    except RenderError:
+        state = {}
+    state.update(changes)
+
+    fd, tmp = tempfile.mkstemp(dir=path, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, os.path.join(path, 'job.json'))
+    return state
+
+
+def run_job(path: str, html: Union[bytes, List[bytes]], assets: Assets, options: RenderOptions):
+    """
+    Render the document of a job and store the result. Runs in a process of the job pool, within
+    `JOB_TIMEOUT`.
+    """
+    _update_state(path, status='running', started=time.time())
+    try:
+        try:
+            with deadline_scope(Deadline(JOB_TIMEOUT)):
+                status, data = render_document(html, assets, options)
+        except DeadlineExceeded:
+            status, data = 504, f'Rendering exceeded the deadline of {JOB_TIMEOUT:g} seconds'.encode('utf-8')
+        if status == 200:
+            fd, tmp = tempfile.mkstemp(dir=path, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(path, 'result.pdf'))
+            _update_state(path, status='done', finished=time.time(), pdf_size=len(data))
+        else:
+            _update_state(path, status='failed', finished=time.time(),
+                          error=data.decode('utf-8'), error_status=status)
+    finally:
+        shutil.rmtree(os.path.join(path, 'assets'), ignore_errors=True)
+
+
+def _check_webhook(url: str):
+    """
+    Make sure the webhook doesn't reach into the network of the service: its host has to be in
+    `WEBHOOK_ALLOWED_HOSTS`, or without that list, resolve to public addresses only.
+
+    :raise: :class:`RenderError` for a webhook that isn't allowed
+    """
+    if not url.startswith(('http://', 'https://')):
+        raise RenderError(f'Invalid "webhook" parameter webhook={url}! Only http and https URLs are supported.', 400)
+
+    try:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        host = None
+    if not host:
+        raise RenderError(f'Invalid "webhook" parameter webhook={url}! The URL has no valid host.', 400)
+
+    if WEBHOOK_ALLOWED_HOSTS:
+        if host.lower() not in WEBHOOK_ALLOWED_HOSTS:
+            raise RenderError(f'Invalid "webhook" parameter webhook={url}! The host {host} is not allowed.', 400)
+        return
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port or 80, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError):
+        raise RenderError(f'Invalid "webhook" parameter webhook={url}! The host {host} can\'t be resolved.', 400)
+    for address in addresses:
+        if not ipaddress.ip_address(address.split('%')[0]).is_global:
+            raise RenderError(f'Invalid "webhook" parameter webhook={url}! The host {host} is not public.', 400)
+
+
+def _notify(url: str, state: dict):
+    try:
+        # Again, the host may resolve to other addresses by now
+        _check_webhook(url)
+        # Not following redirects, they could lead to any host
+        http_pool.pool.request(
+            'POST',
+            url,
+            body=json.dumps(state).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            timeout=10,
+            redirect=False,
+        )
+    except RenderError as e:
+        logger.warning('Skipped the webhook of job %s: %s', state.get('id'), e.message)
+    except Exception:
+        logger.warning('Failed to call the webhook of job %s', state.get('id'), exc_info=True)
+
+
+def _job_finished(path: str, webhook: Optional[str], future: Future):
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+    JOBS_PENDING.dec()
+
+    try:
+        # Cancelled if the pool was reset while the job was queued
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or error is not None:
+            if isinstance(error, BrokenProcessPool):
+                reset_job_pool()
+            state = _update_state(path, status='failed', finished=time.time(),
+                                  error='Render process terminated unexpectedly', error_status=500)
+        else:
+            state = _read_state(path)
+    except Exception:
+        # Runs on the thread collecting the results of the pool, which would swallow the error.
+        # The job expired or `JOB_DIR` was removed meanwhile.
+        logger.warning('Failed to record the result of job %s', os.path.basename(path), exc_info=True)
+        return
+
+    if webhook:
+        # Not on the thread that collects the results of the pool
+        threading.Thread(target=_notify, args=(webhook, _describe(state)), daemon=True).start()
+
+
+def _expire():
+    """
+    Remove finished jobs older than `JOB_TTL`, at most once a minute per worker.
+    """
+    global _last_expiry
+    now = time.time()
+    if now - _last_expiry < 60:
+        return
+    _last_expiry = now
+
+    try:
+        entries = list(os.scandir(JOB_DIR))
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        if not _JOB_ID_RE.match(entry.name):
+            continue
+        try:
+            state = _read_state(entry.path)
+        except (RenderError, ValueError):
+            continue
+        finished = state.get('finished')
+        if (finished and now - finished > JOB_TTL) or (not finished and now - state['created'] > _LOST_AFTER):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _describe(state: dict) -> dict:
+    description = {
+        'id': state['id'],
+        'status': state['status'],
+        'url': f'/jobs/{state["id"]}',
+    }
+    if state['status'] == 'failed':
+        description['error'] = state['error']
+        description['error_status'] = state['error_status']
+    if state.get('finished'):
+        description['expires'] = state['finished'] + JOB_TTL
+    return description
+
+
+def submit_job() -> Response:
+    global _pending
+    _expire()
+
+    try:
+        options = request_options()
+        webhook = request.headers.get('X-Webhook') or request.args.get('webhook')
+        if webhook:
+            _check_webhook(webhook)
+
+        with stage('decode'):
+            html, _ = request_html()
+    except HTTPException as e:
+        return make_error(e.description, e.code)
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    with _pending_lock:
+        if _pending >= JOB_QUEUE_SIZE:
+            response = make_error('Job queue is full', 503)
+            response.headers.set('Retry-After', '10')
+            return response
+        _pending += 1
+    JOBS_PENDING.inc()
+
+    job_id = uuid.uuid4().hex
+    path = os.path.join(JOB_DIR, job_id)
+    try:
+        os.makedirs(os.path.join(path, 'assets'))
+        assets = {}
+        for name, file in request.files.items(multi=True):
+            if name == 'index.html':
+                continue
+            asset_path = os.path.join(path, 'assets', str(len(assets)))
+            file.save(asset_path)
+            assets[name] = (asset_path, file.content_type)
+
+        state = _update_state(path, id=job_id, status='queued', created=time.time())
+        try:
+            future = job_pool().submit(run_job, path, html, assets, options)
+        except BrokenProcessPool:
+            reset_job_pool()
+            future = job_pool().submit(run_job, path, html, assets, options)
+    except BaseException:
+        with _pending_lock:
+            _pending -= 1
+        JOBS_PENDING.dec()
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+    future.add_done_callback(lambda f: _job_finished(path, webhook, f))
+
+    response = make_response(_describe(state), 202)
+    response.headers.set('Location', f'/jobs/{job_id}')
+    return response
+
+
+def get_job(job_id: str) -> Response:
+    _expire()
+
+    try:
+        path = _job_path(job_id)
+        state = _read_state(path)
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    if state['status'] == 'done':
+        response = send_file(os.path.join(path, 'result.pdf'), mimetype='application/pdf',
+                             as_attachment=True, download_name='generated.pdf')
+        return response
+
+    return make_response(_describe(state), 200 if state['status'] == 'failed' else 202)
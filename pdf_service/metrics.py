@@ -0,0 +1,127 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from flask import Flask, g, make_response, request, Response
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client import CONTENT_TYPE_LATEST
+from sentry_sdk import start_span
+
+# With several gunicorn workers every process writes its metrics to files in this directory and
+# `/metrics` aggregates them. It's set up by gunicorn.conf.py, without it `/metrics` reports the
+# metrics of the answering process only.
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+_LATENCY_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 1 KiB to 1 GiB
+_SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
+_PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+REQUEST_DURATION = Histogram(
+    'pdf_service_request_duration_seconds', 'Time to answer a request, by endpoint and status.',
+    ['method', 'endpoint', 'status'], buckets=_LATENCY_BUCKETS)
+REQUEST_BYTES = Histogram(
+    'pdf_service_request_bytes', 'Size of request bodies, by endpoint.',
+    ['method', 'endpoint'], buckets=_SIZE_BUCKETS)
+RESPONSE_BYTES = Histogram(
+    'pdf_service_response_bytes', 'Size of response bodies, by endpoint.',
+    ['method', 'endpoint'], buckets=_SIZE_BUCKETS)
+STAGE_DURATION = Histogram(
+    'pdf_service_stage_duration_seconds', 'Time spent in a stage (decode, parse, render, ...).',
+    ['stage'], buckets=_LATENCY_BUCKETS)
+STAGE_ERRORS = Counter(
+    'pdf_service_stage_errors_total', 'Stages that failed, by stage.', ['stage'])
+PAGES = Histogram(
+    'pdf_service_pages', 'Pages of rendered documents.', buckets=_PAGE_BUCKETS)
+URL_FETCHES = Counter(
+    'pdf_service_url_fetches_total', 'Resources fetched by documents, by kind (internal, data, asset, external).',
+    ['kind'])
+RENDERS_IN_FLIGHT = Gauge(
+    'pdf_service_renders_in_flight', 'Requests holding a render slot.', multiprocess_mode='livesum')
+RENDERS_WAITING = Gauge(
+    'pdf_service_renders_waiting', 'Requests waiting for a render slot.', multiprocess_mode='livesum')
+JOBS_PENDING = Gauge(
+    'pdf_service_jobs_pending', 'Asynchronous jobs that are queued or running.', multiprocess_mode='livesum')
+GATEWAY_ACTIVE = Gauge(
+    'pdf_service_gateway_requests_active', 'Requests of the gateway handled by a gateway process.',
+    multiprocess_mode='livesum')
+GATEWAY_WAITING = Gauge(
+    'pdf_service_gateway_requests_waiting', 'Requests of the gateway waiting for a gateway process.',
+    multiprocess_mode='livesum')
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Run a stage of a request in a Sentry span named `name` and record its duration, and whether it
+    failed, in the stage metrics.
+    """
+    start = time.perf_counter()
+    try:
+        with start_span(op=name):
+            yield
+    except BaseException:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(name).observe(time.perf_counter() - start)
+
+
+def _endpoint() -> str:
+    return request.url_rule.rule if request.url_rule is not None else 'unknown'
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response: Response) -> Response:
+    if request.url_rule is not None and request.url_rule.rule == '/metrics':
+        return response
+
+    endpoint = _endpoint()
+    REQUEST_DURATION.labels(request.method, endpoint, response.status_code).observe(
+        time.perf_counter() - g.get('metrics_start', time.perf_counter()))
+    if request.content_length:
+        REQUEST_BYTES.labels(request.method, endpoint).observe(request.content_length)
+    if response.content_length is not None:
+        RESPONSE_BYTES.labels(request.method, endpoint).observe(response.content_length)
+    return response
+
+
+def instrument(app: Flask):
+    """
+    Record the duration and the sizes of all requests of `app`.
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+
+def live_gauges() -> Optional[Dict[str, float]]:
+    """
+    Values of the `livesum` gauges (renders in flight, ...) summed over the live workers, by metric
+    name. `None` without `PROMETHEUS_MULTIPROC_DIR`, the values are then only known per process.
+    """
+    if not MULTIPROC_DIR:
+        return None
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return {
+        sample.name: sample.value
+        for metric in registry.collect() if metric.type == 'gauge'
+        for sample in metric.samples
+    }
+
+
+def metrics_response() -> Response:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    response = make_response(generate_latest(registry))
+    response.headers.set('Content-Type', CONTENT_TYPE_LATEST)
+    return response
@@ -0,0 +1,105 @@
+import json
+from typing import Callable, Dict, NamedTuple, Optional
+
+from .errors import RenderError
+from .images import DEFAULT_DPI
+
+_TRUE = ('1', 'true', 'yes', 'on')
+_FALSE = ('0', 'false', 'no', 'off')
+
+
+class PdfOptions(NamedTuple):
+    """
+    Size options of WeasyPrint's `write_pdf`. Options that are `None` aren't set, they fall back to
+    the style profile and then to the WeasyPrint defaults (see :meth:`merge`).
+    """
+    # Downscale and recompress images, see `pdf_service.images`
+    optimize_images: Optional[bool] = None
+    # 0 to 95, used for JPEG images when optimizing images
+    jpeg_quality: Optional[int] = None
+    # Maximum resolution of embedded images, `IMAGE_DPI` if unset and images are optimized
+    dpi: Optional[int] = None
+    # Embed whole fonts instead of the used glyphs
+    full_fonts: Optional[bool] = None
+    # Keep the hinting of embedded fonts
+    hinting: Optional[bool] = None
+
+    def merge(self, defaults: 'PdfOptions') -> 'PdfOptions':
+        """
+        These options, with the unset ones taken from `defaults`.
+        """
+        return PdfOptions(*(value if value is not None else default for value, default in zip(self, defaults)))
+
+    def write_pdf_options(self) -> dict:
+        """
+        Keyword arguments of `write_pdf`. Optimized images are limited to `IMAGE_DPI` by default.
+        """
+        return {
+            'optimize_images': bool(self.optimize_images),
+            'jpeg_quality': self.jpeg_quality,
+            'dpi': self.dpi or (DEFAULT_DPI if self.optimize_images else None),
+            'full_fonts': bool(self.full_fonts),
+            'hinting': bool(self.hinting),
+        }
+
+
+def _bool(name: str, value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in _TRUE + _FALSE:
+        return value.lower() in _TRUE
+    raise RenderError(f'Invalid "{name}" option {name}={value}! Supported values are: true, false.', 400)
+
+
+def _int(name: str, value, minimum: int, maximum: int) -> int:
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = None
+    if isinstance(value, bool) or number is None or not minimum <= number <= maximum:
+        raise RenderError(f'Invalid "{name}" option {name}={value}! Supported values are: {minimum} to {maximum}.', 400)
+    return number
+
+
+_PARSERS: Dict[str, Callable] = {
+    'optimize_images': _bool,
+    'jpeg_quality': lambda name, value: _int(name, value, 0, 95),
+    'dpi': lambda name, value: _int(name, value, 1, 2400),
+    'full_fonts': _bool,
+    'hinting': _bool,
+}
+
+
+def parse_options(values: dict, dashed: bool = False) -> PdfOptions:
+    """
+    Options from `values`, e.g. query parameters (`dashed` names like `jpeg-quality`) or the
+    `pdf.json` of a style profile. Missing options aren't set.
+
+    :raise: :class:`RenderError` for invalid values
+    """
+    options = {}
+    for field, parse in _PARSERS.items():
+        name = field.replace('_', '-') if dashed else field
+        value = values.get(name)
+        if value is not None and value != '':
+            options[field] = parse(name, value)
+    return PdfOptions(**options)
+
+
+def load_options(path: str) -> PdfOptions:
+    """
+    Options of a `pdf.json` file, no options if it doesn't exist.
+
+    :raise: :class:`RenderError` for an invalid file
+    """
+    try:
+        with open(path, 'rb') as file:
+            values = json.load(file)
+    except FileNotFoundError:
+        return PdfOptions()
+    except ValueError as e:
+        raise RenderError(f'Invalid PDF options {path}: {e}')
+
+    if not isinstance(values, dict) or set(values) - set(_PARSERS):
+        raise RenderError(f'Invalid PDF options {path}! Supported options are: {", ".join(_PARSERS)}.')
+    return parse_options(values)
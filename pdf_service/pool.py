@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from .deadline import clear_deadline
+
+# Every worker has a pool, together they use each CPU once
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT') or 1)
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES') or max(1, (os.cpu_count() or 1) // WORKER_COUNT))
+# `/jobs` have their own pool, so queued jobs never hold up the renders of requests
+JOB_PROCESSES = int(os.environ.get('JOB_PROCESSES') or 1)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_job_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _create_pool(processes: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('fork'),
+        initializer=clear_deadline,
+    )
+
+
+def render_pool() -> ProcessPoolExecutor:
+    """
+    Pool of render processes of the current worker, created on first use.
+
+    Processes are forked from the worker, so they start with everything the worker already loaded,
+    like the parsed `CSS_PATH` stylesheets, instead of importing and parsing them again.
+    """
+    global _executor
+    if _executor is None:
+        _executor = _create_pool(RENDER_PROCESSES)
+    return _executor
+
+
+def reset_render_pool():
+    """
+    Drop the pool, e.g. after a render process died and the pool is broken.
+    The next :func:`render_pool` call starts a new one.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def job_pool() -> ProcessPoolExecutor:
+    """
+    Pool of the processes rendering the `/jobs` of the current worker, created on first use.
+    """
+    global _job_executor
+    if _job_executor is None:
+        _job_executor = _create_pool(JOB_PROCESSES)
+    return _job_executor
+
+
+def reset_job_pool():
+    """
+    Drop the job pool after one of its processes died, like :func:`reset_render_pool`.
+    """
+    global _job_executor
+    if _job_executor is not None:
+        _job_executor.shutdown(wait=False, cancel_futures=True)
+        _job_executor = None
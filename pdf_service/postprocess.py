@@ -0,0 +1,62 @@
+from io import BytesIO
+from typing import BinaryIO, Callable, Dict, Optional, Union
+
+import pypdf
+
+
+def rotation_finisher(rotation: int) -> Callable:
+    """
+    WeasyPrint `write_pdf` finisher that rotates all pages while the PDF is written, so rotating
+    a generated PDF doesn't need a second parse.
+    """
+    def finisher(document, pdf):
+        # Kids is a flat list of references: number, generation, 'R'
+        for number in pdf.pages['Kids'][::3]:
+            pdf.objects[number]['Rotate'] = rotation
+
+    return finisher
+
+
+def postprocess(data: Union[bytes, BinaryIO], rotation: Optional[int] = None, password: Optional[str] = None,
+                metadata: Optional[Dict[str, str]] = None,
+                target: Optional[BinaryIO] = None) -> Union[bytes, BinaryIO]:
+    """
+    Apply all requested transforms to an existing PDF in a single read and write pass.
+
+    :param data: The PDF as bytes or as a seekable file.
+    :param rotation: Rotation of all pages in degrees (90, 180 or 270).
+    :param password: Encrypt with this password (AES-256).
+    :param metadata: Document information entries to set, e.g. `{'/Title': 'Invoice'}`.
+    :param target: File to write the result to, it's returned rewound. Without a target the result
+     is returned as bytes.
+    :return: `data` unchanged if there is nothing to do.
+    """
+    if not rotation and not password and not metadata:
+        return data
+
+    reader = pypdf.PdfReader(BytesIO(data) if isinstance(data, bytes) else data)
+
+    if password and reader.is_encrypted:
+        raise Exception('PDF is already encrypted. Can not re-encrypt encrypted PDF.');
+
+    writer = pypdf.PdfWriter()
+
+    for page in reader.pages:
+        if rotation:
+            page.rotation = rotation
+        writer.add_page(page)
+
+    if metadata:
+        writer.add_metadata(metadata)
+
+    if password:
+        writer.encrypt(password, algorithm="AES-256")
+
+    if target is not None:
+        writer.write(target)
+        target.seek(0)
+        return target
+
+    with BytesIO() as output:
+        writer.write(output)
+        return output.getvalue()
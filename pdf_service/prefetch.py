@@ -0,0 +1,165 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import urljoin, urlparse
+
+from weasyprint import HTML
+
+from .http_pool import ByteBudget
+
+PREFETCH_CONNECTIONS = int(os.environ.get('PREFETCH_CONNECTIONS') or 8)
+PREFETCH_MAX_BYTES = int(os.environ.get('PREFETCH_MAX_BYTES') or 50 * 1024 * 1024)
+PREFETCH_TIMEOUT = float(os.environ.get('PREFETCH_TIMEOUT') or 10)
+
+_CSS_URL_RE = re.compile(r'''url\(\s*(?:"([^"]*)"|'([^']*)'|([^)'"\s]+))\s*\)|@import\s+(?:"([^"]*)"|'([^']*)')''')
+
+# (tag, attribute) pairs WeasyPrint fetches. Tags of SVG content are namespaced by html5lib.
+_SVG = '{http://www.w3.org/2000/svg}'
+_XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+_RESOURCE_ATTRIBUTES = {
+    'img': ('src',),
+    'embed': ('src',),
+    'object': ('data',),
+    'input': ('src',),
+    'video': ('poster',),
+    _SVG + 'image': ('href', _XLINK_HREF),
+    _SVG + 'use': ('href', _XLINK_HREF),
+}
+_LINK_RELS = {'stylesheet', 'icon', 'attachment'}
+
+# Results fetched before the request reached the render process, see `pdf_service.gateway`
+_ready: ContextVar[Optional[Dict[str, dict]]] = ContextVar('prefetched', default=None)
+
+
+def css_urls(text: str, base_url: str) -> List[str]:
+    """
+    Absolute URLs of the `url()` and `@import` references in a stylesheet.
+    """
+    return [urljoin(base_url, next(group for group in match.groups() if group is not None))
+            for match in _CSS_URL_RE.finditer(text)]
+
+
+def collect_urls(html: HTML) -> List[str]:
+    """
+    External (http and https) URLs referenced by a parsed document: resource attributes, linked
+    stylesheets and `url()` in `style` attributes and elements. References inside fetched
+    stylesheets are found by :func:`prefetch`.
+    """
+    base_url = html.base_url or ''
+    urls = []
+    for element in html.etree_element.iter():
+        if not isinstance(element.tag, str):
+            continue
+
+        tag = element.tag.removeprefix('{http://www.w3.org/1999/xhtml}')
+        for attribute in _RESOURCE_ATTRIBUTES.get(tag, ()):
+            if element.get(attribute):
+                urls.append(urljoin(base_url, element.get(attribute).strip()))
+
+        if tag == 'link' and element.get('href') and \
+                _LINK_RELS.intersection((element.get('rel') or '').lower().split()):
+            urls.append(urljoin(base_url, element.get('href').strip()))
+
+        if tag == 'style' and element.text:
+            urls.extend(css_urls(element.text, base_url))
+
+        if element.get('style'):
+            urls.extend(css_urls(element.get('style'), base_url))
+
+    return _external(urls)
+
+
+def _external(urls: Iterable[str]) -> List[str]:
+    result = []
+    for url in urls:
+        url = url.split('#')[0]
+        parsed = urlparse(url)
+        if parsed.scheme in ('http', 'https') and parsed.netloc and url not in result:
+            result.append(url)
+    return result
+
+
+def prefetch(urls: List[str], fetch: Callable[[str, float, ByteBudget], dict],
+             connections: int = PREFETCH_CONNECTIONS,
+             max_bytes: int = PREFETCH_MAX_BYTES,
+             timeout: float = PREFETCH_TIMEOUT) -> Dict[str, dict]:
+    """
+    Fetch `urls` concurrently, followed by the resources referenced by fetched stylesheets.
+
+    Fetching stops when the fetches together read `max_bytes` or after `timeout` seconds, the
+    results collected until then are returned. Failed fetches are left out; WeasyPrint fetches
+    those URLs again during rendering, which reports the error.
+
+    :param fetch: Called with the URL, the remaining time and the :class:`ByteBudget` shared by all
+     fetches, which it takes the bytes it reads from while reading. Returns a WeasyPrint url_fetcher
+     result with the body as `string`.
+    :return: Results by URL.
+    """
+    results = {}
+    if connections <= 0 or not urls:
+        return results
+
+    deadline = time.monotonic() + timeout
+    budget = ByteBudget(max_bytes)
+    seen = set(urls)
+
+    executor = ThreadPoolExecutor(max_workers=connections)
+    try:
+        def submit(url: str):
+            return executor.submit(fetch, url, max(0.0, deadline - time.monotonic()), budget)
+
+        pending = {submit(url): url for url in urls}
+        while pending:
+            done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+
+            for future in done:
+                url = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    continue
+
+                results[url] = result
+
+                if result.get('mime_type') == 'text/css':
+                    encoding = result.get('encoding') or 'utf-8'
+                    text = result['string'].decode(encoding, errors='replace')
+                    base_url = result.get('redirected_url') or url
+                    for nested in _external(css_urls(text, base_url)):
+                        if nested not in seen:
+                            seen.add(nested)
+                            pending[submit(nested)] = nested
+
+            if not budget.remaining:
+                break
+    finally:
+        # Fetches still running are bounded by their own timeout, don't wait for them
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def prefetched() -> Dict[str, dict]:
+    """
+    Results fetched for the current request before it was rendered, by URL.
+    """
+    return _ready.get() or {}
+
+
+@contextmanager
+def prefetched_scope(results: Dict[str, dict]):
+    """
+    Serve `results` to the fetches of documents rendered in the scope, instead of fetching them
+    again (see :class:`pdf_service.URLFetchHandler.URLFetchHandler`).
+    """
+    token = _ready.set(results)
+    try:
+        yield
+    finally:
+        _ready.reset(token)
@@ -0,0 +1,147 @@
+import re
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import fitz
+from PIL import Image
+from flask import make_response, request, Response
+
+from .cache import cache_from_env, digest
+from .chunks import render_in_pool
+from .deadline import interruptible
+from .errors import make_error, RenderError
+from .generate import cache_key, render_pdf, request_html, request_options
+from .metrics import stage
+from .streaming import Part, streaming_response
+
+FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+DEFAULT_DPI = 72
+MAX_DPI = 300
+# Pages of a single request
+MAX_PREVIEW_PAGES = 100
+
+# Rendered pages keyed by the hash of the document, the page and the image settings
+preview_cache = cache_from_env('PREVIEW', memory_bytes=32 * 1024 * 1024)
+
+_PAGES_RE = re.compile(r'^\d+(-\d+)?(,\d+(-\d+)?)*$')
+
+
+def parse_pages(value: str) -> List[int]:
+    """
+    Page numbers of a `pages` parameter like `1`, `1-3` or `1,4-5`, numbered from 1. Returns the
+    0-based page indexes in ascending order.
+
+    :raise: :class:`RenderError` for invalid page numbers
+    """
+    value = value.replace(' ', '')
+    if not _PAGES_RE.match(value):
+        raise RenderError(f'Invalid "pages" parameter pages={value}! Use page numbers and ranges, e.g. 1,3-5.', 400)
+
+    pages = set()
+    for item in value.split(','):
+        first, _, last = item.partition('-')
+        first, last = int(first), int(last or first)
+        if first < 1 or last < first:
+            raise RenderError(f'Invalid "pages" parameter pages={value}! Pages are numbered from 1.', 400)
+        if len(pages) + last - first + 1 > MAX_PREVIEW_PAGES:
+            raise RenderError(f'Too many pages, at most {MAX_PREVIEW_PAGES} pages can be previewed at once.', 400)
+        pages.update(range(first - 1, last))
+    return sorted(pages)
+
+
+def rasterize(document: fitz.Document, page: int, dpi: int, format: str) -> bytes:
+    """
+    Draw a page of `document` as PNG or WebP image.
+    """
+    pixmap = document[page].get_pixmap(dpi=dpi, alpha=False)
+    if format == 'png':
+        return pixmap.tobytes('png')
+
+    image = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+    output = BytesIO()
+    image.save(output, 'WEBP', quality=80)
+    return output.getvalue()
+
+
+def _open(pdf: bytes) -> fitz.Document:
+    try:
+        document = fitz.open(stream=pdf, filetype='pdf')
+    except Exception as e:
+        raise RenderError('Invalid PDF. ' + str(e), 400)
+    if document.needs_pass:
+        raise RenderError('PDF is encrypted. Can not preview encrypted PDF.', 400)
+    return document
+
+
+def _request_pdf() -> Optional[bytes]:
+    """
+    The PDF of the current request, sent as body or as `pdf` part, or `None` for HTML.
+    """
+    if request.content_type and request.content_type.startswith('application/pdf'):
+        return request.get_data()
+    if 'pdf' in request.files:
+        return request.files['pdf'].read()
+    return None
+
+
+def preview() -> Response:
+    """
+    Images of selected pages of a PDF, or of HTML sent like to `/generate`. Images are cached, so
+    the preview of a document that was previewed before isn't rendered again.
+    """
+    format = request.args.get('format', 'png')
+    if format not in FORMATS:
+        return make_error(f'Invalid "format" parameter format={format}! Supported values are: png, webp.', 400)
+    dpi = request.args.get('dpi', DEFAULT_DPI, type=int)
+    if not 1 <= dpi <= MAX_DPI:
+        return make_error(f'Invalid "dpi" parameter dpi={dpi}! Supported values are: 1 to {MAX_DPI}.', 400)
+    partial = request.args.get('partial', 'false').lower() in ('1', 'true', 'yes')
+
+    try:
+        pages = parse_pages(request.args.get('pages', '1'))
+
+        with stage('decode'):
+            pdf = _request_pdf()
+            if pdf is not None:
+                source = digest('pdf', pdf)
+            else:
+                html, _ = request_html()
+                options = request_options()
+                # A partial layout depends on the number of laid out pages, e.g. with `counter(pages)`
+                laid_out = str(pages[-1] + 1) if partial else None
+                source = digest('html', cache_key(html, request.files, options), laid_out)
+
+        keys = {page: digest(source, str(page), str(dpi), format) for page in pages}
+        images: Dict[int, bytes] = {}
+        if preview_cache is not None:
+            for page, key in keys.items():
+                image = preview_cache.get(key)
+                if image is not None:
+                    images[page] = image
+
+        missing = [page for page in pages if page not in images]
+        if missing:
+            if pdf is None:
+                # With `partial` only the pages up to the last previewed page are laid out
+                render = render_pdf if interruptible() else render_in_pool
+                pdf = render(html, request.files, options, max_pages=pages[-1] + 1 if partial else None)
+
+            with stage('preview'):
+                document = _open(pdf)
+                if missing[-1] >= document.page_count:
+                    raise RenderError(f'Page {missing[-1] + 1} doesn\'t exist, the document has {document.page_count} pages.', 400)
+                for page in missing:
+                    images[page] = rasterize(document, page, dpi, format)
+                    if preview_cache is not None:
+                        preview_cache.set(keys[page], images[page])
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    if len(pages) == 1:
+        response = make_response(images[pages[0]])
+        response.headers.set('Content-Type', FORMATS[format])
+        response.headers.set('Content-Disposition', f'inline; filename="page-{pages[0] + 1}.{format}"')
+        return response
+
+    parts = [Part(f'page-{page + 1}.{format}', images[page], FORMATS[format]) for page in pages]
+    return streaming_response(parts, 'zip', 'preview')
@@ -1,17 +1,4 @@
-from io import BytesIO
-
-import pypdf
+from .postprocess import postprocess
 
 def rotate_pdf(data: bytes, rotation: int) -> bytes:
-    reader = pypdf.PdfReader(BytesIO(data))
-    writer = pypdf.PdfWriter(reader)
-    
-    for page in reader.pages:
-        page.rotation = rotation
-        writer.add_page(page)
-    
-    with BytesIO() as output:
-        writer.write(output)
-        output.seek(0)
-        return output.read()
-    
\ No newline at end of file
+    return postprocess(data, rotation=rotation)
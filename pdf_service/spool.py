@@ -0,0 +1,147 @@
+import io
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterator, Optional
+
+from flask import Request, request, Response
+
+# Bodies and PDFs larger than this are kept in temporary files instead of memory
+SPOOL_THRESHOLD = int(os.environ.get('SPOOL_THRESHOLD') or 8 * 1024 * 1024)
+# Uploaded files larger than this are kept in temporary files, like Werkzeug does
+UPLOAD_SPOOL_THRESHOLD = 500 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class _SpooledFile:
+    """
+    Bytes in memory, moved to a named temporary file once they grow larger than `max_size`, like
+    the gateway's `_Spool`. On disk, the file has a path, so PyMuPDF can open it instead of reading
+    it back into memory (see :func:`file_path`). Other file methods are those of the current file.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.name: Optional[str] = None
+        self._file = io.BytesIO()
+
+    def write(self, data) -> int:
+        if self.name is None and self._file.tell() + memoryview(data).nbytes > self.max_size:
+            self._move_to_disk()
+        return self._file.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def _move_to_disk(self):
+        memory = self._file
+        self._file = tempfile.NamedTemporaryFile(prefix='pdf-service-spool-')
+        self._file.write(memory.getbuffer())
+        self._file.seek(memory.tell())
+        self.name = self._file.name
+        memory.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def spooled(max_size: Optional[int] = None) -> BinaryIO:
+    """
+    A temporary file that stays in memory up to `max_size` bytes, `SPOOL_THRESHOLD` by default, and
+    moves to disk when it grows larger. It's removed when closed.
+    """
+    return _SpooledFile(max_size or SPOOL_THRESHOLD)
+
+
+def file_path(file: BinaryIO) -> Optional[str]:
+    """
+    Path of a :func:`spooled` file once it moved to disk, None while it's in memory. The file is
+    flushed, so the path can be opened.
+    """
+    name = getattr(file, 'name', None)
+    if not isinstance(name, str) or not os.path.isfile(name):
+        return None
+    file.flush()
+    return name
+
+
+class SpooledRequest(Request):
+    """
+    Request whose uploaded files are :func:`spooled` files, so they have a path once they're on disk.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return spooled(UPLOAD_SPOOL_THRESHOLD)
+
+
+def request_body() -> BinaryIO:
+    """
+    Body of the current request, read in chunks into a :func:`spooled` file.
+    """
+    body = spooled()
+    shutil.copyfileobj(request.stream, body, CHUNK_SIZE)
+    body.seek(0)
+    return body
+
+
+class _Unnamed:
+    """
+    A file without `name`. PyMuPDF writes to the path of files with a name, which a spooled file
+    in memory doesn't have.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+
+    def __getattr__(self, name: str):
+        if name == 'name':
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+
+def save_document(document, target: BinaryIO, **options) -> BinaryIO:
+    """
+    Save a PyMuPDF document to `target`, e.g. a :func:`spooled` file, and rewind it.
+    """
+    document.save(_Unnamed(target), **options)
+    target.seek(0)
+    return target
+
+
+def file_size(file: BinaryIO) -> int:
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    return size
+
+
+def _chunks(file: BinaryIO) -> Iterator[bytes]:
+    try:
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+
+def file_response(file: BinaryIO, filename: str, content_type: str = 'application/pdf') -> Response:
+    """
+    Response streaming `file` in chunks. The file is closed when the response is done.
+    """
+    response = Response(_chunks(file), direct_passthrough=True)
+    response.content_length = file_size(file)
+    response.call_on_close(file.close)
+    response.headers.set('Content-Type', content_type)
+    response.headers.set('Content-Disposition', f'attachment; filename="{filename}"')
+    return response
@@ -0,0 +1,95 @@
+import uuid
+import zipfile
+from typing import Iterable, Iterator, NamedTuple
+
+from flask import Response, stream_with_context
+
+FORMATS = ('zip', 'multipart')
+
+
+class Part(NamedTuple):
+    """
+    A single result of a batch response.
+    """
+    filename: str
+    data: bytes
+    content_type: str = 'application/pdf'
+    status: int = 200
+
+
+class _ZipBuffer:
+    """
+    Write-only file for :class:`zipfile.ZipFile`. As it isn't seekable, the archive is written
+    with data descriptors and can be sent while it's being written.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(parts: Iterable[Part]) -> Iterator[bytes]:
+    """
+    Zip archive of `parts`, yielded part by part so only one part is held in memory at a time.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for part in parts:
+            archive.writestr(part.filename, part.data)
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def _quote(value: str) -> str:
+    """
+    `value` as a quoted string of a header. Line breaks are replaced, so they can't end the header.
+    """
+    value = value.replace('\r', ' ').replace('\n', ' ')
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def stream_multipart(parts: Iterable[Part], boundary: str) -> Iterator[bytes]:
+    """
+    `multipart/mixed` body of `parts`. The status of every part is sent as its `X-Status` header.
+    """
+    for part in parts:
+        yield (
+            f'--{boundary}\r\n'
+            f'Content-Type: {part.content_type}\r\n'
+            f'Content-Disposition: attachment; filename={_quote(part.filename)}\r\n'
+            f'Content-Length: {len(part.data)}\r\n'
+            f'X-Status: {part.status}\r\n'
+            '\r\n'
+        ).encode('utf-8')
+        yield part.data
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode('utf-8')
+
+
+def streaming_response(parts: Iterable[Part], format: str, filename: str) -> Response:
+    """
+    Stream `parts` as a zip archive (`format='zip'`) or as a `multipart/mixed` response.
+
+    :param filename: Name of the zip archive, without extension.
+    """
+    if format == 'multipart':
+        boundary = uuid.uuid4().hex
+        response = Response(stream_with_context(stream_multipart(parts, boundary)))
+        response.headers.set('Content-Type', f'multipart/mixed; boundary={boundary}')
+        return response
+
+    response = Response(stream_with_context(stream_zip(parts)))
+    response.headers.set('Content-Type', 'application/zip')
+    response.headers.set('Content-Disposition', f'attachment; filename="{filename}.zip"')
+    return response
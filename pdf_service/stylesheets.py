@@ -0,0 +1,253 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import weasyprint
+import weasyprint.css
+from weasyprint.css import get_child_text, media_queries
+from weasyprint.css.counters import CounterStyle
+from weasyprint.html import element_has_link_type
+from weasyprint.logger import LOGGER
+from weasyprint.urls import URLFetchingError, get_url_attribute
+
+from .URLFetchHandler import read_url
+from .cache import digest
+from .errors import RenderError
+from .pdf_options import PdfOptions, load_options
+
+CSS_PATH = os.environ.get('CSS_PATH') or './pdf_service/css'
+STYLESHEET_CACHE_SIZE = int(os.environ.get('STYLESHEET_CACHE_SIZE') or 256)
+
+_PROFILE_RE = re.compile(r'^[A-Za-z0-9_-]{1,100}$')
+
+
+class ParsedStylesheet(NamedTuple):
+    """
+    A parsed stylesheet and the `@font-face` and `@counter-style` rules WeasyPrint registers while
+    parsing. As these belong to a single document, they are registered again for every document
+    the stylesheet is applied to (see :meth:`register`).
+    """
+    css: weasyprint.CSS
+    font_faces: List[dict]
+    counter_styles: Dict[str, dict]
+
+    def register(self, font_config, counter_style: CounterStyle, url_fetcher: Callable):
+        if font_config is not None:
+            for rule_descriptors in self.font_faces:
+                font_config.add_font_face(rule_descriptors, url_fetcher)
+        counter_style.update(self.counter_styles)
+
+
+class _FontFaces(list):
+    """
+    Stands in for the font configuration while parsing and collects the `@font-face` rules.
+    """
+
+    def add_font_face(self, rule_descriptors: dict, url_fetcher: Callable):
+        self.append(rule_descriptors)
+
+
+# Parsed stylesheets of this worker by content hash
+_parsed = OrderedDict()
+_parsed_lock = threading.Lock()
+
+
+def parse(data: bytes, base_url: Optional[str] = None, url_fetcher: Callable = weasyprint.default_url_fetcher,
+          media_type: str = 'print', encoding: Optional[str] = None) -> ParsedStylesheet:
+    """
+    Parse a stylesheet, or take it from the cache of this worker if the same stylesheet was parsed
+    before. The least recently used stylesheets are evicted when more than `STYLESHEET_CACHE_SIZE`
+    are cached.
+
+    Stylesheets with `@import` rules are not cached, as the imported stylesheets may change.
+    """
+    key = digest(media_type, base_url or '', encoding or '', data)
+    with _parsed_lock:
+        parsed = _parsed.get(key)
+        if parsed is not None:
+            _parsed.move_to_end(key)
+            return parsed
+
+    imported = []
+
+    def import_fetcher(url: str):
+        imported.append(url)
+        return url_fetcher(url)
+
+    font_faces = _FontFaces()
+    counter_styles = CounterStyle()
+    css = weasyprint.CSS(
+        file_obj=BytesIO(data),
+        encoding=encoding,
+        base_url=base_url,
+        url_fetcher=import_fetcher,
+        media_type=media_type,
+        font_config=font_faces,
+        counter_style=counter_styles,
+    )
+    parsed = ParsedStylesheet(css, list(font_faces), dict(counter_styles))
+
+    if not imported:
+        with _parsed_lock:
+            _parsed[key] = parsed
+            while len(_parsed) > STYLESHEET_CACHE_SIZE:
+                _parsed.popitem(last=False)
+
+    return parsed
+
+
+def _fetch(url: str, url_fetcher: Callable, media_type: str) -> Optional[ParsedStylesheet]:
+    try:
+        result = read_url(url_fetcher, url)
+    except Exception as exc:
+        raise URLFetchingError(f'{type(exc).__name__}: {exc}')
+
+    if result['mime_type'] != 'text/css':
+        LOGGER.error('Unsupported stylesheet type %s for %s', result['mime_type'], url)
+        return None
+
+    data, encoding = result['string'], result.get('encoding')
+    if isinstance(data, str):
+        data, encoding = data.encode('utf-8'), 'utf-8'
+    return parse(data, result['redirected_url'], url_fetcher, media_type, encoding)
+
+
+def find_stylesheets(wrapper_element, device_media_type, url_fetcher, base_url,
+                     font_config, counter_style, page_rules):
+    """
+    Replaces :func:`weasyprint.css.find_stylesheets`, which parses the `<style>` elements and
+    linked stylesheets of every document again. Here they are taken from the cache of
+    :func:`parse`, so stylesheets shared by many requests, like uploaded brand stylesheets, are
+    parsed once per worker.
+
+    Parsed stylesheets keep their own `@page` rules, so `page_rules` isn't used.
+    """
+    for wrapper in wrapper_element.query_all('style', 'link'):
+        element = wrapper.etree_element
+        mime_type = element.get('type', 'text/css').split(';', 1)[0].strip()
+        if mime_type != 'text/css':
+            continue
+        media = [query.strip() for query in (element.get('media', '').strip() or 'all').split(',')]
+        if not media_queries.evaluate_media_query(media, device_media_type):
+            continue
+
+        if element.tag == 'style':
+            parsed = parse(get_child_text(element).encode('utf-8'), base_url, url_fetcher, device_media_type, 'utf-8')
+        elif element.tag == 'link' and element.get('href'):
+            if not element_has_link_type(element, 'stylesheet') or element_has_link_type(element, 'alternate'):
+                continue
+            href = get_url_attribute(element, 'href', base_url)
+            if href is None:
+                continue
+            try:
+                parsed = _fetch(href, url_fetcher, device_media_type)
+            except URLFetchingError as exc:
+                LOGGER.error('Failed to load stylesheet at %s: %s', href, exc)
+                continue
+            if parsed is None:
+                continue
+        else:
+            continue
+
+        parsed.register(font_config, counter_style, url_fetcher)
+        yield parsed.css
+
+
+weasyprint.css.find_stylesheets = find_stylesheets
+
+
+class StyleProfile(NamedTuple):
+    """
+    Stylesheets of a directory in `CSS_PATH` and the PDF options of its `pdf.json`.
+    """
+    name: str
+    # (path, modification time, size) of the stylesheet and option files, to notice changes
+    signature: Tuple[Tuple[str, int, int], ...]
+    stylesheets: List[ParsedStylesheet]
+    # Content hash of the stylesheets and options
+    digest: str
+    pdf_options: PdfOptions = PdfOptions()
+
+
+_profiles: Dict[str, StyleProfile] = {}
+
+
+def _load_profile(name: str) -> StyleProfile:
+    directory = os.path.join(CSS_PATH, name)
+    try:
+        entries = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.css') and entry.is_file()),
+                         key=lambda entry: entry.name)
+    except (FileNotFoundError, NotADirectoryError):
+        raise RenderError(f'Unknown "style" parameter style={name}!', 400)
+
+    signature = tuple((entry.path, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in entries)
+    options_path = os.path.join(directory, 'pdf.json')
+    if os.path.isfile(options_path):
+        stat = os.stat(options_path)
+        signature += ((options_path, stat.st_mtime_ns, stat.st_size),)
+
+    profile = _profiles.get(name)
+    if profile is not None and profile.signature == signature:
+        return profile
+
+    stylesheets = []
+    h = hashlib.sha256()
+    for entry in entries:
+        with open(entry.path, 'rb') as file:
+            data = file.read()
+        h.update(data)
+        stylesheets.append(parse(data, base_url=entry.path))
+    pdf_options = load_options(options_path)
+    h.update(repr(tuple(pdf_options)).encode('utf-8'))
+
+    profile = StyleProfile(name, signature, stylesheets, h.hexdigest(), pdf_options)
+    _profiles[name] = profile
+    return profile
+
+
+def style_profile(name: Optional[str] = None) -> StyleProfile:
+    """
+    The stylesheets applied to a document: the `.css` files of `CSS_PATH`, followed by those of the
+    `CSS_PATH/<name>` directory if a profile is selected. Stylesheets are parsed again when a file
+    of the profile was changed, added or removed.
+
+    PDF options of the profile's `pdf.json` take precedence over those of `CSS_PATH/pdf.json`.
+
+    :raise: :class:`RenderError` if the profile doesn't exist
+    """
+    common = _load_profile('')
+    if not name:
+        return common
+
+    if not _PROFILE_RE.match(name):
+        raise RenderError(f'Unknown "style" parameter style={name}!', 400)
+    profile = _load_profile(name)
+    return StyleProfile(
+        name,
+        common.signature + profile.signature,
+        common.stylesheets + profile.stylesheets,
+        digest(common.digest, profile.digest),
+        profile.pdf_options.merge(common.pdf_options),
+    )
+
+
+def load_style_profiles() -> List[str]:
+    """
+    Parse the stylesheets of all profiles, so the first requests don't have to.
+
+    :return: Names of the profiles
+    """
+    _load_profile('')
+    names = []
+    for entry in sorted(os.scandir(CSS_PATH), key=lambda entry: entry.name):
+        if entry.is_dir() and _PROFILE_RE.match(entry.name):
+            _load_profile(entry.name)
+            names.append(entry.name)
+    return names
+
+
+load_style_profiles()
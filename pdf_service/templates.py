@@ -0,0 +1,281 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Tuple
+
+import jinja2
+from flask import make_response, request, Response
+from jinja2.sandbox import SandboxedEnvironment
+from sentry_sdk import set_context
+from werkzeug.datastructures import FileStorage, MultiDict
+
+from .errors import make_error, RenderError
+from .generate import encrypt_output, render_pdf, request_options
+from .metrics import stage
+from .spool import file_response, file_size, spooled
+from .stylesheets import ParsedStylesheet, parse
+
+TEMPLATE_DIR = os.environ.get('TEMPLATE_DIR') or os.path.join(tempfile.gettempdir(), 'pdf-service-templates')
+TEMPLATE_CACHE_SIZE = int(os.environ.get('TEMPLATE_CACHE_SIZE') or 32)
+
+_TEMPLATE_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,100}$')
+
+_environment = SandboxedEnvironment(autoescape=True)
+
+
+class TemplateBundle(NamedTuple):
+    """
+    A registered template, loaded into the memory of the current worker.
+    """
+    revision: str
+    template: jinja2.Template
+    # name -> (data, content type)
+    assets: Dict[str, Tuple[bytes, str]]
+    stylesheets: List[ParsedStylesheet]
+
+    def files(self) -> MultiDict:
+        return MultiDict([
+            (name, FileStorage(BytesIO(data), filename=name, name=name, content_type=content_type))
+            for name, (data, content_type) in self.assets.items()
+        ])
+
+
+_bundles = OrderedDict()
+_bundles_lock = threading.Lock()
+
+
+def _template_path(template_id: str) -> str:
+    """
+    Path of `template_id`, a symlink to the directory of its current revision in
+    `TEMPLATE_DIR/.revisions/<id>/<revision>`.
+    """
+    if not _TEMPLATE_ID_RE.match(template_id) or template_id.startswith('.'):
+        raise RenderError(f'Invalid template id "{template_id}"', 400)
+    return os.path.join(TEMPLATE_DIR, template_id)
+
+
+def _revisions_path(template_id: str) -> str:
+    return os.path.join(TEMPLATE_DIR, '.revisions', template_id)
+
+
+def _read_manifest(path: str) -> dict:
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise RenderError('Template not found', 404)
+
+
+def _load_revision(path: str, manifest: dict) -> TemplateBundle:
+    with open(os.path.join(path, 'index.html'), encoding='utf-8') as f:
+        template = _environment.from_string(f.read())
+
+    assets = {}
+    for name, asset in manifest['assets'].items():
+        with open(os.path.join(path, asset['file']), 'rb') as f:
+            assets[name] = (f.read(), asset['content_type'])
+
+    stylesheets = [
+        parse(assets[name][0], base_url='/' + name)
+        for name in manifest['stylesheets']
+    ]
+
+    return TemplateBundle(manifest['revision'], template, assets, stylesheets)
+
+
+def load_bundle(template_id: str) -> TemplateBundle:
+    """
+    The bundle of `template_id`, from the in-memory cache of this worker if it's still the
+    registered revision, otherwise loaded from `TEMPLATE_DIR`. The least recently used bundles are
+    evicted when more than `TEMPLATE_CACHE_SIZE` are loaded.
+
+    :raise: :class:`RenderError` if the template doesn't exist
+    """
+    while True:
+        # Resolved once, so all files come from the same revision even if it's replaced meanwhile
+        path = os.path.realpath(_template_path(template_id))
+        manifest = _read_manifest(path)
+
+        with _bundles_lock:
+            bundle = _bundles.get(template_id)
+            if bundle is not None and bundle.revision == manifest['revision']:
+                _bundles.move_to_end(template_id)
+                return bundle
+
+        try:
+            bundle = _load_revision(path, manifest)
+            break
+        except FileNotFoundError:
+            # Unless it was deleted, the revision was replaced twice while loading it
+            if os.path.realpath(_template_path(template_id)) == path:
+                raise RenderError('Template not found', 404)
+
+    with _bundles_lock:
+        _bundles[template_id] = bundle
+        _bundles.move_to_end(template_id)
+        while len(_bundles) > TEMPLATE_CACHE_SIZE:
+            _bundles.popitem(last=False)
+
+    return bundle
+
+
+@contextmanager
+def _template_lock(template_id: str):
+    """
+    Exclusive lock on `template_id` across all workers, held while a revision is written and
+    swapped in and old revisions are removed, so concurrent registrations or deletions don't
+    remove each other's revisions.
+    """
+    locks = os.path.join(TEMPLATE_DIR, '.locks')
+    os.makedirs(locks, exist_ok=True)
+    with open(os.path.join(locks, template_id), 'wb') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def register_template(template_id: str) -> Response:
+    try:
+        path = _template_path(template_id)
+
+        if not request.content_type.startswith("multipart/form-data"):
+            raise RenderError("Invalid content type. Expected 'multipart/form-data'", 400)
+
+        index = request.files.get('index.html')
+        if index is None:
+            raise RenderError("No index.html present", 400)
+
+        stylesheets = [name for value in request.form.getlist('stylesheets') for name in value.split(',') if name]
+        missing = [name for name in stylesheets if name not in request.files]
+        if missing:
+            raise RenderError(f'Stylesheets ({", ".join(missing)}) are not part of the bundle', 400)
+
+        try:
+            _environment.parse(index.read().decode('utf-8'))
+        except (jinja2.TemplateSyntaxError, UnicodeDecodeError) as e:
+            raise RenderError('Invalid template. ' + str(e), 400)
+        index.stream.seek(0)
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    with _template_lock(template_id):
+        revisions = _revisions_path(template_id)
+        os.makedirs(revisions, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=revisions, prefix='.tmp-')
+        manifest = {'revision': uuid.uuid4().hex, 'assets': {}, 'stylesheets': stylesheets}
+        index.save(os.path.join(staging, 'index.html'))
+        for name, file in request.files.items(multi=True):
+            if name == 'index.html':
+                continue
+            filename = f'asset-{len(manifest["assets"])}'
+            file.save(os.path.join(staging, filename))
+            manifest['assets'][name] = {'file': filename, 'content_type': file.content_type}
+
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+        os.rename(staging, os.path.join(revisions, manifest['revision']))
+
+        # Swap in the new revision by replacing the symlink, so renders always find either the old
+        # or the new revision. Workers notice the changed revision on their next render.
+        existed = os.path.exists(path)
+        previous = os.path.basename(os.readlink(path)) if os.path.islink(path) else None
+        if existed and previous is None:
+            # Registered before templates had revisions
+            shutil.rmtree(path)
+        link = os.path.join(TEMPLATE_DIR, '.tmp-' + manifest['revision'])
+        os.symlink(os.path.join('.revisions', template_id, manifest['revision']), link)
+        os.replace(link, path)
+
+        # The replaced revision is kept for renders that are still loading it. Staging directories
+        # left here are from registrations that failed, as no other one runs.
+        for name in os.listdir(revisions):
+            if name not in (manifest['revision'], previous):
+                shutil.rmtree(os.path.join(revisions, name), ignore_errors=True)
+
+    response = make_response({
+        'id': template_id,
+        'revision': manifest['revision'],
+        'assets': list(manifest['assets']),
+        'stylesheets': stylesheets,
+    }, 200 if existed else 201)
+    return response
+
+
+def get_template(template_id: str) -> Response:
+    try:
+        manifest = _read_manifest(_template_path(template_id))
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    return make_response({
+        'id': template_id,
+        'revision': manifest['revision'],
+        'assets': list(manifest['assets']),
+        'stylesheets': manifest['stylesheets'],
+    })
+
+
+def delete_template(template_id: str) -> Response:
+    try:
+        path = _template_path(template_id)
+        _read_manifest(path)
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    with _template_lock(template_id):
+        if os.path.islink(path):
+            os.unlink(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+        shutil.rmtree(_revisions_path(template_id), ignore_errors=True)
+    with _bundles_lock:
+        _bundles.pop(template_id, None)
+
+    return make_response('', 204)
+
+
+def generate_from_template(template_id: str) -> Response:
+    try:
+        with stage('decode'):
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                raise RenderError('Request body must be a JSON object', 400)
+
+            bundle = load_bundle(template_id)
+
+        with stage('template'):
+            try:
+                html = bundle.template.render(data).encode('utf-8')
+            except jinja2.TemplateError as e:
+                raise RenderError('An error while rendering template. ' + str(e), 400)
+
+        options = request_options()
+        pdf = render_pdf(html, bundle.files(), options, stylesheets=bundle.stylesheets, target=spooled())
+    except RenderError as e:
+        return make_error(e.message, e.status)
+
+    try:
+        if options.password:
+            with stage('encrypt'):
+                pdf = encrypt_output(pdf, options.password)
+    except Exception as e:
+        return make_error('An error while encrypting pdf. ' + str(e), 500)
+
+    set_context("pdf-details", {
+        "template": template_id,
+        "html_size": len(html),
+        "pdf_size": file_size(pdf),
+    })
+
+    return file_response(pdf, 'generated.pdf')
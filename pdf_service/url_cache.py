@@ -0,0 +1,176 @@
+import json
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.error import HTTPError
+
+import weasyprint
+from weasyprint.urls import HTTP_HEADERS
+
+from . import http_pool
+from .cache import Cache, cache_from_env, digest
+
+# Heuristic freshness for responses without explicit lifetime (RFC 9111 4.2.2), capped at one day.
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX_SECONDS = 24 * 60 * 60
+
+
+class URLCache:
+    """
+    HTTP cache for external resources, following `Cache-Control`, `Expires`, `ETag` and
+    `Last-Modified`.
+
+    Fresh entries are served without a request. Stale entries with a validator are revalidated
+    with a conditional request, and a `304 Not Modified` response refreshes them. Responses with
+    `Cache-Control: no-store` or `private` or `Vary: *` are never stored, as the cache is shared by
+    all requests.
+
+    The storage, including its byte budget and LRU eviction, is provided by :class:`Cache`.
+    """
+
+    def __init__(self, cache: Cache, timeout: int = 10):
+        self.cache = cache
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def fetch(self, url: str, timeout: Optional[float] = None,
+              budget: Optional[http_pool.ByteBudget] = None) -> Tuple[dict, str]:
+        """
+        Fetch `url` through the cache. Bodies served from the cache are taken from `budget` too.
+
+        :return: The WeasyPrint url_fetcher result and whether it was a `hit`, a `revalidated`
+         stale entry or a `miss`.
+        :raise: :class:`urllib.error.HTTPError` and other errors of :func:`http_pool.request`
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if not url.startswith(('http://', 'https://')):
+            self.misses += 1
+            return weasyprint.default_url_fetcher(url, timeout=timeout), 'miss'
+
+        key = digest('url', url)
+        entry = self._load(key)
+        now = time.time()
+
+        if entry is not None and entry[0]['expires'] > now:
+            if budget is not None:
+                budget.take(url, len(entry[1]))
+            self.hits += 1
+            return self._result(*entry), 'hit'
+
+        headers = dict(HTTP_HEADERS)
+        if entry is not None:
+            if entry[0].get('etag'):
+                headers['If-None-Match'] = entry[0]['etag']
+            if entry[0].get('last_modified'):
+                headers['If-Modified-Since'] = entry[0]['last_modified']
+
+        try:
+            redirected_url, info, body = http_pool.request(url, headers, timeout, budget=budget)
+        except HTTPError as error:
+            if error.code != 304 or entry is None:
+                raise
+            meta, body = entry
+            if budget is not None:
+                budget.take(url, len(body))
+            meta['expires'] = now + _freshness_lifetime(error.headers, now)
+            self._store(key, meta, body)
+            self.revalidations += 1
+            return self._result(meta, body), 'revalidated'
+
+        meta = {
+            'redirected_url': redirected_url,
+            'mime_type': info.get_content_type(),
+            'encoding': info.get_param('charset'),
+            'filename': info.get_filename(),
+            'etag': info.get('ETag'),
+            'last_modified': info.get('Last-Modified'),
+            'expires': now + _freshness_lifetime(info, now),
+        }
+        if _is_storable(info) and (meta['expires'] > now or meta['etag'] or meta['last_modified']):
+            self._store(key, meta, body)
+
+        self.misses += 1
+        return self._result(meta, body), 'miss'
+
+    def _load(self, key: str) -> Optional[Tuple[dict, bytes]]:
+        value = self.cache.get(key)
+        if value is None:
+            return None
+        header, _, body = value.partition(b'\n')
+        return json.loads(header), body
+
+    def _store(self, key: str, meta: dict, body: bytes):
+        self.cache.set(key, json.dumps(meta).encode('utf-8') + b'\n' + body)
+
+    @staticmethod
+    def _result(meta: dict, body: bytes) -> dict:
+        return {
+            'string': body,
+            'mime_type': meta['mime_type'],
+            'encoding': meta['encoding'],
+            'redirected_url': meta['redirected_url'],
+            'filename': meta['filename'],
+        }
+
+
+def _cache_control(headers) -> dict:
+    directives = {}
+    for value in headers.get_all('Cache-Control') or []:
+        for directive in value.split(','):
+            name, _, argument = directive.strip().partition('=')
+            if name:
+                directives[name.lower()] = argument.strip('"')
+    return directives
+
+
+def _is_storable(headers) -> bool:
+    directives = _cache_control(headers)
+    if 'no-store' in directives or 'private' in directives:
+        return False
+    return (headers.get('Vary') or '').strip() != '*'
+
+
+def _freshness_lifetime(headers, now: float) -> float:
+    """
+    Remaining freshness in seconds, according to RFC 9111 4.2.
+    """
+    directives = _cache_control(headers)
+    if 'no-cache' in directives:
+        return 0
+
+    try:
+        age = float(headers.get('Age') or 0)
+    except ValueError:
+        age = 0
+
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]) - age)
+            except ValueError:
+                return 0
+
+    try:
+        if headers.get('Expires'):
+            return max(0, parsedate_to_datetime(headers['Expires']).timestamp() - now)
+        if headers.get('Last-Modified'):
+            modified = parsedate_to_datetime(headers['Last-Modified']).timestamp()
+            return max(0, min(HEURISTIC_MAX_SECONDS, (now - modified) * HEURISTIC_FRACTION) - age)
+    except (TypeError, ValueError):
+        pass
+
+    return 0
+
+
+def url_cache_from_env() -> Optional[URLCache]:
+    """
+    Create the cache for external resources, configured by `URL_CACHE_MEMORY_BYTES`,
+    `URL_CACHE_DIR` and `URL_CACHE_DISK_BYTES`.
+    """
+    cache = cache_from_env('URL')
+    return URLCache(cache) if cache is not None else None
+
+
+url_cache = url_cache_from_env()
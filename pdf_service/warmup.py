@@ -0,0 +1,54 @@
+import threading
+
+import fitz
+
+from .form_fill import fill_font
+from .generate import RenderOptions, render_pdf
+from .postprocess import postprocess
+from .stylesheets import load_style_profiles
+
+# Set once :func:`warm_up` finished, reported by `/ready`
+ready = threading.Event()
+
+WARMUP_HTML = b'''<!DOCTYPE html>
+<html>
+<head>
+<title>Warm-up</title>
+<style>
+    @page { @bottom-right { content: counter(page) " / " counter(pages) } }
+    table { border-collapse: collapse }
+    td, th { border: 1px solid black; padding: 2px }
+</style>
+</head>
+<body>
+<h1>Warm-up</h1>
+<p>Regular, <b>bold</b>, <i>italic</i> and <code>monospace</code> text.</p>
+<ul><li>First</li><li>Second</li></ul>
+<table>
+    <thead><tr><th>Item</th><th>Price</th></tr></thead>
+    <tbody><tr><td>Consulting</td><td>100.00</td></tr></tbody>
+</table>
+<svg width="20" height="20"><rect width="20" height="20" fill="gray"/></svg>
+</body>
+</html>
+'''
+
+
+def warm_up():
+    """
+    Render, rotate, encrypt and read a document with every style profile and load the form fill
+    font, so the caches of this process (parsed stylesheets, fonts, font map, lazily loaded
+    modules) are filled before the first request. With a preloading server this runs once, before
+    the workers are forked, and the workers share the filled caches.
+    """
+    for style in [None] + load_style_profiles():
+        pdf = render_pdf(WARMUP_HTML, None, RenderOptions(style=style))
+
+    pdf = postprocess(pdf, rotation=90, password='warm-up')
+    with fitz.open(stream=pdf, filetype='pdf') as document:
+        document.authenticate('warm-up')
+        document.load_page(0).get_text()
+
+    fill_font()
+
+    ready.set()
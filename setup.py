@@ -10,7 +10,10 @@ setup(
         'flask',
         'weasyprint',
         'werkzeug',
-        'sentry-sdk[flask]'
+        'sentry-sdk[flask]',
+        'urllib3',
+        'jinja2',
+        'prometheus-client'
     ],
     extras_require={
         'dev': [
@@ -0,0 +1,24 @@
+import fitz
+import pytest
+
+
+@pytest.fixture
+def form() -> bytes:
+    """
+    A form with two pages, each with a text field `name-<page>` and a checkbox `agree-<page>`.
+    """
+    document = fitz.open()
+    for page_number in range(2):
+        page = document.new_page()
+        widget = fitz.Widget()
+        widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+        widget.field_name = f'name-{page_number}'
+        widget.rect = fitz.Rect(50, 50, 300, 70)
+        page.add_widget(widget)
+
+        widget = fitz.Widget()
+        widget.field_type = fitz.PDF_WIDGET_TYPE_CHECKBOX
+        widget.field_name = f'agree-{page_number}'
+        widget.rect = fitz.Rect(400, 50, 420, 70)
+        page.add_widget(widget)
+    return document.tobytes()
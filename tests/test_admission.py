@@ -0,0 +1,120 @@
+import importlib
+import threading
+from io import BytesIO
+
+import pytest
+from flask import Response
+from flask.testing import Client
+
+from pdf_service import pdf_service
+from pdf_service import admission
+
+generate = importlib.import_module('pdf_service.generate')
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def saturated(monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(admission, '_slots', slots)
+    monkeypatch.setattr(admission, 'RENDER_QUEUE_TIMEOUT', 0.1)
+
+
+def test_rejects_renders_when_saturated(client: Client, saturated, monkeypatch):
+    monkeypatch.setattr(admission, 'RENDER_QUEUE_SIZE', 0)
+
+    rv = client.post('/generate', data='<p>Test</p>', content_type='text/html')
+    assert 503 == rv.status_code
+    assert '5' == rv.headers['Retry-After']
+
+
+def test_rejects_renders_after_queue_timeout(client: Client, saturated):
+    rv = client.post('/generate', data='<p>Test</p>', content_type='text/html')
+    assert 503 == rv.status_code
+    assert 0 == client.get('/queue').json['waiting']
+
+
+def test_reports_queue_depth(client: Client):
+    rv = client.get('/queue')
+    assert 200 == rv.status_code
+    assert {'active': 0, 'waiting': 0} == {key: rv.json[key] for key in ('active', 'waiting')}
+    assert admission.MAX_CONCURRENT_RENDERS == rv.json['capacity']
+
+
+def test_reports_queue_of_all_workers(client: Client, monkeypatch):
+    monkeypatch.setattr(admission, 'live_gauges', lambda: {
+        'pdf_service_renders_in_flight': 6.0,
+        'pdf_service_renders_waiting': 3.0,
+    })
+    monkeypatch.setattr(admission, 'WORKER_COUNT', 2)
+
+    rv = client.get('/queue')
+    assert {
+        'active': 6,
+        'waiting': 3,
+        'capacity': 2 * admission.MAX_CONCURRENT_RENDERS,
+        'queue_size': 2 * admission.RENDER_QUEUE_SIZE,
+    } == rv.json
+
+
+def test_rejects_documents_over_page_limit(client: Client, monkeypatch):
+    monkeypatch.setattr(admission, 'MAX_PAGES', 1)
+
+    rv = client.post('/generate', data='<p>First</p><p style="page-break-before: always">Second</p>',
+                     content_type='text/html')
+    assert 413 == rv.status_code
+    assert b'Document has more than 1 pages' in rv.data
+
+
+def test_rejects_large_requests(client: Client, monkeypatch):
+    monkeypatch.setitem(pdf_service.config, 'MAX_CONTENT_LENGTH', 10)
+
+    rv = client.post('/generate', data='<p>Test text in PDF</p>', content_type='text/html')
+    assert 413 == rv.status_code
+
+
+@pytest.mark.parametrize('path', ['/generate/batch', '/form-fields/bulk', '/encrypt/batch'])
+def test_rejects_batches_when_saturated(client: Client, saturated, monkeypatch, path):
+    monkeypatch.setattr(admission, 'RENDER_QUEUE_SIZE', 0)
+
+    rv = client.post(path, data={'index.html': (BytesIO(b'<p>Test</p>'), 'index.html')})
+    assert 503 == rv.status_code
+
+
+def test_holds_slot_while_streaming(monkeypatch):
+    monkeypatch.setattr(admission, '_slots', threading.BoundedSemaphore(1))
+
+    def chunks():
+        yield str(admission._active).encode()
+
+    view = admission.admission_control(streamed=True)(lambda: Response(chunks()))
+    with pdf_service.test_request_context():
+        response = view()
+        assert b'1' == b''.join(response.response)
+        response.close()
+
+    assert 0 == admission._active
+    assert admission._slots.acquire(False)
+
+
+def test_stops_layout_after_page_limit(client: Client, monkeypatch):
+    monkeypatch.setattr(admission, 'MAX_PAGES', 1)
+    laid_out = []
+    make_all_pages = generate._make_all_pages
+
+    def counting(*args):
+        for page in make_all_pages(*args):
+            laid_out.append(page)
+            yield page
+
+    monkeypatch.setattr(generate, '_make_all_pages', counting)
+
+    rv = client.post('/generate', data='<p style="page-break-after: always">Page</p>' * 10, content_type='text/html')
+    assert 413 == rv.status_code
+    assert 2 == len(laid_out)
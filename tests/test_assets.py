@@ -0,0 +1,90 @@
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from flask.testing import Client
+from pdfminer.high_level import extract_text
+
+from pdf_service import assets, pdf_service
+from pdf_service.cache import DiskCache
+
+PNG = Path(__file__).parent.joinpath('../test-data/assets/test.png').read_bytes()
+PNG_ID = assets.asset_id(PNG)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, 'store', DiskCache(str(tmp_path), 16 * 1024 * 1024))
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def test_uploads_assets(client: Client):
+    rv = client.post('/assets', data={'logo.png': (BytesIO(PNG), 'logo.png', 'image/png')})
+
+    assert 201 == rv.status_code
+    assert {'logo.png': PNG_ID} == rv.json['assets']
+    assert (PNG, 'image/png') == assets.get_asset(PNG_ID)
+
+
+def test_reports_missing_assets(client: Client):
+    assets.put_asset(PNG, 'image/png')
+    missing = 'sha256-' + '0' * 64
+
+    rv = client.post('/assets/missing', json=[PNG_ID, 'asset:' + missing])
+
+    assert 200 == rv.status_code
+    assert ['asset:' + missing] == rv.json['missing']
+
+
+def test_renders_asset_references(client: Client):
+    assets.put_asset(PNG, 'image/png')
+
+    rv = client.post('/generate', data=f'<p>Logo</p><img src="asset:{PNG_ID}">', content_type='text/html')
+
+    assert 200 == rv.status_code
+    assert 'Logo' in extract_text(BytesIO(rv.data))
+
+
+def test_renders_assets_of_manifest(client: Client):
+    assets.put_asset(b'p { color: red }', 'text/css')
+    css_id = assets.asset_id(b'p { color: red }')
+
+    rv = client.post('/generate', data={
+        'index.html': (BytesIO(b'<link rel="stylesheet" href="style.css"><img src="logo.png"><p>Text</p>'), 'index.html'),
+        'logo.png': (BytesIO(PNG), 'logo.png', 'image/png'),
+    }, headers={'X-Assets': f'style.css={css_id}'})
+
+    assert 200 == rv.status_code
+
+
+def test_rejects_missing_assets(client: Client):
+    rv = client.post('/generate', data='<img src="asset:sha256-' + '0' * 64 + '">', content_type='text/html')
+
+    assert 400 == rv.status_code
+    assert b'Missing asset' in rv.data
+
+
+def test_rejects_invalid_manifest(client: Client):
+    rv = client.post('/generate', data='<p>Text</p>', content_type='text/html', headers={'X-Assets': 'logo.png=abc'})
+
+    assert 400 == rv.status_code
+
+
+def test_keeps_uploaded_assets(client: Client):
+    rv = client.post('/generate', data={
+        'index.html': (BytesIO(b'<img src="logo.png">'), 'index.html'),
+        'logo.png': (BytesIO(PNG), 'logo.png', 'image/png'),
+    })
+
+    assert 200 == rv.status_code
+    assert assets.has_asset(PNG_ID)
+
+
+def test_evicts_least_recently_used_assets(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, 'store', DiskCache(str(tmp_path), 20))
+    first = assets.put_asset(b'first', 'text/plain')
+    second = assets.put_asset(b'second', 'text/plain')
+
+    assert not assets.has_asset(first)
+    assert assets.has_asset(second)
@@ -0,0 +1,149 @@
+import json
+import os
+import zipfile
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from flask.testing import Client
+
+from pdfminer import high_level
+
+from pdf_service import batch, pdf_service
+from pdf_service.pool import reset_render_pool
+from pdf_service.streaming import Part, stream_multipart
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def html(text: str):
+    return BytesIO(bytes(text, 'utf8'))
+
+
+def test_renders_every_document_into_zip(client: Client):
+    data = {
+        'first.html': (html('<p>First document</p>'), 'first.html', 'text/html'),
+        'second.html': (html('<p>Second document <img src="test.png"/></p>'), 'second.html', 'text/html'),
+        'test.png': (
+            Path(__file__).parent.joinpath('../test-data/assets/test.png').open('rb'),
+            'test.png',
+            'image/png'
+        ),
+    }
+
+    rv = client.post('/generate/batch', data=data)
+    assert 200 == rv.status_code
+    assert 'application/zip' == rv.content_type
+
+    archive = zipfile.ZipFile(BytesIO(rv.data))
+    assert {'first.pdf', 'second.pdf', 'report.json'} == set(archive.namelist())
+    assert 'First document' in high_level.extract_text(BytesIO(archive.read('first.pdf')))
+    assert 'Second document' in high_level.extract_text(BytesIO(archive.read('second.pdf')))
+
+
+def test_reports_failing_documents_without_failing_batch(client: Client):
+    data = {
+        'good.html': (html('<p>Good</p>'), 'good.html', 'text/html'),
+        'bad.html': (html('<p>Bad <img src="missing.png"/></p>'), 'bad.html', 'text/html'),
+    }
+
+    rv = client.post('/generate/batch', data=data)
+    assert 200 == rv.status_code
+
+    archive = zipfile.ZipFile(BytesIO(rv.data))
+    report = {item['name']: item for item in json.loads(archive.read('report.json'))}
+    assert 200 == report['good.html']['status']
+    assert 400 == report['bad.html']['status']
+    assert b'Missing file (missing.png)' in archive.read('bad.error.txt')
+
+
+def test_accepts_zip_archive(client: Client):
+    body = BytesIO()
+    with zipfile.ZipFile(body, 'w') as archive:
+        archive.writestr('invoice.html', '<p>Zipped <img src="assets/test.png"/></p>')
+        archive.write(Path(__file__).parent.joinpath('../test-data/assets/test.png'), 'assets/test.png')
+
+    rv = client.post('/generate/batch', data=body.getvalue(), content_type='application/zip')
+    assert 200 == rv.status_code
+
+    archive = zipfile.ZipFile(BytesIO(rv.data))
+    assert 'Zipped' in high_level.extract_text(BytesIO(archive.read('invoice.pdf')))
+
+
+def test_streams_multipart_response(client: Client):
+    data = {
+        'first.html': (html('<p>First</p>'), 'first.html', 'text/html'),
+    }
+
+    rv = client.post('/generate/batch', data=data, query_string={'format': 'multipart'})
+    assert 200 == rv.status_code
+    assert rv.content_type.startswith('multipart/mixed; boundary=')
+    assert b'filename="first.pdf"' in rv.data
+    assert b'X-Status: 200' in rv.data
+
+
+def test_error_when_no_documents_present(client: Client):
+    rv = client.post('/generate/batch', data={'test.png': (BytesIO(b'png'), 'test.png', 'image/png')})
+    assert 400 == rv.status_code
+    assert b'No html documents present' in rv.data
+
+
+def test_error_on_invalid_format(client: Client):
+    rv = client.post('/generate/batch', data={'first.html': (html('<p>First</p>'), 'first.html')},
+                     query_string={'format': 'tar'})
+    assert 400 == rv.status_code
+
+
+def test_rejects_zip_archives_over_size_limit(client: Client, monkeypatch):
+    monkeypatch.setattr(batch, 'MAX_ZIP_BYTES', 1024)
+    body = BytesIO()
+    with zipfile.ZipFile(body, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('invoice.html', '<p>' + ' ' * 2048 + '</p>')
+
+    rv = client.post('/generate/batch', data=body.getvalue(), content_type='application/zip')
+    assert 413 == rv.status_code
+
+
+def test_continues_after_render_process_died(client: Client, monkeypatch):
+    def render_pdf(html, files, options):
+        if b'crash' in html:
+            os._exit(1)
+        return b'%PDF-1.7'
+
+    monkeypatch.setattr(batch, 'render_pdf', render_pdf)
+    monkeypatch.setattr(batch, 'RENDER_PROCESSES', 1)
+    # Fork render processes with the patched module
+    reset_render_pool()
+    data = {'crash.html': (html('crash'), 'crash.html', 'text/html')}
+    for number in range(5):
+        data[f'document-{number}.html'] = (html('<p>Document</p>'), f'document-{number}.html', 'text/html')
+
+    try:
+        rv = client.post('/generate/batch', data=data)
+    finally:
+        reset_render_pool()
+
+    assert 200 == rv.status_code
+    archive = zipfile.ZipFile(BytesIO(rv.data))
+    report = {item['name']: item for item in json.loads(archive.read('report.json'))}
+    assert set(data) == set(report)
+    assert 500 == report['crash.html']['status']
+    assert 200 == report['document-4.html']['status']
+
+
+def test_makes_document_names_unique():
+    documents = [('index.html', b'1'), ('index.html', b'2'), ('index-2.html', b'3'), ('index.html', b'4')]
+    names = [name for name, _ in batch._unique_names(documents)]
+    assert ['index.html', 'index-3.html', 'index-2.html', 'index-4.html'] == names
+
+
+def test_quotes_filenames_of_multipart_parts():
+    parts = [Part('a"b\r\nX-Status: 200.pdf', b'%PDF', 'application/pdf', 500)]
+    head = b''.join(stream_multipart(parts, 'boundary')).split(b'\r\n\r\n')[0].decode('utf-8')
+    assert 'Content-Disposition: attachment; filename="a\\"b  X-Status: 200.pdf"' in head.split('\r\n')
+    assert 'X-Status: 500' in head.split('\r\n')
+    assert 'X-Status: 200.pdf"' not in head.split('\r\n')
@@ -0,0 +1,211 @@
+import importlib
+import os
+import threading
+import time
+
+import pytest
+
+from pdf_service import pdf_service
+from pdf_service.cache import Cache, DiskCache, MemoryCache
+
+# The package exports the `generate` view under the module's name
+generate = importlib.import_module('pdf_service.generate')
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(10)
+    cache.set('a', b'12345')
+    cache.set('b', b'12345')
+    cache.get('a')
+    cache.set('c', b'12345')
+
+    assert cache.get('a') == b'12345'
+    assert cache.get('b') is None
+    assert cache.get('c') == b'12345'
+    assert cache.size == 10
+
+
+def test_memory_cache_ignores_values_over_budget():
+    cache = MemoryCache(4)
+    cache.set('a', b'12345')
+
+    assert cache.get('a') is None
+
+
+def test_disk_cache_round_trip(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    cache.set('abcdef', b'value')
+
+    assert DiskCache(str(tmp_path), 1024).get('abcdef') == b'value'
+    assert cache.get('missing') is None
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), 10)
+    cache.set('aa', b'12345')
+    time.sleep(0.01)
+    cache.set('bb', b'12345')
+    time.sleep(0.01)
+    cache.get('aa')
+    time.sleep(0.01)
+    cache.set('cc', b'12345')
+
+    assert cache.get('aa') == b'12345'
+    assert cache.get('bb') is None
+    assert cache.get('cc') == b'12345'
+
+
+def test_disk_cache_scans_only_when_over_budget(tmp_path, mocker):
+    cache = DiskCache(str(tmp_path), 1024)
+    evict = mocker.spy(cache, '_evict')
+    for number in range(10):
+        cache.set(f'key-{number}', b'12345')
+
+    # Only the first write counts the existing entries
+    assert 1 == evict.call_count
+
+    cache.set('large', b'x' * 1000)
+
+    assert 2 == evict.call_count
+    assert cache.get('key-0') is None
+
+
+def test_disk_cache_shares_lock_files(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    for number in range(1000):
+        with cache.lock(f'key-{number}'):
+            pass
+
+    assert len(os.listdir(tmp_path / '.locks')) <= DiskCache.LOCK_STRIPES
+
+
+def test_cache_promotes_disk_hits_to_memory(tmp_path):
+    disk = DiskCache(str(tmp_path), 1024)
+    disk.set('key', b'value')
+    cache = Cache(MemoryCache(1024), disk)
+
+    assert cache.get('key') == b'value'
+    assert cache.memory.get('key') == b'value'
+
+
+def test_cache_deduplicates_concurrent_creates():
+    cache = Cache(MemoryCache(1024))
+    calls = []
+    started = threading.Event()
+
+    def create():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return b'pdf'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create('key', create)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [b'pdf'] * 4
+    assert cache.misses == 1
+    assert cache.hits == 3
+
+
+def test_disk_cache_creates_keys_of_a_lock_file_concurrently(tmp_path):
+    disk = DiskCache(str(tmp_path), 1024)
+    disk.LOCK_STRIPES = 1
+
+    def create():
+        time.sleep(0.3)
+        return b'pdf'
+
+    start = time.monotonic()
+    # Separate caches, like workers sharing the directory
+    threads = [threading.Thread(target=Cache(disk=disk).get_or_create, args=(f'key-{number}', create))
+               for number in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert time.monotonic() - start < 0.6
+    assert not os.listdir(tmp_path / '.claims')
+
+
+def test_disk_cache_deduplicates_creates_of_workers(tmp_path):
+    disk = DiskCache(str(tmp_path), 1024)
+    calls = []
+
+    def create():
+        calls.append(1)
+        time.sleep(0.2)
+        return b'pdf'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(Cache(disk=disk).get_or_create('key', create)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [b'pdf'] * 3
+
+
+def test_disk_cache_takes_over_abandoned_claims(tmp_path):
+    disk = DiskCache(str(tmp_path), 1024)
+    claim = tmp_path / '.claims' / 'key'
+    claim.touch()
+    os.utime(claim, (time.time() - DiskCache.CLAIM_TIMEOUT - 1,) * 2)
+
+    assert Cache(disk=disk).get_or_create('key', lambda: b'pdf') == b'pdf'
+
+
+def test_cache_does_not_store_failures():
+    cache = Cache(MemoryCache(1024))
+
+    def fail():
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        cache.get_or_create('key', fail)
+
+    assert cache.get_or_create('key', lambda: b'pdf') == b'pdf'
+
+
+def test_generate_serves_repeated_requests_from_cache(client, mocker):
+    mocker.patch.object(generate, 'result_cache', Cache(MemoryCache(16 * 1024 * 1024)))
+    render = mocker.spy(generate, 'render_pdf')
+
+    first = client.post('/generate', data="<p>Cached</p>", content_type="text/html")
+    second = client.post('/generate', data="<p>Cached</p>", content_type="text/html")
+    other = client.post('/generate', data="<p>Cached</p>", content_type="text/html",
+                        query_string={'rotate': 90})
+
+    assert 200 == first.status_code
+    assert first.data == second.data
+    assert 200 == other.status_code
+    assert render.call_count == 2
+
+
+def test_generate_caches_before_encryption(client, mocker):
+    mocker.patch.object(generate, 'result_cache', Cache(MemoryCache(16 * 1024 * 1024)))
+    render = mocker.spy(generate, 'render_pdf')
+
+    first = client.post('/generate', data="<p>Cached</p>", content_type="text/html",
+                        headers={'X-Password': 'first'})
+    second = client.post('/generate', data="<p>Cached</p>", content_type="text/html",
+                         headers={'X-Password': 'second'})
+
+    assert 200 == first.status_code
+    assert 200 == second.status_code
+    assert render.call_count == 1
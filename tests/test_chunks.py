@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from io import BytesIO
+
+import pytest
+from pdfminer.high_level import extract_pages, extract_text
+from pdfminer.layout import LTTextContainer
+
+from pdf_service import chunks, pdf_service, pool
+from pdf_service.chunks import split_chunks
+from pdf_service.deadline import current_deadline, Stopped
+from pdf_service.errors import RenderError
+from pdf_service.generate import PageNumbering, RenderOptions
+
+HTML = b'''<!DOCTYPE html>
+<html>
+<head>
+<title>Statement</title>
+<style>@page { @bottom-center { content: "Page " counter(page) " of " counter(pages) } }</style>
+</head>
+<body>
+<h1>Statement</h1>
+<section data-pdf-chunk><p style="break-after: page">January</p><p>February</p></section>
+<section data-pdf-chunk><p>March</p></section>
+</body>
+</html>
+'''
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def render_until_stopped(html, files, options, max_pages=None, numbering=None):
+    """
+    Fails for `fail` and otherwise renders until stopped, then creates the file at the path in `html`.
+    """
+    if html == b'fail':
+        raise RenderError('Broken chunk', 400)
+    try:
+        while True:
+            current_deadline().check()
+            time.sleep(0.05)
+    except Stopped:
+        with open(html, 'wb'):
+            pass
+        raise
+
+
+@pytest.fixture
+def render_pool(monkeypatch):
+    monkeypatch.setattr(chunks, 'render_pdf', render_until_stopped)
+    monkeypatch.setattr(pool, 'RENDER_PROCESSES', 2)
+    # Fork render processes with the patched module
+    pool.reset_render_pool()
+    yield
+    pool.reset_render_pool()
+
+
+def page_texts(pdf: bytes):
+    return [
+        ''.join(element.get_text() for element in page if isinstance(element, LTTextContainer))
+        for page in extract_pages(BytesIO(pdf))
+    ]
+
+
+def test_splits_at_marked_elements():
+    chunks = split_chunks(HTML)
+
+    assert 2 == len(chunks)
+    assert b'<h1>Statement</h1>' in chunks[0]
+    assert b'January' in chunks[0] and b'March' not in chunks[0]
+    assert b'March' in chunks[1] and b'Statement</h1>' not in chunks[1]
+    # Every chunk has the stylesheets of the document
+    assert all(b'counter(pages)' in chunk for chunk in chunks)
+
+
+def test_document_without_chunks_isnt_split():
+    assert [b'<p>Hello</p>'] == split_chunks(b'<p>Hello</p>')
+
+
+def test_renders_chunks_with_page_numbers_of_the_document(client):
+    rv = client.post('/generate?chunked=true', data=HTML, content_type='text/html')
+
+    assert 200 == rv.status_code
+    pages = page_texts(rv.data)
+    assert 3 == len(pages)
+    for number, text in enumerate(pages, 1):
+        assert f'Page {number} of 3' in text
+    assert 'March' in pages[2]
+
+
+def test_chunked_render_matches_text(client):
+    chunked = client.post('/generate?chunked=true', data=HTML, content_type='text/html')
+    whole = client.post('/generate', data=HTML, content_type='text/html')
+
+    assert extract_text(BytesIO(chunked.data)).split() == extract_text(BytesIO(whole.data)).split()
+
+
+def test_encrypts_chunked_document(client):
+    rv = client.post('/generate?chunked=true&password=secret', data=HTML, content_type='text/html')
+
+    assert 200 == rv.status_code
+    assert b'/Encrypt' in rv.data
+
+
+def test_stops_other_chunks_when_one_fails(render_pool, tmp_path):
+    stopped = tmp_path / 'stopped'
+    html = {0: os.fsencode(stopped), 1: b'fail'}
+    with pytest.raises(RenderError, match='Broken chunk'):
+        chunks._render_all(html, {}, RenderOptions(), {0: PageNumbering(), 1: PageNumbering()})
+
+    for _ in range(50):
+        if stopped.exists():
+            break
+        time.sleep(0.1)
+    assert stopped.exists()
+
+
+def test_times_out_chunks_without_deadline(render_pool, monkeypatch, tmp_path):
+    monkeypatch.setattr(chunks, 'RENDER_TIMEOUT', 0.3)
+    html = {index: os.fsencode(tmp_path / str(index)) for index in range(2)}
+    with pytest.raises(RenderError) as error:
+        chunks._render_all(html, {}, RenderOptions(), {0: PageNumbering(), 1: PageNumbering()})
+    assert 504 == error.value.status
+
+
+def test_stops_render_on_worker_thread(render_pool, tmp_path):
+    # Threads of gthread workers can't be interrupted by the timer, their renders run in the pool
+    client = pdf_service.test_client()
+    responses = []
+
+    def post():
+        responses.append(client.post('/generate?timeout=0.3', data=os.fsencode(tmp_path / 'stopped'),
+                                     content_type='text/html'))
+
+    start = time.monotonic()
+    thread = threading.Thread(target=post)
+    thread.start()
+    thread.join(10)
+
+    assert 504 == responses[0].status_code
+    assert time.monotonic() - start < 5
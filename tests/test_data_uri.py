@@ -3,7 +3,8 @@ import pytest
 from pdfminer import high_level
 from pdf_service import pdf_service
 from io import BytesIO
-from pdf_service.data_uri import parse
+from pdf_service.URLFetchHandler import URLFetchHandler
+from pdf_service.data_uri import decode, parse
 from pdf_service.errors import InvalidDataURI
 
 
@@ -46,3 +47,38 @@ def test_non_base64_data_uri(client):
 
     assert text == "sample"
 
+
+
+def test_decode_base64():
+    uri = decode("data:text/plain;charset=utf-8;base64,VGhlIHF1aWNrIGJyb3duIGZveA")
+
+    assert uri.mimetype == "text/plain"
+    assert uri.charset == "utf-8"
+    assert uri.data == b"The quick brown fox"
+
+
+def test_decode_urlsafe_base64():
+    assert decode("data:;base64,-_-_").data == b"\xfb\xff\xbf"
+
+
+def test_decode_percent_encoded():
+    uri = decode("data:,a%20b%2C%FF")
+
+    assert uri.mimetype is None
+    assert uri.data == b"a b,\xff"
+
+
+def test_decode_invalid_data_uri():
+    with pytest.raises(InvalidDataURI):
+        decode("data:*garbled*;base64,VGhl")
+    with pytest.raises(InvalidDataURI):
+        decode("data:text/plain;base64,V")
+
+
+def test_data_uri_decoded_once_per_request():
+    uri = "data:text/plain;base64,VGhlIHF1aWNrIGJyb3duIGZveA=="
+    url_fetcher = URLFetchHandler()
+
+    assert url_fetcher(uri)['file_obj'].read() == b"The quick brown fox"
+    assert url_fetcher(uri)['file_obj'].read() == b"The quick brown fox"
+    assert len(url_fetcher.data_uris) == 1
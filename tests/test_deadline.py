@@ -0,0 +1,85 @@
+import importlib
+import socket
+import time
+
+import pytest
+from flask.testing import Client
+
+from pdf_service import pdf_service
+from pdf_service.deadline import Deadline, DeadlineExceeded, Stopped, _is_disconnected, deadline_scope, shielded
+
+# The package exports the `generate` view under the module's name
+generate = importlib.import_module('pdf_service.generate')
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def test_times_out_slow_render(client: Client, mocker):
+    mocker.patch.object(generate, 'render_pdf', side_effect=lambda *args, **kwargs: time.sleep(5))
+
+    start = time.monotonic()
+    rv = client.post('/generate?timeout=0.2', data='<p>Test</p>', content_type='text/html')
+
+    assert 504 == rv.status_code
+    assert b'Rendering exceeded the deadline of 0.2 seconds' in rv.data
+    assert time.monotonic() - start < 2
+
+
+def test_deadline_header(client: Client, mocker):
+    mocker.patch.object(generate, 'render_pdf', side_effect=lambda *args, **kwargs: time.sleep(5))
+
+    rv = client.post('/generate', headers={'X-Deadline': '0.2'}, data='<p>Test</p>', content_type='text/html')
+    assert 504 == rv.status_code
+
+
+def test_renders_within_deadline(client: Client):
+    rv = client.post('/generate?timeout=30', data='<p>Test</p>', content_type='text/html')
+    assert 200 == rv.status_code
+
+
+def test_error_for_invalid_deadline(client: Client):
+    rv = client.post('/generate?timeout=soon', data='<p>Test</p>', content_type='text/html')
+    assert 400 == rv.status_code
+
+
+def test_defers_interruption_of_shielded_blocks():
+    finished = []
+    with pytest.raises(DeadlineExceeded):
+        with deadline_scope(Deadline(0.05)):
+            with shielded():
+                end = time.monotonic() + 0.3
+                while time.monotonic() < end:
+                    pass
+                finished.append(True)
+            time.sleep(5)
+
+    assert finished
+
+
+def test_expired_deadline():
+    with pytest.raises(DeadlineExceeded):
+        Deadline(0).check()
+
+
+def test_stops_once_marker_is_removed(tmp_path):
+    marker = tmp_path / 'marker'
+    marker.touch()
+    deadline = Deadline(30, marker=str(marker))
+    deadline.check()
+
+    marker.unlink()
+    with pytest.raises(Stopped):
+        deadline.check()
+
+
+def test_detects_disconnected_client():
+    server, client = socket.socketpair()
+    assert not _is_disconnected(server)
+
+    client.close()
+    assert _is_disconnected(server)
+    server.close()
@@ -0,0 +1,103 @@
+import json
+import zipfile
+from io import BytesIO
+
+import pypdf
+import pytest
+from flask.testing import Client
+
+from pdf_service import pdf_service
+from pdf_service.encryption import Recipient, encrypt_copies
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def pdf():
+    writer = pypdf.PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(200, 300)
+    with BytesIO() as output:
+        writer.write(output)
+        return output.getvalue()
+
+
+@pytest.mark.parametrize('backend', ['pypdf', 'pymupdf'])
+def test_encrypts_copies_with_one_parse(pdf, backend):
+    copies = list(encrypt_copies(pdf, [Recipient('a', 'first'), Recipient('b', 'second')], backend))
+
+    assert 2 == len(copies)
+    for copy, password in zip(copies, ['first', 'second']):
+        reader = pypdf.PdfReader(BytesIO(copy))
+        assert reader.is_encrypted
+        assert reader.decrypt(password)
+        assert 3 == len(reader.pages)
+
+
+@pytest.mark.parametrize('backend', ['pypdf', 'pymupdf'])
+def test_restricts_permissions(pdf, backend):
+    copy, = encrypt_copies(pdf, [Recipient('a', 'secret', ('print',))], backend)
+
+    reader = pypdf.PdfReader(BytesIO(copy))
+    # The user password doesn't open the PDF as owner
+    assert pypdf.PasswordType.USER_PASSWORD == reader.decrypt('secret')
+    permissions = int(reader.trailer['/Encrypt']['/P'])
+    assert permissions & 4
+    assert not permissions & (8 | 16 | 32)
+
+
+@pytest.mark.parametrize('backend', ['pypdf', 'pymupdf'])
+def test_encrypt_batch_streams_zip(client: Client, pdf, backend):
+    recipients = [{'name': 'alice', 'password': 'a'}, {'password': 'b', 'permissions': ['print', 'copy']}]
+    rv = client.post(f'/encrypt/batch?backend={backend}', data={
+        'pdf': (BytesIO(pdf), 'document.pdf'),
+        'recipients': json.dumps(recipients),
+    })
+
+    assert 200 == rv.status_code
+    archive = zipfile.ZipFile(BytesIO(rv.data))
+    assert ['alice.pdf', 'recipient-2.pdf'] == archive.namelist()
+    reader = pypdf.PdfReader(BytesIO(archive.read('recipient-2.pdf')))
+    assert reader.decrypt('b')
+
+
+def test_encrypt_batch_multipart(client: Client, pdf):
+    rv = client.post('/encrypt/batch?format=multipart', data={
+        'pdf': (BytesIO(pdf), 'document.pdf'),
+        'recipients': json.dumps([{'password': 'a'}]),
+    })
+
+    assert 200 == rv.status_code
+    assert rv.content_type.startswith('multipart/mixed')
+
+
+@pytest.mark.parametrize('recipients', [
+    '[]',
+    '[{"name": "alice"}]',
+    '[{"password": "a", "permissions": ["fly"]}]',
+    '[{"password": "a", "name": "../alice"}]',
+    '[{"password": "a", "name": "alice"}, {"password": "b", "name": "alice"}]',
+])
+def test_encrypt_batch_rejects_invalid_recipients(client: Client, pdf, recipients):
+    rv = client.post('/encrypt/batch', data={'pdf': (BytesIO(pdf), 'document.pdf'), 'recipients': recipients})
+
+    assert 400 == rv.status_code
+
+
+def test_encrypt_with_pymupdf_backend(client: Client, pdf):
+    rv = client.post('/encrypt', data=pdf, query_string={'password': 'secret', 'backend': 'pymupdf'}, content_type='application/pdf')
+
+    assert 200 == rv.status_code
+    reader = pypdf.PdfReader(BytesIO(rv.data))
+    assert reader.decrypt('secret')
+    assert 3 == len(reader.pages)
+
+
+def test_encrypt_rejects_unknown_backend(client: Client, pdf):
+    rv = client.post('/encrypt', data=pdf, query_string={'password': 'secret', 'backend': 'qpdf'}, content_type='application/pdf')
+
+    assert 400 == rv.status_code
@@ -0,0 +1,62 @@
+from io import BytesIO
+
+import fitz
+import pypdf
+import pytest
+from flask.testing import Client
+
+from pdf_service import pdf_service
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def test_flattens_filled_fields(client: Client, form):
+    rv = client.post('/form-fields', data={'pdf': (BytesIO(form), 'form.pdf'), 'name-1': 'Jonas Jonaitis'})
+    assert 200 == rv.status_code
+    assert 'application/pdf' == rv.content_type
+
+    document = fitz.open(stream=rv.data, filetype='pdf')
+    assert 'Jonas Jonaitis' == document[1].get_text().strip()
+    assert ['agree-1'] == [widget.field_name for widget in document[1].widgets()]
+    assert {'name-0', 'agree-0'} == {widget.field_name for widget in document[0].widgets()}
+
+
+def test_flattens_values_with_line_breaks(client: Client, form):
+    rv = client.post('/form-fields', data={'pdf': (BytesIO(form), 'form.pdf'), 'name-0': 'line1\nline2'})
+    assert 200 == rv.status_code
+
+    document = fitz.open(stream=rv.data, filetype='pdf')
+    assert 'line1\nline2' == document[0].get_text().strip()
+
+
+def test_sets_form_values(client: Client, form):
+    rv = client.post('/form-fields', query_string={'flatten': 'false'}, data={
+        'pdf': (BytesIO(form), 'form.pdf'),
+        'name-0': 'Jonas',
+        'agree-0': 'yes',
+    })
+    assert 200 == rv.status_code
+
+    reader = pypdf.PdfReader(BytesIO(rv.data))
+    assert 'Jonas' == reader.get_form_text_fields()['name-0']
+    assert '/Off' != reader.get_fields()['agree-0']['/V']
+    assert '/Off' == reader.get_fields()['agree-1']['/V']
+
+
+def test_gets_text_field_values(client: Client, form):
+    rv = client.put('/form-fields', data=form)
+    assert 200 == rv.status_code
+    assert {'name-0': None, 'name-1': None} == rv.get_json(force=True)
+
+
+def test_gets_field_details(client: Client, form):
+    rv = client.put('/form-fields', query_string={'details': 'true'}, data=form)
+    assert 200 == rv.status_code
+
+    fields = rv.get_json(force=True)
+    assert 'checkbox' == fields['agree-1']['type']
+    assert [{'page': 1, 'rect': [50.0, 50.0, 300.0, 70.0]}] == fields['name-1']['widgets']
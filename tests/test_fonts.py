@@ -0,0 +1,74 @@
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from fontTools.ttLib import TTFont
+from flask.testing import Client
+
+from pdfminer import high_level
+
+from pdf_service import pdf_service
+from pdf_service import fonts
+from pdf_service.cache import MemoryCache
+
+FONT = Path(__file__).parent.joinpath('../fonts/DejaVuSansCondensed.ttf').read_bytes()
+
+HTML = b'''
+<style>@font-face { font-family: Brand; src: url(brand.ttf) }</style>
+<p style="font-family: Brand">Branded text</p>
+'''
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(fonts, 'font_files', MemoryCache(16 * 1024 * 1024))
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def generate(client: Client, font: bytes, html: bytes = HTML):
+    data = {
+        'index.html': (BytesIO(html), 'index.html', 'text/html'),
+        'brand.ttf': (BytesIO(font), 'brand.ttf', 'font/ttf'),
+    }
+    rv = client.post('/generate', data=data)
+    assert 200 == rv.status_code
+    assert 'Branded text' in high_level.extract_text(BytesIO(rv.data))
+    return rv
+
+
+def woff(font: bytes) -> bytes:
+    ttfont = TTFont(BytesIO(font))
+    ttfont.flavor = 'woff'
+    with BytesIO() as output:
+        ttfont.save(output)
+        return output.getvalue()
+
+
+def test_keeps_font_faces_to_their_document(client: Client, mocker):
+    add_font_face = mocker.spy(fonts.FontDirConfiguration, 'add_font_face')
+
+    generate(client, FONT)
+    generate(client, FONT)
+
+    first, second = [call.args[0] for call in add_font_face.call_args_list]
+    assert first is not second
+    assert fonts.font_configuration() not in (first, second)
+
+
+def test_shares_configuration_without_font_faces(client: Client, mocker):
+    add_font_face = mocker.spy(fonts.FontDirConfiguration, 'add_font_face')
+
+    generate(client, FONT, b'<p style="font-family: Brand">Branded text</p>')
+
+    assert 0 == add_font_face.call_count
+
+
+def test_decompresses_web_fonts_once(client: Client):
+    font = woff(FONT)
+
+    decoded = fonts.decode_font(font)
+
+    assert decoded[:4] != b'wOFF'
+    assert decoded is fonts.decode_font(font)
+    assert FONT[:4] == fonts.decode_font(FONT)[:4]
@@ -0,0 +1,93 @@
+import json
+import zipfile
+from io import BytesIO
+
+import fitz
+import pytest
+from flask.testing import Client
+
+from pdf_service import pdf_service
+from pdf_service import form_fill
+from pdf_service.pool import reset_render_pool
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(form_fill, 'BULK_CHUNK_SIZE', 2)
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def text(pdf: bytes):
+    return [page.get_text().strip() for page in fitz.open(stream=pdf, filetype='pdf')]
+
+
+def test_fills_a_pdf_per_record(client: Client, form):
+    records = '\n'.join(json.dumps({'name-0': f'First {n}', 'name-1': n}) for n in range(5))
+
+    rv = client.post('/form-fields/bulk', data={
+        'pdf': (BytesIO(form), 'form.pdf'),
+        'records': (BytesIO(records.encode('utf-8')), 'records.ndjson'),
+    })
+    assert 200 == rv.status_code
+
+    archive = zipfile.ZipFile(BytesIO(rv.data))
+    assert [f'record-{n}.pdf' for n in range(1, 6)] + ['report.json'] == archive.namelist()
+    assert ['First 3', '3'] == text(archive.read('record-4.pdf'))
+    assert not list(fitz.open(stream=archive.read('record-4.pdf'), filetype='pdf')[0].widgets())
+
+
+def test_fills_a_single_pdf_from_csv(client: Client, form):
+    records = 'name-0,name-1\nAlice,Ąžuolas\nBob,\n'
+
+    rv = client.post('/form-fields/bulk', query_string={'format': 'pdf'}, data={
+        'pdf': (BytesIO(form), 'form.pdf'),
+        'records': (BytesIO(records.encode('utf-8')), 'records.csv'),
+    })
+    assert 200 == rv.status_code
+    assert 'application/pdf' == rv.content_type
+    assert ['Alice', 'Ąžuolas', 'Bob', ''] == text(rv.data)
+
+
+def test_rejects_invalid_records(client: Client, form):
+    rv = client.post('/form-fields/bulk', data={'pdf': (BytesIO(form), 'form.pdf'), 'records': '{"name-0": "A"}\n[1]'})
+    assert 400 == rv.status_code
+    assert b'Record on line 2 is not a JSON object' in rv.data
+
+
+def test_rejects_invalid_pdf(client: Client):
+    rv = client.post('/form-fields/bulk', data={'pdf': (BytesIO(b'not a pdf'), 'form.pdf'), 'records': '{}'})
+    assert 400 == rv.status_code
+
+
+def test_reports_failing_records_without_failing_the_archive(client: Client, form, monkeypatch):
+    draw_values = form_fill.draw_values
+
+    def failing_draw_values(document, layout, values, *args, **kwargs):
+        if values.get('name-0') == 'fail':
+            raise ValueError('Broken record')
+        draw_values(document, layout, values, *args, **kwargs)
+
+    monkeypatch.setattr(form_fill, 'draw_values', failing_draw_values)
+    # Fork render processes with the patched module
+    reset_render_pool()
+    records = '\n'.join(json.dumps({'name-0': 'fail' if n == 2 else f'First {n}'}) for n in range(5))
+    try:
+        rv = client.post('/form-fields/bulk', data={
+            'pdf': (BytesIO(form), 'form.pdf'),
+            'records': (BytesIO(records.encode('utf-8')), 'records.ndjson'),
+        })
+    finally:
+        reset_render_pool()
+    assert 200 == rv.status_code
+
+    archive = zipfile.ZipFile(BytesIO(rv.data))
+    assert ['record-1.pdf', 'record-2.pdf', 'records-3-4.error.txt', 'record-5.pdf', 'report.json'] == archive.namelist()
+    assert b'Broken record' in archive.read('records-3-4.error.txt')
+    report = json.loads(archive.read('report.json'))
+    assert [200, 200, 500, 500, 200] == [item['status'] for item in report]
+
+
+def test_rejects_missing_content_type(client: Client):
+    rv = client.post('/form-fields/bulk', data=b'records')
+    assert 400 == rv.status_code
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+import pytest
+from PIL import Image
+
+from pdf_service import gateway, pdf_service, pool
+from pdf_service.URLFetchHandler import URLFetchHandler
+
+HTML = b'<img src="https://example.com/logo.png">'
+
+
+def png() -> bytes:
+    output = BytesIO()
+    Image.new('RGB', (10, 10), 'red').save(output, 'PNG')
+    return output.getvalue()
+
+
+def environ(query: bytes, body: bytes) -> dict:
+    return gateway._environ({
+        'method': 'POST',
+        'path': '/generate',
+        'query_string': query,
+        'headers': [(b'content-type', b'text/html')],
+    }, len(body))
+
+
+@pytest.fixture(autouse=True)
+def processes():
+    yield
+    gateway._reset_processes()
+
+
+def call(method: str, path: str, body: bytes = b'', query: str = '',
+         headers: Optional[List[Tuple[bytes, bytes]]] = None, chunk_size: int = 64 * 1024):
+    """
+    Run a request on the gateway, the body is received in chunks of `chunk_size`.
+
+    :return: The status, the headers and the body of the response.
+    """
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'path': path,
+        'query_string': query.encode('ascii'),
+        'headers': headers or [],
+        'server': ('localhost', 8080),
+    }
+    asyncio.run(gateway.app(scope, receive, send))
+
+    start = sent[0]
+    return start['status'], dict(start['headers']), b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def test_answers_health_in_gateway(mocker):
+    processes = mocker.spy(gateway, '_processes')
+    status, _, body = call('GET', '/health')
+
+    assert 200 == status
+    assert b'Healthy' == body
+    processes.assert_not_called()
+
+
+def test_generates_pdf_in_gateway_process():
+    status, headers, body = call('POST', '/generate', b'<p>Hello</p>', headers=[(b'content-type', b'text/html')])
+
+    assert 200 == status
+    assert b'application/pdf' == headers[b'content-type']
+    assert body.startswith(b'%PDF')
+
+
+def test_spools_large_bodies(mocker, tmp_path):
+    mocker.patch.object(gateway, 'SPOOL_THRESHOLD', 1024)
+    mocker.patch.object(gateway.tempfile, 'tempdir', str(tmp_path))
+    html = b'<p>' + b'Hello ' * 2000 + b'</p>'
+
+    status, _, body = call('POST', '/generate', html, headers=[(b'content-type', b'text/html')], chunk_size=1000)
+
+    assert 200 == status
+    assert body.startswith(b'%PDF')
+    # Spooled request and response bodies are removed
+    assert [] == os.listdir(tmp_path)
+
+
+def test_rejects_large_requests(monkeypatch):
+    monkeypatch.setitem(pdf_service.config, 'MAX_CONTENT_LENGTH', 10)
+    status, _, _ = call('POST', '/generate', b'<p>Hello world</p>', headers=[(b'content-type', b'text/html')])
+
+    assert 413 == status
+
+
+def test_sheds_requests_when_saturated(monkeypatch):
+    monkeypatch.setattr(gateway, '_queued', gateway.GATEWAY_PROCESSES + gateway.RENDER_QUEUE_SIZE)
+    status, headers, _ = call('POST', '/generate', b'<p>Hello</p>', headers=[(b'content-type', b'text/html')])
+
+    assert 503 == status
+    assert b'retry-after' in headers
+
+
+def test_prefetches_external_resources(mocker):
+    fetch = mocker.patch.object(URLFetchHandler, '_fetch_external', return_value={
+        'string': png(), 'mime_type': 'image/png', 'redirected_url': 'https://example.com/logo.png'})
+
+    deadline = gateway.prefetch_deadline(environ(b'isAllowExternalResources=true', HTML))
+    urls = gateway.collect_resources(environ(b'isAllowExternalResources=true', HTML), HTML, deadline.remaining())
+    prefetched = gateway.prefetch_resources(urls, deadline)
+
+    assert ['https://example.com/logo.png'] == list(prefetched)
+    fetch.assert_called_once()
+
+
+def test_skips_prefetch_without_external_resources(mocker):
+    collect = mocker.spy(gateway, 'collect_resources')
+
+    assert gateway.prefetch_deadline(environ(b'', HTML)) is None
+    status, _, _ = call('POST', '/generate', HTML, headers=[(b'content-type', b'text/html')])
+    collect.assert_not_called()
+
+
+def test_reports_queue_of_gateway(monkeypatch):
+    monkeypatch.setattr(gateway, '_queued', gateway.GATEWAY_PROCESSES + 2)
+    status, headers, body = call('GET', '/queue')
+
+    assert 200 == status
+    assert {
+        'active': gateway.GATEWAY_PROCESSES,
+        'waiting': 2,
+        'capacity': gateway.GATEWAY_PROCESSES,
+        'queue_size': gateway.RENDER_QUEUE_SIZE,
+    } == json.loads(body)
+
+
+def render_processes() -> int:
+    return pool.RENDER_PROCESSES
+
+
+def test_splits_render_processes_between_gateway_processes(monkeypatch):
+    monkeypatch.setattr(pool, 'RENDER_PROCESSES', 4)
+    monkeypatch.setattr(gateway, 'GATEWAY_PROCESSES', 2)
+
+    assert 2 == gateway._processes().submit(render_processes).result()
+
+
+def test_renders_with_prefetched_resources(mocker):
+    fetch = mocker.patch.object(URLFetchHandler, '_fetch_external')
+    prefetched = {'https://example.com/logo.png': {
+        'string': png(), 'mime_type': 'image/png', 'redirected_url': 'https://example.com/logo.png'}}
+
+    status, _, body = gateway.handle(environ(b'isAllowExternalResources=true', HTML), HTML, prefetched)
+
+    assert status.startswith('200')
+    assert body.startswith(b'%PDF')
+    fetch.assert_not_called()
@@ -1,6 +1,7 @@
 import pytest
 
 from pdf_service import pdf_service
+from pdf_service import warmup
 
 @pytest.fixture
 def client():
@@ -12,3 +13,17 @@ def test_responds(client):
     rv = client.get('/health')
     assert 200 == rv.status_code
     assert b"Healthy" == rv.data
+
+
+def test_ready_after_warm_up(client, monkeypatch):
+    monkeypatch.setattr(warmup, 'ready', warmup.threading.Event())
+    monkeypatch.setattr('pdf_service.ready', warmup.ready)
+
+    rv = client.get('/ready')
+    assert 503 == rv.status_code
+
+    warmup.warm_up()
+
+    rv = client.get('/ready')
+    assert 200 == rv.status_code
+    assert b"Ready" == rv.data
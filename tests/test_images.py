@@ -0,0 +1,79 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage, MultiDict
+
+from pdf_service import pdf_service
+from pdf_service.URLFetchHandler import URLFetchHandler
+from pdf_service.images import optimize_image
+from pdf_service.pdf_options import PdfOptions
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def photo(width: int = 4000, height: int = 3000, orientation: int = 1) -> bytes:
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x010f] = 'Camera'
+    output = BytesIO()
+    Image.effect_noise((width, height), 60).convert('RGB').save(output, 'JPEG', quality=95, exif=exif)
+    return output.getvalue()
+
+
+def test_downscales_and_strips_metadata():
+    optimized = optimize_image(photo(), dpi=150)
+
+    image = Image.open(BytesIO(optimized))
+    assert 'JPEG' == image.format
+    assert round(11.7 * 150) == max(image.size)
+    assert 0 == len(image.getexif())
+
+
+def test_applies_orientation():
+    image = Image.open(BytesIO(optimize_image(photo(orientation=6), dpi=150)))
+    assert image.width < image.height
+
+
+def test_keeps_images_that_dont_get_smaller():
+    output = BytesIO()
+    Image.new('RGB', (10, 10)).save(output, 'PNG')
+
+    assert optimize_image(output.getvalue()) is None
+    assert optimize_image(b'<svg xmlns="http://www.w3.org/2000/svg"/>') is None
+    assert optimize_image(b'\x89PNG\r\n\x1a\nbroken') is None
+
+
+def test_optimizes_fetched_images():
+    data = photo()
+    file = FileStorage(BytesIO(data), 'photo.jpg', content_type='application/octet-stream')
+
+    with URLFetchHandler(MultiDict({'photo.jpg': file}), pdf_options=PdfOptions(optimize_images=True)) as url_fetcher:
+        result = url_fetcher('/photo.jpg')
+
+    assert 'image/jpeg' == result['mime_type']
+    assert len(result['string']) < len(data)
+    # Uploaded files can be fetched again
+    assert 0 == file.stream.tell()
+
+
+def test_generate_with_optimized_images(client):
+    def generate(query_string=None) -> bytes:
+        rv = client.post('/generate', query_string=query_string, data={
+            'index.html': (BytesIO(b'<img src="photo.jpg" style="width: 5cm">'), 'index.html', 'text/html'),
+            'photo.jpg': (BytesIO(photo(2000, 1500)), 'photo.jpg', 'image/jpeg'),
+        })
+        assert 200 == rv.status_code
+        return rv.data
+
+    assert len(generate({'optimize-images': 'true', 'dpi': '150', 'jpeg-quality': '80'})) < len(generate()) / 2
+
+
+def test_invalid_pdf_options(client):
+    rv = client.post('/generate?jpeg-quality=100', data='<p>Hello</p>', content_type='text/html')
+    assert 400 == rv.status_code
+    assert b'Invalid "jpeg-quality" option' in rv.data
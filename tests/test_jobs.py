@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from flask.testing import Client
+
+from pdfminer import high_level
+
+from pdf_service import pdf_service
+from pdf_service import jobs
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_DIR', str(tmp_path))
+    with pdf_service.test_client() as client:
+        yield client
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    calls = []
+
+    def do_POST(self):
+        WebhookHandler.calls.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def webhook():
+    WebhookHandler.calls = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), WebhookHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/done'
+    httpd.shutdown()
+
+
+def wait_for(client: Client, url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        rv = client.get(url)
+        if rv.status_code != 202 or time.monotonic() > deadline:
+            return rv
+        time.sleep(0.1)
+
+
+def test_renders_job(client: Client):
+    data = {
+        'index.html': (BytesIO(b'<p>Job document <img src="test.png"/></p>'), 'index.html', 'text/html'),
+        'test.png': (
+            Path(__file__).parent.joinpath('../test-data/assets/test.png').open('rb'),
+            'test.png',
+            'image/png'
+        ),
+    }
+
+    rv = client.post('/jobs', data=data)
+    assert 202 == rv.status_code
+    assert rv.json['status'] in ('queued', 'running')
+    assert f'/jobs/{rv.json["id"]}' == rv.headers['Location']
+
+    rv = wait_for(client, rv.headers['Location'])
+    assert 200 == rv.status_code
+    assert 'application/pdf' == rv.content_type
+    assert 'Job document' in high_level.extract_text(BytesIO(rv.data))
+
+
+def test_reports_failed_job(client: Client):
+    rv = client.post('/jobs', data='<p><img src="test.png"/></p>', content_type='text/html')
+    assert 202 == rv.status_code
+
+    rv = wait_for(client, rv.headers['Location'])
+    assert 200 == rv.status_code
+    assert 'failed' == rv.json['status']
+    assert 400 == rv.json['error_status']
+    assert 'Referenced local file (test.png) in basic mode' in rv.json['error']
+
+
+def test_calls_webhook(client: Client, webhook, monkeypatch):
+    monkeypatch.setattr(jobs, 'WEBHOOK_ALLOWED_HOSTS', ['127.0.0.1'])
+    rv = client.post('/jobs', query_string={'webhook': webhook}, data='<p>Done</p>', content_type='text/html')
+    job_id = rv.json['id']
+
+    wait_for(client, rv.headers['Location'])
+    deadline = time.monotonic() + 10
+    while not WebhookHandler.calls and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    assert job_id == WebhookHandler.calls[0]['id']
+    assert 'done' == WebhookHandler.calls[0]['status']
+
+
+@pytest.mark.parametrize('webhook', [
+    'http://127.0.0.1:8080/done',
+    'http://localhost/done',
+    'http://169.254.169.254/latest/meta-data',
+    'http://10.0.0.1/done',
+    'http://[::1]/done',
+    'ftp://example.com/done',
+    'http:///done',
+])
+def test_rejects_internal_webhooks(client: Client, webhook):
+    rv = client.post('/jobs', headers={'X-Webhook': webhook}, data='<p>Test</p>', content_type='text/html')
+    assert 400 == rv.status_code
+    assert 'Invalid "webhook" parameter' in rv.text
+
+
+def test_rejects_webhooks_to_other_hosts(client: Client, monkeypatch):
+    monkeypatch.setattr(jobs, 'WEBHOOK_ALLOWED_HOSTS', ['hooks.example.com'])
+
+    rv = client.post('/jobs', query_string={'webhook': 'http://example.com/done'},
+                     data='<p>Test</p>', content_type='text/html')
+    assert 400 == rv.status_code
+    assert 'The host example.com is not allowed' in rv.text
+
+
+def test_stops_job_after_timeout(tmp_path, monkeypatch):
+    def render_forever(html, assets, options):
+        while True:
+            time.sleep(0.01)
+
+    monkeypatch.setattr(jobs, 'JOB_TIMEOUT', 0.2)
+    monkeypatch.setattr(jobs, 'render_document', render_forever)
+    jobs._update_state(str(tmp_path), id='0' * 32, status='queued', created=time.time())
+
+    jobs.run_job(str(tmp_path), b'<p>Test</p>', {}, None)
+
+    state = jobs._read_state(str(tmp_path))
+    assert 'failed' == state['status']
+    assert 504 == state['error_status']
+    assert 'Rendering exceeded the deadline of 0.2 seconds' == state['error']
+
+
+def test_rejects_jobs_when_queue_is_full(client: Client, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_QUEUE_SIZE', 0)
+
+    rv = client.post('/jobs', data='<p>Test</p>', content_type='text/html')
+    assert 503 == rv.status_code
+    assert 'Retry-After' in rv.headers
+
+
+def test_unknown_job(client: Client):
+    assert 404 == client.get('/jobs/0123456789abcdef0123456789abcdef').status_code
+    assert 404 == client.get('/jobs/..').status_code
+
+
+def test_ignores_results_of_removed_jobs(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(jobs, '_pending', 1)
+    future = Future()
+    future.set_result(None)
+
+    jobs._job_finished(str(tmp_path / 'removed'), None, future)
+
+    assert 0 == jobs._pending
+    assert 'Failed to record the result of job removed' in caplog.text
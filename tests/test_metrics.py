@@ -0,0 +1,51 @@
+import pytest
+from flask.testing import Client
+from prometheus_client import REGISTRY
+
+from pdf_service import pdf_service
+from pdf_service.metrics import stage
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_records_stages_and_requests(client: Client):
+    renders = sample('pdf_service_stage_duration_seconds_count', stage='render')
+    requests = sample('pdf_service_request_duration_seconds_count', method='POST', endpoint='/generate', status='200')
+    fetches = sample('pdf_service_url_fetches_total', kind='data')
+
+    rv = client.post('/generate', data='<p>Metrics <img src="data:image/gif;base64,R0lGODlhAQABAAAAACw="/></p>', content_type='text/html')
+    assert 200 == rv.status_code
+
+    assert renders + 1 == sample('pdf_service_stage_duration_seconds_count', stage='render')
+    assert requests + 1 == sample('pdf_service_request_duration_seconds_count', method='POST', endpoint='/generate', status='200')
+    assert fetches + 1 == sample('pdf_service_url_fetches_total', kind='data')
+    assert sample('pdf_service_pages_count') > 0
+
+
+def test_counts_stage_errors():
+    errors = sample('pdf_service_stage_errors_total', stage='test')
+
+    with pytest.raises(ValueError):
+        with stage('test'):
+            raise ValueError()
+
+    assert errors + 1 == sample('pdf_service_stage_errors_total', stage='test')
+    assert sample('pdf_service_stage_duration_seconds_count', stage='test') > 0
+
+
+def test_metrics_endpoint(client: Client):
+    client.get('/health')
+
+    rv = client.get('/metrics')
+    assert 200 == rv.status_code
+    assert rv.content_type.startswith('text/plain')
+    assert b'pdf_service_request_duration_seconds_count{endpoint="/health",method="GET",status="200"}' in rv.data
+    assert b'pdf_service_renders_in_flight' in rv.data
@@ -3,6 +3,7 @@ from pathlib import Path
 import pytest
 from flask.testing import Client
 
+import pypdf
 from pdfminer import high_level
 
 from pdf_service import pdf_service
@@ -102,3 +103,25 @@ def test_error_when_internal_ressource_is_missing(client: Client):
     rv = client.post('/generate', data=data)
     assert 400 == rv.status_code
     assert b'Missing file (test.png) required by html file' in rv.data
+
+
+def test_combines_multiple_index_html_parts(client: Client):
+    data = {
+        'index.html': [
+            (BytesIO(bytes('<p>Cover letter</p>', 'utf8')), 'index.html', 'text/html'),
+            (BytesIO(bytes('<p>Invoice <img src="test.png"/></p>', 'utf8')), 'index.html', 'text/html'),
+        ],
+        'test.png': (
+            Path(__file__).parent.joinpath('../test-data/assets/test.png').open('rb'),
+            'test.png',
+            'image/png'
+        )
+    }
+
+    rv = client.post('/generate', data=data)
+    assert 200 == rv.status_code
+
+    reader = pypdf.PdfReader(BytesIO(rv.data))
+    assert 2 == len(reader.pages)
+    assert 'Cover letter' in reader.pages[0].extract_text()
+    assert 'Invoice' in reader.pages[1].extract_text()
@@ -0,0 +1,56 @@
+from io import BytesIO
+
+import pypdf
+import pytest
+
+from pdf_service import pdf_service
+from pdf_service.postprocess import postprocess
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def pdf():
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(200, 300)
+    writer.add_blank_page(200, 300)
+    with BytesIO() as output:
+        writer.write(output)
+        return output.getvalue()
+
+
+def test_returns_input_without_transforms(pdf):
+    assert postprocess(pdf) is pdf
+
+
+def test_applies_all_transforms_in_one_pass(pdf):
+    result = postprocess(pdf, rotation=90, password='secret', metadata={'/Title': 'Invoice'})
+
+    reader = pypdf.PdfReader(BytesIO(result))
+    assert reader.is_encrypted
+    reader.decrypt('secret')
+    assert [90, 90] == [page.rotation for page in reader.pages]
+    assert 'Invoice' == reader.metadata.title
+
+
+def test_refuses_to_encrypt_encrypted_pdf(pdf):
+    with pytest.raises(Exception, match='already encrypted'):
+        postprocess(postprocess(pdf, password='first'), password='second')
+
+
+def test_generate_rotates_while_writing(client):
+    rv = client.post('/generate', data="<p>Rotated</p>", content_type="text/html", query_string={'rotate': 270})
+    assert 200 == rv.status_code
+
+    reader = pypdf.PdfReader(BytesIO(rv.data))
+    assert 270 == reader.pages[0].rotation
+
+
+def test_generate_rejects_invalid_rotation(client):
+    rv = client.post('/generate', data="<p>Rotated</p>", content_type="text/html", query_string={'rotate': 45})
+    assert 500 == rv.status_code
+    assert b'Invalid "rotate" parameter' in rv.data
@@ -0,0 +1,127 @@
+import time
+
+from weasyprint import HTML
+
+from pdf_service.prefetch import collect_urls, css_urls, prefetch
+from pdf_service.URLFetchHandler import URLFetchHandler
+
+
+def test_collects_external_references():
+    html = HTML(string="""
+        <link rel="stylesheet" href="https://cdn.example.com/style.css">
+        <style>@import "theme.css"; body { background: url('/bg.png') }</style>
+        <img src="logo.png"><img src="data:image/png;base64,AAAA">
+        <p style="background-image: url(https://other.example.com/p.png)">Text</p>
+        <a href="https://example.com/not-fetched">Link</a>
+    """, base_url='https://example.com/invoice/')
+
+    assert collect_urls(html) == [
+        'https://cdn.example.com/style.css',
+        'https://example.com/invoice/theme.css',
+        'https://example.com/bg.png',
+        'https://example.com/invoice/logo.png',
+        'https://other.example.com/p.png',
+    ]
+
+
+def test_ignores_internal_references():
+    html = HTML(string='<img src="logo.png">', base_url='/')
+
+    assert collect_urls(html) == []
+
+
+def test_css_urls_resolve_against_stylesheet():
+    assert css_urls('@font-face { src: url("fonts/a.woff") }', 'https://cdn.example.com/css/main.css') == \
+        ['https://cdn.example.com/css/fonts/a.woff']
+
+
+def fake_fetch(bodies, delay=0.0):
+    calls = []
+
+    def fetch(url, timeout, budget):
+        calls.append(url)
+        time.sleep(delay)
+        body, mime_type = bodies[url]
+        budget.take(url, len(body))
+        return {'string': body, 'mime_type': mime_type, 'redirected_url': url}
+
+    return fetch, calls
+
+
+def test_prefetch_follows_stylesheet_references():
+    fetch, calls = fake_fetch({
+        'https://cdn.example.com/main.css': (b'p { background: url(bg.png) }', 'text/css'),
+        'https://cdn.example.com/bg.png': (b'png', 'image/png'),
+    })
+
+    results = prefetch(['https://cdn.example.com/main.css'], fetch)
+
+    assert set(results) == {'https://cdn.example.com/main.css', 'https://cdn.example.com/bg.png'}
+
+
+def test_prefetch_fetches_concurrently():
+    urls = [f'https://cdn.example.com/{i}.png' for i in range(8)]
+    fetch, _ = fake_fetch({url: (b'png', 'image/png') for url in urls}, delay=0.2)
+
+    start = time.monotonic()
+    results = prefetch(urls, fetch, connections=8)
+
+    assert len(results) == 8
+    assert time.monotonic() - start < 1
+
+
+def test_prefetch_respects_byte_budget():
+    urls = [f'https://cdn.example.com/{i}.png' for i in range(4)]
+    fetch, _ = fake_fetch({url: (b'0123456789', 'image/png') for url in urls})
+
+    results = prefetch(urls, fetch, connections=1, max_bytes=25)
+
+    assert len(results) == 2
+
+
+def test_prefetch_budget_bounds_fetches_in_flight():
+    read = []
+
+    def fetch(url, timeout, budget):
+        for _ in range(10):
+            budget.take(url, 10)
+            read.append(10)
+            time.sleep(0.01)
+        return {'string': b'0' * 100, 'mime_type': 'image/png', 'redirected_url': url}
+
+    urls = [f'https://cdn.example.com/{i}.png' for i in range(4)]
+    results = prefetch(urls, fetch, connections=4, max_bytes=150)
+
+    assert len(results) <= 1
+    assert sum(read) <= 150
+
+
+def test_prefetch_respects_timeout():
+    fetch, _ = fake_fetch({'https://cdn.example.com/slow.png': (b'png', 'image/png')}, delay=1)
+
+    start = time.monotonic()
+    results = prefetch(['https://cdn.example.com/slow.png'], fetch, timeout=0.1)
+
+    assert results == {}
+    assert time.monotonic() - start < 0.5
+
+
+def test_handler_serves_prefetched_results(mocker):
+    fetch = mocker.patch.object(URLFetchHandler, '_fetch_external',
+                                return_value={'string': b'png', 'mime_type': 'image/png'})
+
+    with URLFetchHandler(isAllowExternal=True) as url_fetcher:
+        url_fetcher.prefetch(['https://cdn.example.com/logo.png'])
+        result = url_fetcher('https://cdn.example.com/logo.png')
+
+    assert result['string'] == b'png'
+    assert fetch.call_count == 1
+
+
+def test_handler_does_not_prefetch_when_external_is_forbidden(mocker):
+    fetch = mocker.patch.object(URLFetchHandler, '_fetch_external')
+
+    with URLFetchHandler() as url_fetcher:
+        url_fetcher.prefetch(['https://cdn.example.com/logo.png'])
+
+    assert fetch.call_count == 0
@@ -0,0 +1,76 @@
+import zipfile
+from io import BytesIO
+
+import fitz
+import pytest
+import weasyprint.layout.page
+from PIL import Image
+
+from pdf_service import pdf_service
+from pdf_service.preview import preview_cache
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def pdf(pages: int) -> bytes:
+    document = fitz.open()
+    for number in range(pages):
+        document.new_page().insert_text((72, 72), f'Page {number + 1}')
+    return document.tobytes()
+
+
+def test_previews_first_page_of_pdf(client):
+    rv = client.post('/preview', data=pdf(3), content_type='application/pdf')
+
+    assert 200 == rv.status_code
+    assert 'image/png' == rv.content_type
+    # A4 at 72 DPI
+    assert (595, 842) == Image.open(BytesIO(rv.data)).size
+
+
+def test_previews_pages_as_webp(client):
+    rv = client.post('/preview?pages=2-3&format=webp&dpi=36', data={'pdf': (BytesIO(pdf(3)), 'document.pdf')})
+
+    assert 200 == rv.status_code
+    archive = zipfile.ZipFile(BytesIO(rv.data))
+    assert ['page-2.webp', 'page-3.webp'] == archive.namelist()
+    assert 'WEBP' == Image.open(BytesIO(archive.read('page-2.webp'))).format
+
+
+def test_previews_html(client):
+    rv = client.post('/preview?dpi=50', data='<p>Hello World!</p>', content_type='text/html')
+
+    assert 200 == rv.status_code
+    assert 'image/png' == rv.content_type
+
+
+def test_lays_out_previewed_pages_only(client, mocker):
+    html = '<p style="break-after: page">Page</p>' * 50
+    remake_page = mocker.spy(weasyprint.layout.page, 'remake_page')
+
+    rv = client.post('/preview?partial=true&pages=2', data=html, content_type='text/html')
+
+    assert 200 == rv.status_code
+    assert remake_page.call_count < 10
+
+
+def test_caches_previews(client, mocker):
+    cache_set = mocker.spy(preview_cache, 'set')
+    document = pdf(2)
+
+    first = client.post('/preview', data=document, content_type='application/pdf')
+    second = client.post('/preview', data=document, content_type='application/pdf')
+
+    assert first.data == second.data
+    assert 1 == cache_set.call_count
+
+
+def test_invalid_preview_parameters(client):
+    assert 400 == client.post('/preview?pages=5', data=pdf(1), content_type='application/pdf').status_code
+    assert 400 == client.post('/preview?pages=0', data=pdf(1), content_type='application/pdf').status_code
+    assert 400 == client.post('/preview?format=gif', data=pdf(1), content_type='application/pdf').status_code
+    assert 400 == client.post('/preview', data=b'no pdf', content_type='application/pdf').status_code
@@ -0,0 +1,94 @@
+import os
+from io import BytesIO
+
+import pypdf
+import pytest
+from flask.testing import Client
+
+from pdf_service import pdf_service
+from pdf_service import form_fill, spool
+from pdf_service.postprocess import postprocess
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Spool everything to disk
+    monkeypatch.setattr(spool, 'SPOOL_THRESHOLD', 1)
+    monkeypatch.setattr(spool, 'UPLOAD_SPOOL_THRESHOLD', 1)
+    with pdf_service.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def pdf():
+    writer = pypdf.PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(200, 300)
+    with BytesIO() as output:
+        writer.write(output)
+        return output.getvalue()
+
+
+def test_postprocess_writes_file_to_file(pdf):
+    target = spool.spooled()
+    result = postprocess(BytesIO(pdf), rotation=180, target=target)
+
+    assert result is target
+    assert 0 == target.tell()
+    assert [180, 180, 180] == [page.rotation for page in pypdf.PdfReader(target).pages]
+
+
+def test_spooled_file_has_path_on_disk():
+    target = spool.spooled(4)
+    target.write(b'pdf')
+    assert spool.file_path(target) is None
+
+    target.write(b' on disk')
+    path = spool.file_path(target)
+    with open(path, 'rb') as f:
+        assert b'pdf on disk' == f.read()
+    target.close()
+    assert not os.path.exists(path)
+
+
+def test_form_fields_open_spooled_pdf_by_path(client: Client, pdf, mocker):
+    fitz_open = mocker.spy(form_fill.fitz, 'open')
+
+    rv = client.put('/form-fields', query_string={'details': 'true'}, data=pdf, content_type='application/pdf')
+    assert 200 == rv.status_code
+    assert b'{}' == rv.data.strip()
+    assert isinstance(fitz_open.call_args.args[0], str)
+
+    rv = client.post('/form-fields', data={'pdf': (BytesIO(pdf), 'form.pdf')}, content_type='multipart/form-data')
+    assert 200 == rv.status_code
+    assert 3 == len(pypdf.PdfReader(BytesIO(rv.data)).pages)
+    assert isinstance(fitz_open.call_args_list[1].args[0], str)
+
+
+def test_generate_streams_pdf(client: Client):
+    rv = client.post('/generate', data='<p>Streamed</p>', content_type='text/html', buffered=False)
+    assert 200 == rv.status_code
+    assert rv.is_streamed
+    assert 'attachment; filename="generated.pdf"' == rv.headers['Content-Disposition']
+
+    data = rv.get_data()
+    rv.close()
+    assert int(rv.headers['Content-Length']) == len(data)
+    assert 1 == len(pypdf.PdfReader(BytesIO(data)).pages)
+
+
+def test_encrypt_streams_pdf(client: Client, pdf):
+    rv = client.post('/encrypt', data=pdf, query_string={'password': 'secret'}, content_type='application/pdf')
+    assert 200 == rv.status_code
+    assert int(rv.headers['Content-Length']) == len(rv.data)
+
+    reader = pypdf.PdfReader(BytesIO(rv.data))
+    assert reader.is_encrypted
+    reader.decrypt('secret')
+    assert 3 == len(reader.pages)
+
+
+def test_generate_encrypts_spooled_pdf(client: Client):
+    rv = client.post('/generate', data='<p>Secret</p>', content_type='text/html', query_string={'password': 'secret'})
+    assert 200 == rv.status_code
+    assert pypdf.PdfReader(BytesIO(rv.data)).is_encrypted
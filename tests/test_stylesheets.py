@@ -0,0 +1,98 @@
+import os
+from io import BytesIO
+
+import pytest
+from flask.testing import Client
+
+from pdfminer import high_level
+
+from pdf_service import pdf_service
+from pdf_service import stylesheets
+
+
+@pytest.fixture
+def css_path(tmp_path, monkeypatch):
+    tmp_path.joinpath('common.css').write_text('@page { size: A4; margin: 10px }')
+    tmp_path.joinpath('invoice').mkdir()
+    tmp_path.joinpath('invoice', 'invoice.css').write_text('p::after { content: " (invoice)" }')
+    monkeypatch.setattr(stylesheets, 'CSS_PATH', str(tmp_path))
+    monkeypatch.setattr(stylesheets, '_profiles', {})
+    monkeypatch.setattr(stylesheets, '_parsed', stylesheets.OrderedDict())
+    return tmp_path
+
+
+@pytest.fixture
+def client():
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def generate_text(client: Client, style: str = None) -> str:
+    rv = client.post('/generate', query_string={'style': style} if style else None,
+                     data='<p>Total</p>', content_type='text/html')
+    assert 200 == rv.status_code
+    return high_level.extract_text(BytesIO(rv.data))
+
+
+def test_applies_style_profile(client: Client, css_path):
+    assert '(invoice)' not in generate_text(client)
+    assert 'Total (invoice)' in generate_text(client, 'invoice')
+
+
+def test_error_for_unknown_style_profile(client: Client, css_path):
+    rv = client.post('/generate?style=receipt', data='<p>Total</p>', content_type='text/html')
+    assert 400 == rv.status_code
+    assert b'Unknown "style" parameter style=receipt' in rv.data
+
+    rv = client.post('/generate?style=../invoice', data='<p>Total</p>', content_type='text/html')
+    assert 400 == rv.status_code
+
+
+def test_reloads_changed_stylesheets(client: Client, css_path):
+    generate_text(client, 'invoice')
+
+    stylesheet = css_path.joinpath('invoice', 'invoice.css')
+    stylesheet.write_text('p::after { content: " (changed)" }')
+    mtime = stylesheet.stat().st_mtime_ns + 1_000_000_000
+    os.utime(stylesheet, ns=(mtime, mtime))
+
+    assert 'Total (changed)' in generate_text(client, 'invoice')
+
+
+def test_parses_profiles_once(client: Client, css_path, mocker):
+    stylesheets.load_style_profiles()
+    css = mocker.spy(stylesheets.weasyprint, 'CSS')
+
+    generate_text(client, 'invoice')
+    generate_text(client, 'invoice')
+
+    assert 0 == css.call_count
+
+
+def test_parses_uploaded_stylesheets_once(client: Client, css_path, mocker):
+    css = mocker.spy(stylesheets.weasyprint, 'CSS')
+
+    for _ in range(2):
+        data = {
+            'index.html': (BytesIO(b'<link rel="stylesheet" href="brand.css"><p>Total</p>'), 'index.html', 'text/html'),
+            'brand.css': (BytesIO(b'p::before { content: "Brand: " }'), 'brand.css', 'text/css'),
+        }
+        rv = client.post('/generate', data=data)
+        assert 200 == rv.status_code
+        assert 'Brand: Total' in high_level.extract_text(BytesIO(rv.data))
+
+    assert 1 == css.call_count
+
+
+def test_applies_pdf_options_of_style_profile(client: Client, css_path, mocker):
+    css_path.joinpath('pdf.json').write_text('{"jpeg_quality": 70, "dpi": 300}')
+    css_path.joinpath('invoice', 'pdf.json').write_text('{"optimize_images": true, "dpi": 150}')
+    write_pdf = mocker.spy(stylesheets.weasyprint.Document, 'write_pdf')
+
+    generate_text(client, 'invoice')
+    options = write_pdf.call_args.kwargs
+    assert (True, 70, 150) == (options['optimize_images'], options['jpeg_quality'], options['dpi'])
+
+    rv = client.post('/generate?style=invoice&dpi=96', data='<p>Total</p>', content_type='text/html')
+    assert 200 == rv.status_code
+    assert 96 == write_pdf.call_args.kwargs['dpi']
@@ -0,0 +1,166 @@
+import threading
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from flask.testing import Client
+
+from pdfminer import high_level
+
+from pdf_service import pdf_service
+from pdf_service import stylesheets, templates
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(templates, 'TEMPLATE_DIR', str(tmp_path))
+    monkeypatch.setattr(templates, '_bundles', templates.OrderedDict())
+    monkeypatch.setattr(stylesheets, '_parsed', stylesheets.OrderedDict())
+    with pdf_service.test_client() as client:
+        yield client
+
+
+def register(client: Client, template_id='invoice', html='<p>Invoice {{ number }} <img src="logo.png"/></p>', **extra):
+    data = {
+        'index.html': (BytesIO(bytes(html, 'utf8')), 'index.html', 'text/html'),
+        'logo.png': (
+            Path(__file__).parent.joinpath('../test-data/assets/test.png').open('rb'),
+            'logo.png',
+            'image/png'
+        ),
+        **extra,
+    }
+    return client.put(f'/templates/{template_id}', data=data)
+
+
+def test_registers_template(client: Client):
+    rv = register(client)
+    assert 201 == rv.status_code
+    assert ['logo.png'] == rv.json['assets']
+
+    rv = client.get('/templates/invoice')
+    assert 200 == rv.status_code
+    assert 'invoice' == rv.json['id']
+
+
+def test_renders_template_with_json_data(client: Client):
+    register(client)
+
+    rv = client.post('/templates/invoice/render', json={'number': 'INV-42'})
+    assert 200 == rv.status_code
+    assert 'application/pdf' == rv.content_type
+    assert 'Invoice INV-42' in high_level.extract_text(BytesIO(rv.data))
+
+
+def test_escapes_data(client: Client):
+    register(client, html='<p>{{ name }}</p>')
+
+    rv = client.post('/templates/invoice/render', json={'name': '<b>Bold</b>'})
+    assert 200 == rv.status_code
+    assert '<b>Bold</b>' in high_level.extract_text(BytesIO(rv.data))
+
+
+def test_applies_preparsed_stylesheets(client: Client, mocker):
+    register(client, html='<p>Styled</p>', **{
+        'style.css': (BytesIO(b'p { color: red }'), 'style.css', 'text/css'),
+        'stylesheets': 'style.css',
+    })
+    css = mocker.spy(stylesheets.weasyprint, 'CSS')
+
+    client.post('/templates/invoice/render', json={})
+    client.post('/templates/invoice/render', json={})
+
+    assert 1 == len(templates.load_bundle('invoice').stylesheets)
+    assert 1 == css.call_count
+
+
+def test_reloads_replaced_template(client: Client):
+    register(client, html='<p>First</p>')
+    client.post('/templates/invoice/render', json={})
+    register(client, html='<p>Second</p>')
+
+    rv = client.post('/templates/invoice/render', json={})
+    assert 'Second' in high_level.extract_text(BytesIO(rv.data))
+
+
+def test_evicts_least_recently_used_bundles(client: Client, monkeypatch):
+    monkeypatch.setattr(templates, 'TEMPLATE_CACHE_SIZE', 1)
+    register(client, template_id='first')
+    register(client, template_id='second')
+
+    templates.load_bundle('first')
+    templates.load_bundle('second')
+
+    assert ['second'] == list(templates._bundles)
+
+
+def test_replaces_template_atomically(client: Client):
+    register(client, html='<p>First</p>')
+    replaced = threading.Event()
+    statuses = []
+
+    def replace():
+        try:
+            with pdf_service.test_client() as other:
+                for _ in range(20):
+                    statuses.append(register(other, html='<p>Second</p>').status_code)
+        finally:
+            replaced.set()
+
+    thread = threading.Thread(target=replace)
+    thread.start()
+    while not replaced.is_set():
+        templates._bundles.clear()
+        templates.load_bundle('invoice')
+    thread.join()
+
+    assert [200] * 20 == statuses
+    # Only the current and the replaced revision are kept
+    assert 2 == len(list(Path(templates.TEMPLATE_DIR, '.revisions', 'invoice').iterdir()))
+
+
+def test_concurrent_registrations_keep_current_revision(client: Client):
+    def replace():
+        with pdf_service.test_client() as other:
+            for _ in range(10):
+                register(other, html='<p>Second</p>')
+
+    threads = [threading.Thread(target=replace) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    path = Path(templates.TEMPLATE_DIR, 'invoice')
+    assert path.resolve().is_dir()
+    assert 200 == client.get('/templates/invoice').status_code
+
+
+def test_deletes_template(client: Client):
+    register(client)
+
+    assert 204 == client.delete('/templates/invoice').status_code
+    assert 404 == client.post('/templates/invoice/render', json={}).status_code
+
+
+def test_error_for_unknown_template(client: Client):
+    rv = client.post('/templates/unknown/render', json={})
+    assert 404 == rv.status_code
+
+
+def test_error_for_invalid_template(client: Client):
+    rv = register(client, html='<p>{% if %}</p>')
+    assert 400 == rv.status_code
+    assert b'Invalid template' in rv.data
+
+
+def test_error_for_invalid_template_id(client: Client):
+    rv = client.post('/templates/..invoice/render', json={})
+    assert 400 == rv.status_code
+
+
+def test_error_for_non_object_data(client: Client):
+    register(client)
+
+    rv = client.post('/templates/invoice/render', json=[1, 2])
+    assert 400 == rv.status_code
@@ -0,0 +1,85 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pdf_service.cache import Cache, MemoryCache
+from pdf_service.url_cache import URLCache
+
+
+class AssetHandler(BaseHTTPRequestHandler):
+    requests = []
+    headers_by_path = {
+        '/fresh.css': {'Cache-Control': 'max-age=3600'},
+        '/etag.css': {'ETag': '"v1"', 'Cache-Control': 'no-cache'},
+        '/no-store.css': {'Cache-Control': 'no-store'},
+        '/private.css': {'Cache-Control': 'private, max-age=3600'},
+    }
+
+    def do_GET(self):
+        AssetHandler.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/etag.css' and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/css')
+        for name, value in self.headers_by_path[self.path].items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(b'p { color: red }')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    AssetHandler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), AssetHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+
+@pytest.fixture
+def url_cache():
+    return URLCache(Cache(MemoryCache(1024 * 1024)))
+
+
+def test_serves_fresh_responses_from_cache(server, url_cache):
+    first, first_status = url_cache.fetch(server + '/fresh.css')
+    second, second_status = url_cache.fetch(server + '/fresh.css')
+
+    assert (first_status, second_status) == ('miss', 'hit')
+    assert second['string'] == b'p { color: red }'
+    assert second['mime_type'] == 'text/css'
+    assert len(AssetHandler.requests) == 1
+    assert (url_cache.hits, url_cache.misses) == (1, 1)
+
+
+def test_revalidates_with_etag(server, url_cache):
+    url_cache.fetch(server + '/etag.css')
+    result, status = url_cache.fetch(server + '/etag.css')
+
+    assert status == 'revalidated'
+    assert result['string'] == b'p { color: red }'
+    assert AssetHandler.requests[-1] == ('/etag.css', '"v1"')
+
+
+def test_does_not_store_no_store_responses(server, url_cache):
+    url_cache.fetch(server + '/no-store.css')
+    _, status = url_cache.fetch(server + '/no-store.css')
+
+    assert status == 'miss'
+    assert len(AssetHandler.requests) == 2
+
+
+def test_does_not_store_private_responses(server, url_cache):
+    url_cache.fetch(server + '/private.css')
+    _, status = url_cache.fetch(server + '/private.css')
+
+    assert status == 'miss'
+    assert len(AssetHandler.requests) == 2